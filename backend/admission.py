@@ -0,0 +1,135 @@
+"""
+Control de carga para las agregaciones pesadas sobre gestiones.
+
+- SingleFlight: cálculos idénticos en curso se hacen una sola vez; quienes
+  llegan mientras tanto esperan el mismo resultado (o la misma excepción).
+- Gate: como mucho `limit` cálculos en paralelo y `queue` esperando; un
+  request que no consigue lugar en `max_wait` segundos, o que encuentra la
+  cola llena, recibe Overloaded (503) enseguida. Así una ráfaga no satura la
+  base y quedan conexiones para autocompletado, snapshots, etc.
+
+Los límites son por worker de uvicorn. Cada consulta pesada puede usar hasta
+DB_REQUEST_PARALLELISM conexiones (gather_db): el límite se acota para que
+limit × paralelismo quede por debajo de DB_POOL_SIZE.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+from . import config
+from .db import request_parallelism
+
+log = logging.getLogger(__name__)
+
+class Overloaded(RuntimeError):
+    """No hay lugar para otra consulta pesada (cola llena o espera máxima agotada)."""
+
+# ---------------------------- single-flight ----------------------------
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats = {"leaders": 0, "followers": 0}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Resultado de `await fn()`, compartido con los llamados concurrentes de la
+        misma `key`. El cálculo corre en su propia tarea: si el request que lo
+        lanzó se cancela, los demás siguen esperando el mismo resultado.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            self._stats["leaders" if leader else "followers"] += 1
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._settle(key, future, t))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _settle(self, key: Hashable, future: Future, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        with self._lock:
+            self._inflight.pop(key, None)
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "inflight": len(self._inflight)}
+
+# ---------------------------- admisión ----------------------------
+
+class Gate:
+    """Semáforo con cola acotada y espera máxima; se usa con `async with gate:`."""
+
+    def __init__(self, name: str, limit: int, queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait = max_wait
+        self._sem = asyncio.Semaphore(limit)
+        self._waiting = 0
+        self._active = 0
+        self._stats = {"admitted": 0, "rejected": 0, "timeouts": 0, "wait_ms_max": 0.0}
+
+    async def __aenter__(self):
+        # _waiting se cuenta antes del primer await: así se ve también a los que aún no tomaron el semáforo
+        if self._active + self._waiting >= self.limit + self.queue:
+            self._stats["rejected"] += 1
+            raise Overloaded(f"Demasiadas consultas pesadas en curso ({self.name}: {self.limit} activas, "
+                             f"{self._waiting} en cola)")
+        self._waiting += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise Overloaded(f"Sin lugar para consultas pesadas tras {self.max_wait}s ({self.name})") from None
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        self._stats["admitted"] += 1
+        self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], round((time.perf_counter() - t0) * 1000, 3))
+        return self
+
+    async def __aexit__(self, *exc):
+        self._active -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "limit": self.limit, "queue": self.queue, "active": self._active,
+                "waiting": self._waiting}
+
+def heavy_limit() -> int:
+    """HEAVY_QUERY_LIMIT, reducido si con el paralelismo por request ocuparía todo el pool."""
+    fit = max((config.DB_POOL_SIZE - 1) // request_parallelism(), 1)
+    if config.HEAVY_QUERY_LIMIT > fit:
+        log.warning("HEAVY_QUERY_LIMIT=%d x %d conexiones por request no entra en DB_POOL_SIZE=%d; se usa %d",
+                    config.HEAVY_QUERY_LIMIT, request_parallelism(), config.DB_POOL_SIZE, fit)
+        return fit
+    return max(config.HEAVY_QUERY_LIMIT, 1)
+
+flights = SingleFlight()
+heavy = Gate("heavy", heavy_limit(), config.HEAVY_QUERY_QUEUE, config.HEAVY_QUERY_MAX_WAIT)
+
+async def run(key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Cálculo pesado deduplicado por `key`: sólo el primero pasa por la admisión y consulta la base."""
+    async def admitted():
+        async with heavy:
+            return await fn()
+    return await flights.run(key, admitted)
+
+def stats() -> Dict[str, Any]:
+    return {**{f"flight_{k}": v for k, v in flights.stats().items()}, **heavy.stats()}
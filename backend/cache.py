@@ -0,0 +1,163 @@
+"""
+Cache de respuestas de /api/kpis por filtros normalizados.
+
+La invalidación la maneja una marca de agua barata de gestiones
+(MAX(id) + COUNT(*)): una entrada sólo se usa si se calculó con la marca de
+agua vigente. La misma marca de agua da el ETag y el Last-Modified, así un
+cliente que repite la consulta recibe 304 sin agregar nada en la base.
+El TTL queda sólo como red de seguridad (p. ej. UPDATE sobre gestiones existentes).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+from . import config
+
+Watermark = Tuple[int, ...]
+
+def normalize_token(token: Optional[str]) -> Optional[str]:
+    """
+    Token de campaña/agente como lo interpreta _resolve_filters: recortado, IDs
+    sin ceros a la izquierda. El texto conserva mayúsculas: si no hay
+    coincidencias, el label es el texto tal cual.
+    """
+    if token is None:
+        return None
+    token = token.strip()
+    if not token:
+        return None
+    if token.isdigit():
+        return str(int(token))
+    return token
+
+def filter_key(start: Optional[str], end: Optional[str], campaign: Optional[str], agent: Optional[str]) -> tuple:
+    return (start or None, end or None, normalize_token(campaign), normalize_token(agent))
+
+# ---------------------------- marca de agua ----------------------------
+
+class DataWatermark:
+    """
+    MAX(id) y COUNT(*) de gestiones, consultados como mucho cada `min_interval`
+    segundos. `changed_at` es el momento en que se observó el último cambio.
+    """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._value: Optional[Watermark] = None
+        self._checked_at = 0.0
+        self.changed_at = time.time()
+
+    def current(self, conn) -> Watermark:
+        now = time.time()
+        with self._lock:
+            if self._value is not None and now - self._checked_at < self.min_interval:
+                return self._value
+        cur = conn.cursor()
+        cur.execute("/* kpis.watermark */ SELECT COALESCE(MAX(id), 0), COUNT(*) FROM gestiones")
+        row = cur.fetchone()
+        cur.close()
+        value = (int(row[0]), int(row[1]))
+        with self._lock:
+            if value != self._value:
+                self._value = value
+                self.changed_at = now
+            self._checked_at = now
+        return value
+
+    def peek(self) -> Optional[Watermark]:
+        """Último valor observado, sin consultar la base."""
+        with self._lock:
+            return self._value
+
+    def last_modified(self) -> str:
+        return formatdate(int(self.changed_at), usegmt=True)
+
+def etag(key: tuple, wm: Watermark) -> str:
+    raw = json.dumps([list(key), list(wm)], separators=(",", ":"))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+def not_modified(headers, tag: str, last_modified: str) -> bool:
+    """Evalúa If-None-Match / If-Modified-Since (el primero tiene prioridad, como indica RFC 9110)."""
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        return inm.strip() == "*" or tag in [t.strip().removeprefix("W/") for t in inm.split(",")]
+    ims = headers.get("if-modified-since")
+    if ims:
+        try:
+            return parsedate_to_datetime(ims) >= parsedate_to_datetime(last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+# ---------------------------- cache LRU ----------------------------
+
+class KpiCache:
+    """LRU acotado por cantidad de entradas y por bytes (tamaño aproximado en JSON), con TTL."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[tuple, Tuple[Any, Watermark, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "expirations": 0}
+
+    def get(self, key: tuple, wm: Watermark) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, entry_wm, size, expires = entry
+            if entry_wm != wm or now >= expires:
+                self._stats["invalidations" if entry_wm != wm else "expirations"] += 1
+                self._stats["misses"] += 1
+                self._drop(key)
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def put(self, key: tuple, wm: Watermark, value: Any) -> None:
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, wm, size, time.time() + self.ttl)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def _drop(self, key: tuple) -> None:
+        _, _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s.update(entries=len(self._data), bytes=self._bytes,
+                     max_entries=self.max_entries, max_bytes=self.max_bytes)
+        return s
+
+kpi_cache = KpiCache(config.KPI_CACHE_MAX_ENTRIES, config.KPI_CACHE_MAX_BYTES, config.KPI_CACHE_TTL)
+data_watermark = DataWatermark(config.KPI_WATERMARK_SECONDS)
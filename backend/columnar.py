@@ -0,0 +1,497 @@
+"""
+Motor columnar opcional para KPIs (KPI_ENGINE=columnar, requiere numpy).
+
+Guarda en COLUMNAR_DIR las columnas de `gestiones` que usan los KPIs (id,
+timestamp, id_campaign, id_broker, id_resultado) como arreglos NumPy en
+archivos planos que se abren con memmap: los workers comparten las páginas
+del sistema operativo y un reinicio no recarga nada. `timestamp` se guarda
+como int64 YYYYMMDDhhmmss y los IDs con el tipo entero más chico que
+alcanza (se ensancha si aparece un ID más grande).
+
+El refresco agrega las filas con `id` mayor a la marca de agua de meta.json,
+como el rollup. Las consultas se responden con máscaras vectorizadas y
+`bincount`, y devuelven las mismas filas que kpis.fetch_counts. Si el
+almacén no está al día con la marca de agua de gestiones (MAX(id) y
+COUNT(*)), o los límites no son YYYYMMDDhhmmss, se responde por SQL.
+Un UPDATE/DELETE sobre gestiones existentes no se ve: en ese caso hay que
+correr `rebuild` (el refresco en segundo plano lo hace solo si el conteo
+deja de coincidir).
+
+Uso:
+    python -m backend.columnar refresh   # agrega las filas nuevas
+    python -m backend.columnar rebuild   # reconstruye todo desde cero
+    python -m backend.columnar check     # compara el motor columnar contra SQL
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import cache, config, rollup
+
+try:
+    import numpy as np
+except ImportError:  # el motor es opcional: sin numpy todo va por SQL
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se serializa dentro del proceso
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ("id", "timestamp", "id_campaign", "id_broker", "id_resultado")
+
+# tipos candidatos para columnas de IDs, del más chico al más grande
+_ID_DTYPES = ("uint8", "uint16", "uint32", "int64")
+
+def available() -> bool:
+    return np is not None
+
+def enabled() -> bool:
+    return config.KPI_ENGINE == "columnar" and available()
+
+# ---------------------------- tipos ----------------------------
+
+def _fit(lo: int, hi: int) -> str:
+    """El tipo más chico de _ID_DTYPES que representa [lo, hi]."""
+    for name in _ID_DTYPES:
+        info = np.iinfo(name)
+        if info.min <= lo and hi <= info.max:
+            return name
+    raise ValueError(f"IDs fuera de rango: {lo}..{hi}")
+
+def _timestamps(values: Sequence[Any]) -> "np.ndarray":
+    """CHAR(14) YYYYMMDDhhmmss -> int64; lo que no tiene ese formato queda en -1."""
+    return np.array([int(v) if rollup._TS.match(str(v)) else -1 for v in values], dtype=np.int64)
+
+# ---------------------------- almacén ----------------------------
+
+class ColumnStore:
+    """
+    Columnas en `path/<columna>.<dtype>.bin` más `path/meta.json` con la
+    cantidad de filas, la marca de agua y el tipo/máximo de cada columna.
+
+    Escribe un solo proceso a la vez (flock sobre `path/lock`); los lectores
+    reabren los memmap cuando cambia meta.json. Los bytes de un archivo más
+    allá de `rows` (una escritura interrumpida) se ignoran y se truncan en la
+    próxima escritura.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._view: Optional[Tuple[Dict[str, Any], Dict[str, Any]]] = None
+        self.stale = False
+
+    # ---------------------------- archivos ----------------------------
+
+    def _file(self, name: str, dtype: str) -> str:
+        return os.path.join(self.path, f"{name}.{dtype}.bin")
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    def read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta: Dict[str, Any]) -> None:
+        tmp = self._meta_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._meta_path())
+
+    @staticmethod
+    def _empty_meta() -> Dict[str, Any]:
+        cols = {name: {"dtype": "uint8", "min": 0, "max": 0} for name in COLUMNS}
+        cols["timestamp"]["dtype"] = "int64"
+        return {"rows": 0, "last_id": 0, "irregular": 0, "columns": cols}
+
+    @contextmanager
+    def _writer(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, open(os.path.join(self.path, "lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ---------------------------- escritura ----------------------------
+
+    def _widen(self, meta: Dict[str, Any], name: str, dtype: str) -> None:
+        col = meta["columns"][name]
+        old = self._file(name, col["dtype"])
+        data = np.fromfile(old, dtype=col["dtype"], count=meta["rows"]) if meta["rows"] else np.empty(0, dtype=dtype)
+        data.astype(dtype).tofile(self._file(name, dtype))
+        col["dtype"] = dtype
+        # el archivo viejo se borra después de publicar meta.json (ver append)
+
+    def _append_batch(self, meta: Dict[str, Any], batch: List[tuple]) -> List[str]:
+        ids, stamps, camps, brokers, results = zip(*batch)
+        values = {
+            "id": np.array(ids, dtype=np.int64),
+            "timestamp": _timestamps(stamps),
+            "id_campaign": np.array(camps, dtype=np.int64),
+            "id_broker": np.array(brokers, dtype=np.int64),
+            "id_resultado": np.array(results, dtype=np.int64),
+        }
+        obsolete: List[str] = []
+        for name, arr in values.items():
+            col = meta["columns"][name]
+            if name != "timestamp":
+                col["min"] = min(col["min"], int(arr.min()))
+                col["max"] = max(col["max"], int(arr.max()))
+                dtype = _fit(col["min"], col["max"])
+                if _ID_DTYPES.index(dtype) > _ID_DTYPES.index(col["dtype"]):
+                    obsolete.append(self._file(name, col["dtype"]))
+                    self._widen(meta, name, dtype)
+            with open(self._file(name, col["dtype"]), "ab") as f:
+                f.write(arr.astype(col["dtype"]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        meta["irregular"] += int((values["timestamp"] < 0).sum())
+        meta["rows"] += len(batch)
+        meta["last_id"] = int(ids[-1])
+        return obsolete
+
+    def _truncate_tails(self, meta: Dict[str, Any]) -> None:
+        for name, col in meta["columns"].items():
+            path = self._file(name, col["dtype"])
+            size = meta["rows"] * np.dtype(col["dtype"]).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def append(self, conn, upto: Optional[int] = None) -> Dict[str, Any]:
+        """Agrega las filas con id > marca de agua (y <= `upto` si se indica), de a COLUMNAR_BATCH."""
+        added = 0
+        with self._writer():
+            meta = self.read_meta() or self._empty_meta()
+            since = meta["last_id"]
+            self._truncate_tails(meta)
+            cur = conn.cursor()
+            try:
+                while upto is None or meta["last_id"] < upto:
+                    cur.execute(
+                        "/* columnar.append */ SELECT id, `timestamp`, id_campaign, id_broker, id_resultado "
+                        "FROM gestiones WHERE id > %s AND id <= %s ORDER BY id LIMIT %s",
+                        (meta["last_id"], upto if upto is not None else 2 ** 63 - 1, config.COLUMNAR_BATCH),
+                    )
+                    batch = cur.fetchall()
+                    if not batch:
+                        break
+                    obsolete = self._append_batch(meta, batch)
+                    self._write_meta(meta)
+                    for path in obsolete:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    added += len(batch)
+                    if len(batch) < config.COLUMNAR_BATCH:
+                        break
+            finally:
+                cur.close()
+        return {"since": since, "last_id": meta["last_id"], "added": added, "rows": meta["rows"]}
+
+    def rebuild(self, conn) -> Dict[str, Any]:
+        """Borra el almacén y lo vuelve a llenar. Mientras tanto las consultas van por SQL."""
+        with self._writer():
+            meta = self.read_meta()
+            if meta is not None:
+                os.remove(self._meta_path())
+                for name, col in meta["columns"].items():
+                    path = self._file(name, col["dtype"])
+                    if os.path.exists(path):
+                        os.remove(path)
+        out = self.append(conn)
+        self.stale = False
+        return out
+
+    # ---------------------------- lectura ----------------------------
+
+    def view(self) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """(meta, {columna: memmap}) vigente; se reabre sólo si cambió meta.json."""
+        try:
+            st = os.stat(self._meta_path())
+        except FileNotFoundError:
+            self._stamp = self._view = None
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            if stamp != self._stamp:
+                meta = self.read_meta()
+                if meta is None:
+                    return None
+                cols = {}
+                try:
+                    for name, col in meta["columns"].items():
+                        if meta["rows"]:
+                            cols[name] = np.memmap(self._file(name, col["dtype"]), dtype=col["dtype"],
+                                                   mode="r", shape=(meta["rows"],))
+                        else:
+                            cols[name] = np.empty(0, dtype=col["dtype"])
+                except (FileNotFoundError, ValueError):
+                    return None  # otro proceso está reescribiendo una columna
+                self._stamp, self._view = stamp, (meta, cols)
+            return self._view
+
+    def counts(
+        self,
+        conn,
+        start: Optional[str],
+        end: Optional[str],
+        campaign_ids: Optional[Sequence[int]],
+        broker_ids: Optional[Sequence[int]],
+        extra: Sequence[str] = (),
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Las filas de kpis.fetch_counts (sin nombres) para esos filtros, o None
+        si el motor no puede responder igual que SQL y hay que ir a la base.
+        """
+        if set(extra) - {"day"} or any(ts is not None and not rollup._TS.match(ts) for ts in (start, end)):
+            return None
+        max_id, total = cache.data_watermark.current(conn)[:2]
+        current = self.view()
+        if current is None or self.stale:
+            return None
+        meta, cols = current
+        if meta["last_id"] < max_id:
+            if max_id - meta["last_id"] > config.COLUMNAR_CATCHUP_MAX:
+                return None  # muy atrasado: lo pone al día el refresco en segundo plano
+            self.append(conn, upto=max_id)
+            current = self.view()
+            if current is None:
+                return None
+            meta, cols = current
+
+        # las filas hasta max_id tienen que ser exactamente las COUNT(*) de la marca de agua
+        n = int(np.searchsorted(cols["id"], max_id, side="right"))
+        if n != total:
+            if not self.stale:
+                log.warning("Motor columnar desalineado (%s filas vs COUNT(*) %s): se usa SQL hasta el rebuild", n, total)
+            self.stale = True
+            return None
+        if meta["irregular"] and (start or end or extra):
+            return None
+        return _group(meta, {k: v[:n] for k, v in cols.items()}, start, end, campaign_ids, broker_ids, "day" in extra)
+
+# ---------------------------- agregación vectorizada ----------------------------
+
+def _member(col: "np.ndarray", ids: Sequence[int], lo: int, hi: int) -> "np.ndarray":
+    ids = [i for i in set(ids) if lo <= i <= hi]
+    if lo < 0:
+        return np.isin(col, ids)
+    if len(ids) == 1:
+        return col == ids[0]
+    lut = np.zeros(hi + 1, dtype=bool)
+    lut[ids] = True
+    return lut[col]
+
+def _group(
+    meta: Dict[str, Any],
+    cols: Dict[str, "np.ndarray"],
+    start: Optional[str],
+    end: Optional[str],
+    campaign_ids: Optional[Sequence[int]],
+    broker_ids: Optional[Sequence[int]],
+    by_day: bool,
+) -> List[Dict[str, Any]]:
+    ts = cols["timestamp"]
+    masks = []
+    if start:
+        masks.append(ts >= int(start))
+    if end:
+        masks.append(ts <= int(end))
+    if campaign_ids is not None:
+        c = meta["columns"]["id_campaign"]
+        masks.append(_member(cols["id_campaign"], campaign_ids, c["min"], c["max"]))
+    if broker_ids is not None:
+        c = meta["columns"]["id_broker"]
+        masks.append(_member(cols["id_broker"], broker_ids, c["min"], c["max"]))
+
+    names = ["id_campaign", "id_broker", "id_resultado"]
+    keys = [cols[c] for c in names]
+    if masks:
+        mask = masks[0]
+        for m in masks[1:]:
+            mask &= m
+        sel = np.flatnonzero(mask)
+        keys = [k[sel] for k in keys]
+        ts = ts[sel]
+    days = None
+    if by_day:
+        days, day_idx = np.unique(ts // 1_000_000, return_inverse=True)
+        names.insert(0, "day")
+        keys.insert(0, day_idx)
+    if not len(keys[0]):
+        return []
+
+    shape = tuple(len(days) if c == "day" else meta["columns"][c]["max"] + 1 for c in names)
+    size = 1
+    for s in shape:
+        size *= s
+    if size <= config.COLUMNAR_BINCOUNT_MAX:
+        flat = np.ravel_multi_index([k.astype(np.int64) for k in keys], shape)
+        counts = np.bincount(flat, minlength=size)
+        found = np.flatnonzero(counts)
+        groups, n = np.unravel_index(found, shape), counts[found]
+    else:
+        uniq, n = np.unique(np.stack([k.astype(np.int64) for k in keys], axis=1), axis=0, return_counts=True)
+        groups = uniq.T
+
+    out = []
+    for values in zip(*(g.tolist() for g in groups), n.tolist()):
+        row = dict(zip(names, values[:-1]))
+        row["n"] = values[-1]
+        if by_day:
+            row["day"] = f"{int(days[row['day']]):08d}"
+        out.append(row)
+    return out
+
+store = ColumnStore(config.COLUMNAR_DIR)
+
+# ---------------------------- verificación ----------------------------
+
+def _canon(rows: List[Dict[str, Any]], extra: Sequence[str]) -> List[tuple]:
+    cols = tuple(extra) + ("id_campaign", "id_broker", "id_resultado", "n")
+    return sorted(tuple(r[c] for c in cols) for r in rows)
+
+def check(conn, samples: int = 20) -> Dict[str, Any]:
+    """
+    Compara, para rangos y filtros de muestra, las filas de kpis.fetch_counts
+    por SQL contra las del motor columnar, y los KPIs/distribución/rendimiento
+    derivados de cada una. Con escrituras concurrentes puede dar diferencias
+    espurias: conviene correrlo con la base quieta.
+    """
+    from . import dimensions, kpis
+
+    if not available():
+        return {"ok": False, "error": "numpy no está instalado"}
+    store.append(conn)
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(`timestamp`), MAX(`timestamp`) FROM gestiones")
+    lo, hi = cur.fetchone()
+    cur.execute("SELECT id_campaign, COUNT(*) FROM gestiones GROUP BY id_campaign ORDER BY 2 DESC LIMIT 3")
+    camps = [r[0] for r in cur.fetchall()]
+    cur.execute("SELECT id_broker, COUNT(*) FROM gestiones GROUP BY id_broker ORDER BY 2 DESC LIMIT 3")
+    brokers = [r[0] for r in cur.fetchall()]
+    cur.close()
+
+    cases: List[Tuple[Optional[str], Optional[str], Optional[List[int]], Optional[List[int]], Tuple[str, ...]]] = [
+        (None, None, None, None, ()),
+    ]
+    if lo and hi:
+        cases += [
+            (lo, hi, None, None, ()),
+            (lo[:8] + "000000", lo[:8] + "235959", None, None, ()),
+            (lo[:10] + "1530", hi[:10] + "4512", None, None, ("day",)),
+            (hi[:8] + "000000", None, None, None, ("day",)),
+            (None, None, camps, None, ()),
+            (lo, hi, None, brokers[:1], ()),
+            (lo[:10] + "3000", None, camps[:1], brokers, ("day",)),
+            (None, None, [-1], None, ()),
+        ]
+        cases += [(None, hi, [c], None, ()) for c in camps]
+    cases = cases[:samples]
+
+    dims = dimensions.get(conn)
+    failures = []
+    answered = 0
+    for start, end, campaign_ids, broker_ids, extra in cases:
+        where, params = kpis.ids_where(campaign_ids, broker_ids)
+        sql_rows = kpis.fetch_counts(conn, start, end, where, params, extra)
+        col_rows = store.counts(conn, start, end, campaign_ids, broker_ids, extra)
+        case = {"start": start, "end": end, "campaign_ids": campaign_ids, "broker_ids": broker_ids, "extra": extra}
+        if col_rows is None:
+            failures.append({**case, "error": "el motor columnar no respondió"})
+            continue
+        answered += 1
+        kpis.label_rows(dims, col_rows)
+        if _canon(sql_rows, extra) != _canon(col_rows, extra):
+            failures.append({**case, "error": "conteos distintos", "sql": len(sql_rows), "columnar": len(col_rows)})
+        elif (kpis.summarize(sql_rows), kpis.rendimiento(sql_rows)) != (kpis.summarize(col_rows), kpis.rendimiento(col_rows)):
+            failures.append({**case, "error": "KPIs/distribución/rendimiento distintos"})
+
+    meta = store.read_meta() or {}
+    return {
+        "rows": meta.get("rows"),
+        "last_id": meta.get("last_id"),
+        "cases": len(cases),
+        "answered": answered,
+        "failures": failures,
+        "ok": not failures,
+    }
+
+def info() -> Dict[str, Any]:
+    meta = store.read_meta()
+    if meta is None:
+        return {"path": store.path, "built": False}
+    size = sum(os.path.getsize(store._file(n, c["dtype"])) for n, c in meta["columns"].items()
+               if os.path.exists(store._file(n, c["dtype"])))
+    return {"path": store.path, "built": True, "bytes": size, "stale": store.stale, **meta}
+
+# ---------------------------- refresco en segundo plano ----------------------------
+
+def start_refresher(connection, interval: float) -> Optional[threading.Event]:
+    """Como rollup.start_refresher; si el almacén quedó desalineado con la base, lo reconstruye."""
+    if interval <= 0 or not enabled():
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with connection() as conn:
+                    if store.stale:
+                        store.rebuild(conn)
+                    else:
+                        store.append(conn)
+            except Exception:
+                log.exception("Falló el refresco del motor columnar")
+
+    threading.Thread(target=loop, name="columnar-refresher", daemon=True).start()
+    return stop
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import connect
+
+    ap = argparse.ArgumentParser(prog="python -m backend.columnar", description=__doc__.split("\n\n")[0])
+    ap.add_argument("command", choices=["refresh", "rebuild", "check", "info"])
+    ap.add_argument("--samples", type=int, default=20, help="casos de muestra para `check`")
+    args = ap.parse_args(argv)
+
+    if not available():
+        sys.exit("El motor columnar requiere numpy: pip install numpy")
+    if args.command == "info":
+        out = info()
+    else:
+        conn = connect()
+        try:
+            if args.command == "refresh":
+                out = store.append(conn)
+            elif args.command == "rebuild":
+                out = store.rebuild(conn)
+            else:
+                out = check(conn, args.samples)
+        finally:
+            conn.close()
+    print(json.dumps(out, indent=2, default=str))
+    return 0 if out.get("ok", True) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import os
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv(usecwd=True))
+
+def env(name: str) -> str:
+    v = os.getenv(name)
+    if not v:
+        raise RuntimeError(f"Falta la variable de entorno {name}")
+    return v
+
+def env_int(name: str, default: int) -> int:
+    v = os.getenv(name)
+    return int(v) if v not in (None, "") else default
+
+def env_float(name: str, default: float) -> float:
+    v = os.getenv(name)
+    return float(v) if v not in (None, "") else default
+
+def env_flag(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    return v.strip().lower() in ("1", "true", "yes", "on") if v not in (None, "") else default
+
+# ---------------------------- pool de conexiones ----------------------------
+
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 10)            # conexiones máximas abiertas
+DB_POOL_TIMEOUT = env_float("DB_POOL_TIMEOUT", 5.0)   # segundos de espera por una conexión libre
+DB_POOL_RECYCLE = env_float("DB_POOL_RECYCLE", 1800)  # se descartan conexiones más viejas que esto
+DB_POOL_PING_AFTER = env_float("DB_POOL_PING_AFTER", 30)  # ping si estuvo ociosa más que esto
+DB_EXECUTOR_WORKERS = env_int("DB_EXECUTOR_WORKERS", 0)   # hilos para endpoints async; 0 = DB_POOL_SIZE
+DB_REQUEST_PARALLELISM = env_int("DB_REQUEST_PARALLELISM", 4)  # consultas en paralelo por request
+
+# ---------------------------- rollup de gestiones ----------------------------
+
+ROLLUP_ENABLED = env_flag("ROLLUP_ENABLED", True)                # requiere sql/05_rollup.sql (si no, 0)
+ROLLUP_REFRESH_SECONDS = env_float("ROLLUP_REFRESH_SECONDS", 60)  # 0 = sin refresco en la app
+ROLLUP_BATCH = env_int("ROLLUP_BATCH", 200_000)                  # ids por transacción de refresco
+ROLLUP_SAFETY_IDS = env_int("ROLLUP_SAFETY_IDS", 10_000)          # ids más nuevos sin volcar (commits tardíos)
+
+# ---------------------------- criterios de KPIs ----------------------------
+
+def _id_set(name: str, default: str) -> frozenset:
+    return frozenset(int(x) for x in (os.getenv(name) or default).split(",") if x.strip())
+
+RESULTADOS_EFECTIVOS = _id_set("KPI_RESULTADOS_EFECTIVOS", "1,2,8,10,11,14,16")  # contacto efectivo
+RESULTADOS_EXITOSOS = _id_set("KPI_RESULTADOS_EXITOSOS", "1")                     # venta / éxito
+
+# ---------------------------- cache de /api/kpis ----------------------------
+
+KPI_CACHE_MAX_ENTRIES = env_int("KPI_CACHE_MAX_ENTRIES", 512)
+KPI_CACHE_MAX_BYTES = env_int("KPI_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+KPI_CACHE_TTL = env_float("KPI_CACHE_TTL", 600)              # red de seguridad; invalida la marca de agua
+KPI_WATERMARK_SECONDS = env_float("KPI_WATERMARK_SECONDS", 1.0)  # cada cuánto se reconsulta MAX(id)/COUNT(*)
+
+# ---------------------------- dimensiones ----------------------------
+
+DIM_REFRESH_SECONDS = env_float("DIM_REFRESH_SECONDS", 300)  # recarga de campaigns/users/resultados
+
+# ---------------------------- KPIs en vivo (SSE) ----------------------------
+
+LIVE_POLL_SECONDS = env_float("LIVE_POLL_SECONDS", 2.0)        # cada cuánto se buscan gestiones nuevas
+LIVE_HEARTBEAT_SECONDS = env_float("LIVE_HEARTBEAT_SECONDS", 15.0)
+LIVE_QUEUE_SIZE = env_int("LIVE_QUEUE_SIZE", 100)              # eventos pendientes por suscriptor
+LIVE_SAFETY_IDS = env_int("LIVE_SAFETY_IDS", 5_000)            # ids bajo la marca de agua que se revisan (commits tardíos)
+
+# ---------------------------- métricas y consultas lentas ----------------------------
+
+SLOW_QUERY_MS = env_float("SLOW_QUERY_MS", 500)             # 0 = sin registro de consultas lentas
+SLOW_QUERY_EXPLAIN = env_flag("SLOW_QUERY_EXPLAIN", True)   # EXPLAIN automático de las lentas
+SLOW_QUERY_KEEP = env_int("SLOW_QUERY_KEEP", 50)            # últimas lentas en /api/health/slow_queries
+SLOW_QUERY_FULL_SCAN_ROWS = env_int("SLOW_QUERY_FULL_SCAN_ROWS", 10_000)  # type=ALL con más filas = full scan
+
+# ---------------------------- índice de teléfonos ----------------------------
+
+PHONE_INDEX_ENABLED = env_flag("PHONE_INDEX_ENABLED", True)               # requiere sql/07_contacto_telefono.sql
+PHONE_INDEX_REFRESH_SECONDS = env_float("PHONE_INDEX_REFRESH_SECONDS", 300)  # 0 = sin refresco en la app
+PHONE_COUNTRY_CODE = os.getenv("PHONE_COUNTRY_CODE", "598")               # se quita si viene adelante
+PHONE_NATIONAL_DIGITS = env_int("PHONE_NATIONAL_DIGITS", 8)               # largo mínimo sin código de país
+CONTACTOS_BATCH_MAX = env_int("CONTACTOS_BATCH_MAX", 1000)                # teléfonos + documentos por request
+
+# ---------------------------- /api/kpis/batch ----------------------------
+
+KPI_BATCH_MAX = env_int("KPI_BATCH_MAX", 500)  # filtros por request
+
+# ---------------------------- motor de KPIs ----------------------------
+
+KPI_ENGINE = (os.getenv("KPI_ENGINE") or "sql").strip().lower()  # sql | columnar (requiere numpy)
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR") or os.path.join("data", "columnar")
+COLUMNAR_REFRESH_SECONDS = env_float("COLUMNAR_REFRESH_SECONDS", 30)  # 0 = sin refresco en la app
+COLUMNAR_BATCH = env_int("COLUMNAR_BATCH", 500_000)                   # filas por lectura al agregar
+COLUMNAR_CATCHUP_MAX = env_int("COLUMNAR_CATCHUP_MAX", 50_000)        # atraso que se completa en el request
+COLUMNAR_BINCOUNT_MAX = env_int("COLUMNAR_BINCOUNT_MAX", 1 << 24)     # celdas máximas para bincount (si no, unique)
+
+# ---------------------------- admisión de consultas pesadas ----------------------------
+
+HEAVY_QUERY_LIMIT = env_int("HEAVY_QUERY_LIMIT", 2)             # agregaciones en paralelo por worker (x paralelismo < pool)
+HEAVY_QUERY_QUEUE = env_int("HEAVY_QUERY_QUEUE", 32)            # en espera; con la cola llena -> 503
+HEAVY_QUERY_MAX_WAIT = env_float("HEAVY_QUERY_MAX_WAIT", 10.0)  # segundos máximos en la cola -> 503
+
+# ---------------------------- snapshots ----------------------------
+
+SNAPSHOT_COMPRESS_BYTES = env_int("SNAPSHOT_COMPRESS_BYTES", 2048)     # distribución más grande -> zlib
+SNAPSHOTS_CLIENT_KPIS = env_flag("SNAPSHOTS_CLIENT_KPIS", False)       # modo anterior: acepta KPIs del cliente
+SNAPSHOTS_HOURLY = env_flag("SNAPSHOTS_HOURLY", False)                 # snapshot por campaña de cada hora
+SNAPSHOTS_HOURLY_CHECK_SECONDS = env_float("SNAPSHOTS_HOURLY_CHECK_SECONDS", 300)
+
+# ---------------------------- carga masiva de gestiones ----------------------------
+
+INGEST_BATCH_ROWS = env_int("INGEST_BATCH_ROWS", 2000)           # filas por INSERT multi-fila + commit
+INGEST_MAX_BYTES = env_int("INGEST_MAX_BYTES", 64 * 1024 * 1024)  # cuerpo máximo de /api/gestiones/bulk
+INGEST_MAX_REJECTS = env_int("INGEST_MAX_REJECTS", 100)           # rechazos detallados en el reporte
+INGEST_REFRESH_ROLLUP = env_flag("INGEST_REFRESH_ROLLUP", True)   # refresca el rollup al terminar
+INGEST_LOCK_TIMEOUT = env_int("INGEST_LOCK_TIMEOUT", 30)           # segundos de espera por GET_LOCK entre cargas
@@ -1,16 +1,22 @@
-import os
-from dotenv import load_dotenv, find_dotenv
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
 import mysql.connector
 
-load_dotenv(find_dotenv(usecwd=True))
+from . import config, metrics
+from .config import env as _env
 
-def _env(name: str) -> str:
-    v = os.getenv(name)
-    if not v:
-        raise RuntimeError(f"Falta la variable de entorno {name}")
-    return v
+class PoolTimeout(RuntimeError):
+    """No se liberó ninguna conexión dentro de DB_POOL_TIMEOUT."""
 
-def get_conn():
+def connect():
+    """Conexión suelta, fuera del pool (scripts y comandos de mantenimiento)."""
     return mysql.connector.connect(
         host=_env("DB_HOST"),
         port=int(_env("DB_PORT")),
@@ -19,3 +25,332 @@ def get_conn():
         database=_env("DB_NAME"),
         autocommit=True,
     )
+
+# ---------------------------- instrumentación ----------------------------
+
+class InstrumentedCursor:
+    """
+    Envuelve un cursor de mysql-connector y mide cada consulta: tiempo dentro de
+    execute + fetch* y filas leídas. La observación se cierra al agotar el
+    resultado, al cerrar el cursor o al ejecutar la siguiente consulta.
+    """
+
+    def __init__(self, cur):
+        self._cur = cur
+        self._sql: Optional[str] = None
+        self._params: Any = None
+        self._seconds = 0.0
+        self._rows = 0
+
+    def _timed(self, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            dt = time.perf_counter() - t0
+            self._seconds += dt
+            metrics.add_db_time(dt)
+
+    def _begin(self, sql: str, params: Any) -> None:
+        self._finish()
+        self._sql, self._params, self._seconds, self._rows = sql, params, 0.0, 0
+        metrics.add_db_time(0.0, queries=1)
+
+    def _finish(self) -> None:
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            metrics.observe_query(sql, self._seconds, self._rows, self._params)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._begin(operation, params)
+        return self._timed(self._cur.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        self._begin(operation, f"<{len(seq_params)} filas>")
+        result = self._timed(self._cur.executemany, operation, seq_params, *args, **kwargs)
+        self._rows = len(seq_params)
+        self._finish()
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cur.fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._timed(self._cur.fetchmany, size)
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cur.fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finish()
+        return self._cur.close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class InstrumentedConnection:
+    """Conexión cuyos cursores se miden; el resto de la API se delega tal cual."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def instrumented_connect():
+    return InstrumentedConnection(connect())
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones MySQL.
+
+    Como máximo `size` conexiones abiertas; si están todas en uso se espera
+    hasta `timeout` segundos y después se lanza PoolTimeout. Las conexiones
+    ociosas más de `ping_after` segundos se verifican con un ping antes de
+    entregarlas y las más viejas que `recycle` se cierran y se reabren.
+    """
+
+    def __init__(self, size: int, timeout: float, recycle: float, ping_after: float, connect_fn=connect):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._connect = connect_fn
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # (conexión, creada_en, liberada_en); LIFO para reusar las más calientes
+        self._idle: Deque[Tuple[Any, float, float]] = deque()
+        self._born: Dict[int, float] = {}
+        self._in_use = 0
+        self._closed = False
+        self._stats = {
+            "acquired": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    # ---------------------------- ciclo de vida ----------------------------
+
+    def acquire(self):
+        t0 = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"Sin conexiones libres tras {self.timeout}s (pool={self.size})")
+        waited = (time.perf_counter() - t0) * 1000
+        metrics.observe_pool_wait(waited / 1000)
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._stats["acquired"] += 1
+            self._stats["wait_ms_total"] += waited
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited)
+        return conn
+
+    def release(self, conn) -> None:
+        now = time.time()
+        keep = not self._closed and self._alive(conn)
+        with self._lock:
+            self._in_use -= 1
+            born = self._born.pop(id(conn), now)
+            if keep:
+                self._idle.append((conn, born, now))
+            else:
+                self._stats["discarded"] += 1
+        if not keep:
+            self._close_quietly(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    # ---------------------------- internos ----------------------------
+
+    def _checkout(self):
+        now = time.time()
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                break
+            conn, born, released = item
+            if now - born > self.recycle or not self._healthy(conn, now - released):
+                with self._lock:
+                    self._stats["discarded"] += 1
+                self._close_quietly(conn)
+                continue
+            with self._lock:
+                self._born[id(conn)] = born
+            return conn
+
+        with metrics.step("db_connect"):
+            conn = self._connect()
+        with self._lock:
+            self._stats["created"] += 1
+            self._born[id(conn)] = now
+        return conn
+
+    def _healthy(self, conn, idle_for: float) -> bool:
+        if idle_for < self.ping_after:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _alive(conn) -> bool:
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            if conn.in_transaction:
+                conn.rollback()
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s.update(size=self.size, in_use=self._in_use, idle=len(self._idle))
+        s["wait_ms_avg"] = round(s["wait_ms_total"] / s["acquired"], 3) if s["acquired"] else 0.0
+        s["wait_ms_total"] = round(s["wait_ms_total"], 3)
+        s["wait_ms_max"] = round(s["wait_ms_max"], 3)
+        return s
+
+# ---------------------------- pool global ----------------------------
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def init_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                size=config.DB_POOL_SIZE,
+                timeout=config.DB_POOL_TIMEOUT,
+                recycle=config.DB_POOL_RECYCLE,
+                ping_after=config.DB_POOL_PING_AFTER,
+                connect_fn=instrumented_connect,
+            )
+        return _pool
+
+def close_pool() -> None:
+    global _pool, _executor
+    with _pool_lock:
+        pool, _pool = _pool, None
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=True, cancel_futures=True)
+    if pool is not None:
+        pool.close()
+
+def pool() -> ConnectionPool:
+    return _pool or init_pool()
+
+def connection():
+    """Context manager: `with connection() as conn:` devuelve la conexión al pool al salir."""
+    return pool().connection()
+
+def get_conn():
+    """Dependencia de FastAPI: presta una conexión del pool y siempre la devuelve."""
+    with pool().connection() as conn:
+        yield conn
+
+def pool_stats() -> Dict[str, Any]:
+    return pool().stats()
+
+# ---------------------------- ejecución async ----------------------------
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+def executor() -> ThreadPoolExecutor:
+    """Hilos dedicados a MySQL (DB_EXECUTOR_WORKERS, por defecto uno por conexión del pool)."""
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.DB_EXECUTOR_WORKERS or config.DB_POOL_SIZE,
+                                           thread_name_prefix="db")
+        return _executor
+
+async def run_db(fn: Callable[..., Any], *args) -> Any:
+    """
+    fn(conn, *args) en el executor de DB con una conexión propia del pool.
+    El event loop queda libre mientras MySQL responde, y varias llamadas
+    concurrentes corren en paralelo, cada una en su conexión. El contexto
+    (métricas del request) viaja con la llamada.
+    """
+    ctx = contextvars.copy_context()
+
+    def call():
+        with connection() as conn:
+            return fn(conn, *args)
+
+    return await asyncio.get_running_loop().run_in_executor(executor(), ctx.run, call)
+
+def request_parallelism() -> int:
+    """DB_REQUEST_PARALLELISM, dejando al menos una conexión del pool libre para los demás requests."""
+    return max(min(config.DB_REQUEST_PARALLELISM, config.DB_POOL_SIZE - 1), 1)
+
+async def gather_db(calls: Sequence[Tuple[Callable[..., Any], tuple]]) -> List[Any]:
+    """run_db de varias llamadas en paralelo, como mucho request_parallelism() a la vez."""
+    sem = asyncio.Semaphore(request_parallelism())
+
+    async def one(fn, args):
+        async with sem:
+            return await run_db(fn, *args)
+
+    return await asyncio.gather(*(one(fn, args) for fn, args in calls))
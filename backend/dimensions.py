@@ -0,0 +1,175 @@
+"""
+Cache en memoria de las dimensiones chicas: campaigns, users y gestiones_resultado.
+
+Se recargan completas cada DIM_REFRESH_SECONDS (o al llamar invalidate()) y
+`version` aumenta sólo si cambió el contenido (hash de las filas): la versión
+forma parte de la marca de agua del cache de KPIs. Para el autocompletado hay un índice de
+trigramas sobre el texto normalizado (sin mayúsculas ni tildes, igual que la
+collation utf8_spanish_ci), así buscar "%q%" no recorre las tablas.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from . import config
+from .text import fold
+
+log = logging.getLogger(__name__)
+
+def _trigrams(s: str) -> Set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+class TextIndex:
+    """Búsqueda por subcadena sobre uno o más campos de texto por id."""
+
+    def __init__(self, docs: Dict[int, Sequence[str]]):
+        self._docs = {i: [fold(f) for f in fields] for i, fields in docs.items()}
+        self._grams: Dict[str, Set[int]] = {}
+        for i, fields in self._docs.items():
+            for f in fields:
+                for g in _trigrams(f):
+                    self._grams.setdefault(g, set()).add(i)
+
+    def search(self, q: str) -> Set[int]:
+        fq = fold(q)
+        if not fq:
+            return set(self._docs)
+        if len(fq) >= 3:
+            grams = sorted(_trigrams(fq), key=lambda g: len(self._grams.get(g, ())))
+            candidates = set(self._grams.get(grams[0], ()))
+            for g in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._grams.get(g, set())
+        else:
+            candidates = self._docs.keys()
+        return {i for i in candidates if any(fq in f for f in self._docs[i])}
+
+class Dimensions:
+    """Foto inmutable de las tablas de dimensión."""
+
+    def __init__(self, campaigns: List[Dict[str, Any]], users: List[Dict[str, Any]],
+                 resultados: List[Dict[str, Any]], version: int):
+        self.version = version
+        self.loaded_at = time.time()
+        self.campaigns = {r["id"]: r for r in campaigns}
+        self.users = {r["id"]: r for r in users}
+        self.resultados = {r["id"]: r["nombre"] for r in resultados}
+        self._campaign_codes = {fold(r["codigo"]): r["id"] for r in campaigns}
+        self._usernames: Dict[str, List[int]] = {}
+        for r in users:
+            self._usernames.setdefault(fold(r["usuario"]), []).append(r["id"])
+        self._campaign_idx = TextIndex({r["id"]: (r["nombre"], r["codigo"]) for r in campaigns})
+        self._user_idx = TextIndex({r["id"]: (r["usuario"], r["nombre_completo"]) for r in users})
+        self._campaign_name_idx = TextIndex({r["id"]: (r["nombre"],) for r in campaigns})
+        self._user_name_idx = TextIndex({r["id"]: (r["nombre_completo"],) for r in users})
+
+    # ---------------------------- nombres ----------------------------
+
+    def campaign_name(self, id_campaign: int) -> Optional[str]:
+        r = self.campaigns.get(id_campaign)
+        return r["nombre"] if r else None
+
+    def agent_name(self, id_broker: int) -> Optional[str]:
+        r = self.users.get(id_broker)
+        return r["nombre_completo"] if r else None
+
+    def resultado_name(self, id_resultado: int) -> Optional[str]:
+        return self.resultados.get(id_resultado)
+
+    # ---------------------------- filtros ----------------------------
+
+    def match_campaigns(self, token: str) -> List[int]:
+        """Equivalente a `codigo = token OR nombre LIKE %token%`."""
+        ids = self._campaign_name_idx.search(token)
+        code = self._campaign_codes.get(fold(token))
+        if code is not None:
+            ids.add(code)
+        return sorted(ids)
+
+    def match_agents(self, token: str) -> List[int]:
+        """Equivalente a `usuario = token OR CONCAT(nombre,' ',apellido) LIKE %token%`."""
+        ids = self._user_name_idx.search(token)
+        ids.update(self._usernames.get(fold(token), ()))
+        return sorted(ids)
+
+    # ---------------------------- autocompletado ----------------------------
+
+    def search_campaigns(self, q: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        ids = self._campaign_idx.search(q or "")
+        rows = sorted((self.campaigns[i] for i in ids), key=lambda r: (fold(r["nombre"]), r["id"]))
+        return [{"id": r["id"], "codigo": r["codigo"], "nombre": r["nombre"]} for r in rows[:max(limit, 0)]]
+
+    def search_agents(self, q: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        ids = self._user_idx.search(q or "")
+        rows = sorted((self.users[i] for i in ids),
+                      key=lambda r: (fold(r["nombre"]), fold(r["apellido"]), r["id"]))
+        return [{"id": r["id"], "usuario": r["usuario"], "nombre_completo": r["nombre_completo"]}
+                for r in rows[:max(limit, 0)]]
+
+def label(names: Iterable[Optional[str]]) -> Optional[str]:
+    """GROUP_CONCAT(DISTINCT nombre ORDER BY nombre SEPARATOR ', ')."""
+    distinct = sorted({n for n in names if n}, key=fold)
+    return ", ".join(distinct) or None
+
+# ---------------------------- cache global ----------------------------
+
+_lock = threading.Lock()
+_current: Optional[Dimensions] = None
+_version = 0
+_digest: Optional[bytes] = None
+
+def _load(conn, previous: Optional[Dimensions]) -> Dimensions:
+    """Lee las tablas; si no cambiaron desde la última carga, devuelve `previous` con la hora renovada."""
+    global _version, _digest
+    cur = conn.cursor(dictionary=True)
+    cur.execute("SELECT id, codigo, nombre FROM campaigns ORDER BY id")
+    campaigns = cur.fetchall()
+    cur.execute("SELECT id, usuario, nombre, apellido FROM users ORDER BY id")
+    users = cur.fetchall()
+    cur.execute("SELECT id, nombre FROM gestiones_resultado ORDER BY id")
+    resultados = cur.fetchall()
+    cur.close()
+    digest = hashlib.sha1(repr((campaigns, users, resultados)).encode()).digest()
+    if previous is not None and digest == _digest:
+        previous.loaded_at = time.time()
+        return previous
+    for u in users:
+        u["nombre_completo"] = f"{u['nombre']} {u['apellido']}"
+    _version += 1
+    _digest = digest
+    return Dimensions(campaigns, users, resultados, _version)
+
+def get(conn) -> Dimensions:
+    """
+    Devuelve la foto vigente. Si venció (DIM_REFRESH_SECONDS) la recarga con
+    `conn`; mientras un hilo recarga, los demás siguen usando la anterior.
+    """
+    global _current
+    dims = _current
+    if dims is not None and time.time() - dims.loaded_at < config.DIM_REFRESH_SECONDS:
+        return dims
+    if dims is not None and not _lock.acquire(blocking=False):
+        return dims
+    if dims is None:
+        _lock.acquire()
+    try:
+        if _current is dims:
+            try:
+                _current = _load(conn, dims)
+            except Exception:
+                if dims is None:
+                    raise
+                log.exception("No se pudieron recargar las dimensiones; se usa la foto anterior")
+        return _current
+    finally:
+        _lock.release()
+
+def invalidate() -> None:
+    """Fuerza la recarga en el próximo get() (p. ej. tras dar de alta campañas o usuarios)."""
+    global _current
+    with _lock:
+        if _current is not None:
+            _current.loaded_at = 0.0
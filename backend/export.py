@@ -0,0 +1,125 @@
+"""
+Paginación keyset y exportación en streaming para /api/consultas/*.
+
+- Paginación: `limit` + `cursor` opaco (base64 de los valores de la clave de
+  orden de la última fila). El cursor de la página siguiente viaja en los
+  headers `X-Next-Cursor` y `Link: <...>; rel="next"`, así el cuerpo sigue
+  siendo la misma lista de siempre.
+- Streaming: `format=ndjson|csv` escribe las filas a medida que salen de un
+  cursor sin buffer, con memoria constante sin importar el tamaño del resultado.
+"""
+import base64
+import csv
+import io
+import json
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from .db import connection
+
+FETCH_SIZE = 1000
+
+_MEDIA = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+class BadCursor(ValueError):
+    pass
+
+# ---------------------------- cursores keyset ----------------------------
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token: str, size: int) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except ValueError as e:
+        raise BadCursor("cursor inválido") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise BadCursor("cursor inválido")
+    return values
+
+def keyset_where(cols: Sequence[str], values: Sequence[Any], desc: bool = False) -> Tuple[str, List[Any]]:
+    """
+    Condición "después de `values`" para ORDER BY cols (todas ASC o todas DESC),
+    expandida como (a > x) OR (a = x AND b > y) ... para que MySQL use índices.
+    """
+    op = "<" if desc else ">"
+    ors: List[str] = []
+    params: List[Any] = []
+    for i, col in enumerate(cols):
+        ands = [f"{c} = %s" for c in cols[:i]] + [f"{col} {op} %s"]
+        ors.append("(" + " AND ".join(ands) + ")")
+        params += list(values[:i]) + [values[i]]
+    return "(" + " OR ".join(ors) + ")", params
+
+def page(rows: List[Dict[str, Any]], limit: Optional[int], key: Callable[[Dict[str, Any]], Sequence[Any]]):
+    """Recorta a `limit` filas (la consulta pide limit + 1) y calcula el cursor siguiente."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+def page_headers(request: Request, next_cursor: Optional[str]) -> Dict[str, str]:
+    if not next_cursor:
+        return {}
+    url = request.url.include_query_params(cursor=next_cursor)
+    return {"X-Next-Cursor": next_cursor, "Link": f'<{url}>; rel="next"'}
+
+# ---------------------------- streaming ----------------------------
+
+def _default(o: Any) -> Any:
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() and o.as_tuple().exponent >= 0 else float(o)
+    return str(o)
+
+def _encode(rows: Iterable[Dict[str, Any]], fmt: str, columns: Sequence[str]) -> Iterator[bytes]:
+    if fmt == "ndjson":
+        for r in rows:
+            yield (json.dumps(r, default=_default, ensure_ascii=False) + "\n").encode()
+        return
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(columns)
+    for r in rows:
+        w.writerow([_default(r[c]) if isinstance(r[c], Decimal) else r[c] for c in columns])
+        if buf.tell() >= 64 * 1024:
+            yield buf.getvalue().encode()
+            buf.seek(0); buf.truncate()
+    yield buf.getvalue().encode()
+
+def _query_rows(sql: str, params: Sequence[Any]) -> Iterator[Dict[str, Any]]:
+    # Conexión propia, tomada recién cuando empieza el stream (los endpoints no usan Depends(get_conn))
+    with connection() as conn:
+        cur = conn.cursor(dictionary=True)  # sin buffer: las filas se leen del socket a demanda
+        done = False
+        try:
+            cur.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                yield from batch
+            done = True
+        finally:
+            if done:
+                cur.close()
+            else:
+                # cliente desconectado o error a mitad de camino: en vez de drenar
+                # las filas pendientes se cierra la conexión y el pool la descarta
+                conn.close()
+
+def _filename(name: str, fmt: str) -> Dict[str, str]:
+    ext = "ndjson" if fmt == "ndjson" else "csv"
+    return {"Content-Disposition": f'attachment; filename="{name}.{ext}"'}
+
+def stream_query(sql: str, params: Sequence[Any], fmt: str, columns: Sequence[str], name: str) -> StreamingResponse:
+    return StreamingResponse(_encode(_query_rows(sql, params), fmt, columns),
+                             media_type=_MEDIA[fmt], headers=_filename(name, fmt))
+
+def stream_rows(rows: Iterable[Dict[str, Any]], fmt: str, columns: Sequence[str], name: str) -> StreamingResponse:
+    return StreamingResponse(_encode(rows, fmt, columns), media_type=_MEDIA[fmt], headers=_filename(name, fmt))
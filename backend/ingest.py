@@ -0,0 +1,269 @@
+"""
+Carga masiva de gestiones desde NDJSON o CSV (POST /api/gestiones/bulk y CLI).
+
+- Cada fila se valida en memoria: enteros, `timestamp` YYYYMMDDhhmmss y
+  claves foráneas contra el cache de dimensiones (campaigns, users,
+  gestiones_resultado; id_resultado 0 = sin resultado). Si aparece un id
+  desconocido se recargan las dimensiones una vez, por si es un alta reciente.
+  Las filas inválidas se rechazan con su número de línea y el resto sigue.
+- Las válidas se escriben en lotes de INGEST_BATCH_ROWS filas: un INSERT
+  multi-fila y un commit por lote, así una carga grande no arma una
+  transacción enorme y un error sólo deshace el lote en curso.
+- Cada lote se escribe con el lock de MySQL GET_LOCK('gestiones_ingest'):
+  las cargas concurrentes (API en varios workers, CLI) no intercalan sus
+  lotes. Las inserciones de otros sistemas no pasan por ese lock; un id
+  confirmado tarde lo cubre el margen de la marca de agua del rollup
+  (ROLLUP_SAFETY_IDS, mayor que INGEST_BATCH_ROWS). Al terminar se refresca
+  el rollup (INGEST_REFRESH_ROLLUP).
+
+Columnas: id_campaign, id_broker, id_contacto y timestamp obligatorias;
+id_tipo (1 = Llamada), id_resultado (0), notas ('') e id_tel_fijo1 (0) opcionales.
+
+Uso:
+    python -m backend.ingest gestiones.ndjson
+    python -m backend.ingest gestiones.csv --batch 5000
+    python -m backend.ingest - --format csv --dry-run < gestiones.csv
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import config, dimensions, metrics, rollup
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "csv")
+
+COLUMNS = ("id_tipo", "id_campaign", "id_broker", "id_contacto", "id_resultado", "notas", "timestamp", "id_tel_fijo1")
+
+_INSERT = ("INSERT INTO gestiones (" + ", ".join(f"`{c}`" for c in COLUMNS) + ") VALUES ("
+           + ", ".join(["%s"] * len(COLUMNS)) + ")")
+
+_TS = re.compile(r"^\d{14}$")
+
+_NOTAS_MAX_BYTES = 65535  # TEXT
+
+# lock de MySQL (por servidor): un lote de carga masiva a la vez entre procesos
+LOCK_NAME = "gestiones_ingest"
+
+Record = Tuple[int, Any]  # (número de línea, dict o la excepción de parseo)
+
+class UnknownRef(ValueError):
+    """Clave foránea que no está en el cache de dimensiones."""
+
+# ---------------------------- lectura ----------------------------
+# Las líneas se cortan sólo en "\n" (newline="\n"): un \r, U+2028, \x1c, etc.
+# dentro de notas no parte el registro.
+
+def split_lines(text: str) -> io.StringIO:
+    return io.StringIO(text, newline="\n")
+
+def open_lines(path: str):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="\n")
+    return open(path, encoding="utf-8-sig", newline="\n")
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[Record]:
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            # strict=False: caracteres de control sin escapar dentro de notas
+            yield n, json.loads(line, strict=False)
+        except ValueError as e:
+            yield n, ValueError(f"JSON inválido: {e}")
+
+def read_csv(lines: Iterable[str]) -> Iterator[Record]:
+    """CSV con encabezado; las columnas que no son de gestiones se ignoran."""
+    reader = csv.DictReader(lines)
+    for rec in reader:
+        if None in rec:
+            yield reader.line_num, ValueError("la fila tiene más campos que el encabezado")
+        else:
+            yield reader.line_num, rec
+
+def records(lines: Iterable[str], fmt: str) -> Iterator[Record]:
+    return read_csv(lines) if fmt == "csv" else read_ndjson(lines)
+
+# ---------------------------- validación ----------------------------
+
+def _int(rec: Dict[str, Any], col: str, default: Optional[int] = None) -> int:
+    v = rec.get(col)
+    if v is None or v == "":
+        if default is None:
+            raise ValueError(f"falta {col}")
+        return default
+    if isinstance(v, bool) or isinstance(v, float):
+        raise ValueError(f"{col} no es entero: {v!r}")
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"{col} no es entero: {v!r}") from None
+
+def validate(rec: Any, dims: dimensions.Dimensions) -> tuple:
+    """Fila lista para el INSERT (en el orden de COLUMNS) o ValueError con el motivo."""
+    if isinstance(rec, Exception):
+        raise rec
+    if not isinstance(rec, dict):
+        raise ValueError("se esperaba un objeto")
+    id_campaign = _int(rec, "id_campaign")
+    id_broker = _int(rec, "id_broker")
+    id_resultado = _int(rec, "id_resultado", 0)
+    if id_campaign not in dims.campaigns:
+        raise UnknownRef(f"id_campaign {id_campaign} no existe")
+    if id_broker not in dims.users:
+        raise UnknownRef(f"id_broker {id_broker} no existe")
+    if id_resultado != 0 and id_resultado not in dims.resultados:
+        raise UnknownRef(f"id_resultado {id_resultado} no existe")
+
+    ts = str(rec.get("timestamp") or "").strip()
+    if not _TS.match(ts):
+        raise ValueError(f"timestamp inválido: {ts!r} (YYYYMMDDhhmmss)")
+    try:
+        datetime.strptime(ts, "%Y%m%d%H%M%S")
+    except ValueError:
+        raise ValueError(f"timestamp inválido: {ts!r}") from None
+    notas = rec.get("notas") or ""
+    if not isinstance(notas, str):
+        raise ValueError("notas debe ser texto")
+    if len(notas) * 3 > _NOTAS_MAX_BYTES and len(notas.encode()) > _NOTAS_MAX_BYTES:
+        raise ValueError("notas supera 65535 bytes")
+
+    return (_int(rec, "id_tipo", 1), id_campaign, id_broker, _int(rec, "id_contacto"), id_resultado,
+            notas, ts, _int(rec, "id_tel_fijo1", 0))
+
+# ---------------------------- escritura ----------------------------
+
+def _write(conn, rows: List[tuple]) -> None:
+    """Un lote: INSERT multi-fila + commit, con GET_LOCK para no intercalarse con otras cargas."""
+    with metrics.step("ingest.write"):
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, config.INGEST_LOCK_TIMEOUT))
+            if cur.fetchone()[0] != 1:
+                raise RuntimeError(f"No se obtuvo el lock {LOCK_NAME} en {config.INGEST_LOCK_TIMEOUT}s")
+            try:
+                conn.start_transaction()
+                try:
+                    cur.executemany(_INSERT, rows)  # mysql-connector lo envía como un INSERT multi-fila
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+                cur.fetchone()
+        finally:
+            cur.close()
+
+def _rate(rows: int, seconds: float) -> float:
+    return round(rows / seconds, 1) if seconds > 0 else 0.0
+
+def load(conn, recs: Iterable[Record], batch: Optional[int] = None, dry_run: bool = False,
+         refresh_rollup: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Valida y escribe `recs` en lotes. Devuelve el reporte: totales, throughput
+    por lote (`seconds` incluye parseo y validación, `db_seconds` sólo el
+    INSERT + commit) y las primeras INGEST_MAX_REJECTS filas rechazadas. Si un
+    lote falla al escribir se corta la carga: los lotes anteriores quedan
+    confirmados y el reporte lleva `error`.
+    """
+    batch = batch or config.INGEST_BATCH_ROWS
+    if refresh_rollup is None:
+        refresh_rollup = config.INGEST_REFRESH_ROLLUP
+    dims = dimensions.get(conn)
+    reloaded = False
+    report: Dict[str, Any] = {"rows": 0, "inserted": 0, "rejected": 0, "dry_run": dry_run,
+                              "batches": [], "rejects": []}
+    buf: List[tuple] = []
+    batch_rows = batch_rejected = 0
+    t_start = t_batch = time.perf_counter()
+
+    def flush() -> None:
+        nonlocal buf, batch_rows, batch_rejected, t_batch
+        t_db = time.perf_counter()
+        if buf and not dry_run:
+            _write(conn, buf)
+        now = time.perf_counter()
+        report["inserted"] += 0 if dry_run else len(buf)
+        report["batches"].append({
+            "batch": len(report["batches"]) + 1, "rows": batch_rows, "valid": len(buf), "rejected": batch_rejected,
+            "seconds": round(now - t_batch, 4), "db_seconds": round(now - t_db, 4),
+            "rows_per_s": _rate(len(buf), now - t_batch),
+        })
+        buf, batch_rows, batch_rejected, t_batch = [], 0, 0, now
+
+    try:
+        for line, rec in recs:
+            report["rows"] += 1
+            batch_rows += 1
+            try:
+                try:
+                    buf.append(validate(rec, dims))
+                except UnknownRef:
+                    if reloaded:
+                        raise
+                    # puede ser una campaña o un usuario dado de alta después de la última recarga
+                    dimensions.invalidate()
+                    dims, reloaded = dimensions.get(conn), True
+                    buf.append(validate(rec, dims))
+            except ValueError as e:
+                report["rejected"] += 1
+                batch_rejected += 1
+                if len(report["rejects"]) < config.INGEST_MAX_REJECTS:
+                    report["rejects"].append({"line": line, "error": str(e)})
+            if len(buf) >= batch:
+                flush()
+        if batch_rows:
+            flush()
+    except Exception as e:
+        log.exception("Falló la carga de gestiones en el lote %d", len(report["batches"]) + 1)
+        report["error"] = f"lote {len(report['batches']) + 1}: {e}"
+
+    elapsed = time.perf_counter() - t_start
+    report.update(seconds=round(elapsed, 4), rows_per_s=_rate(report["inserted"] or report["rows"], elapsed))
+    if report["inserted"] and refresh_rollup and config.ROLLUP_ENABLED:
+        try:
+            report["rollup"] = rollup.refresh(conn)
+        except Exception:
+            # el refresco en segundo plano lo completa más tarde
+            log.exception("No se pudo refrescar el rollup tras la carga")
+            report["rollup"] = None
+    report["ok"] = "error" not in report and not report["rejected"]
+    return report
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import connect
+
+    ap = argparse.ArgumentParser(prog="python -m backend.ingest", description=__doc__.split("\n\n")[0])
+    ap.add_argument("path", help="archivo NDJSON o CSV ('-' = stdin)")
+    ap.add_argument("--format", choices=FORMATS, help="por defecto, según la extensión (NDJSON si no es .csv)")
+    ap.add_argument("--batch", type=int, default=config.INGEST_BATCH_ROWS, help="filas por lote (INSERT + commit)")
+    ap.add_argument("--dry-run", action="store_true", help="sólo valida, no escribe")
+    ap.add_argument("--no-rollup", action="store_true", help="no refrescar el rollup al terminar")
+    args = ap.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    src = open_lines(args.path)
+    conn = connect()
+    try:
+        out = load(conn, records(src, fmt), args.batch, args.dry_run, not args.no_rollup)
+    finally:
+        conn.close()
+        if args.path != "-":
+            src.close()
+    print(json.dumps(out, indent=2, default=str))
+    return 0 if out.get("ok", True) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
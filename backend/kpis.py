@@ -0,0 +1,371 @@
+"""
+Motor de KPIs: una sola pasada agrupada sobre gestiones (vía rollup) y todo
+lo demás (contactabilidad, PB, PN, distribución, top campaña/agente y
+rendimiento) se deriva en Python a partir de esos conteos.
+
+Los criterios de gestión efectiva/exitosa salen de config
+(RESULTADOS_EFECTIVOS / RESULTADOS_EXITOSOS).
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import columnar, config, dimensions, rollup
+from .text import fold
+
+COUNT_BY = ("id_campaign", "id_broker", "id_resultado")
+
+_Q4 = Decimal("0.0001")
+_Q2 = Decimal("0.01")
+
+def fetch_counts(
+    conn,
+    start: Optional[str],
+    end: Optional[str],
+    dim_where: Sequence[str],
+    dim_params: Sequence[Any],
+    extra: Sequence[str] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Conteos por (campaña, agente, resultado) en una única consulta sin JOINs;
+    los nombres se completan desde el cache de dimensiones. `extra` agrega
+    columnas de agrupación de rollup.source_sql (p. ej. "day").
+    """
+    dims = dimensions.get(conn)
+    cur = conn.cursor(dictionary=True)
+    with rollup.consistent(conn) as wm:
+        src, params = rollup.source_sql(wm, start, end, "", dim_where, dim_params, tuple(extra) + COUNT_BY)
+        cur.execute("/* kpis.counts */ " + src, params)
+        rows = cur.fetchall()
+    cur.close()
+    for r in rows:
+        r["n"] = int(r["n"])
+    return label_rows(dims, rows)
+
+def label_rows(dims: dimensions.Dimensions, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Completa campaña, agente y resultado desde el cache de dimensiones."""
+    for r in rows:
+        r["campaña"] = dims.campaign_name(r["id_campaign"])
+        r["agente"] = dims.agent_name(r["id_broker"])
+        r["resultado"] = dims.resultado_name(r["id_resultado"])
+    return rows
+
+def ids_where(campaign_ids: Optional[Sequence[int]], broker_ids: Optional[Sequence[int]]) -> Tuple[List[str], List[Any]]:
+    """WHERE sobre g.id_campaign / g.id_broker (None = sin filtro, lista vacía = ninguna fila)."""
+    where: List[str] = []
+    params: List[Any] = []
+    for col, ids in (("g.id_campaign", campaign_ids), ("g.id_broker", broker_ids)):
+        if ids is None:
+            continue
+        if not ids:
+            where.append("1 = 0")
+        elif len(ids) == 1:
+            where.append(f"{col} = %s")
+            params.append(ids[0])
+        else:
+            where.append(f"{col} IN ({', '.join(['%s'] * len(ids))})")
+            params += list(ids)
+    return where, params
+
+def counts(
+    conn,
+    start: Optional[str],
+    end: Optional[str],
+    campaign_ids: Optional[Sequence[int]],
+    broker_ids: Optional[Sequence[int]],
+    extra: Sequence[str] = (),
+) -> List[Dict[str, Any]]:
+    """
+    Las mismas filas que fetch_counts, filtrando por IDs. Con KPI_ENGINE=columnar
+    salen del motor columnar cuando puede responder; si no, de SQL.
+    """
+    if columnar.enabled():
+        rows = columnar.store.counts(conn, start, end, campaign_ids, broker_ids, extra)
+        if rows is not None:
+            return label_rows(dimensions.get(conn), rows)
+    where, params = ids_where(campaign_ids, broker_ids)
+    return fetch_counts(conn, start, end, where, params, extra)
+
+# ---------------------------- cálculo ----------------------------
+
+def pct(num: int, den: int) -> Optional[Decimal]:
+    """ROUND(100 * num / NULLIF(den, 0), 2) con el mismo redondeo que MySQL (4 decimales y luego 2)."""
+    if not den:
+        return None
+    q = (Decimal(100 * num) / Decimal(den)).quantize(_Q4, rounding=ROUND_HALF_UP)
+    return q.quantize(_Q2, rounding=ROUND_HALF_UP)
+
+def totals(rows: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    gestiones = efectivas = exitosas = 0
+    for r in rows:
+        n = r["n"]
+        gestiones += n
+        if r["id_resultado"] in config.RESULTADOS_EFECTIVOS:
+            efectivas += n
+        if r["id_resultado"] in config.RESULTADOS_EXITOSOS:
+            exitosas += n
+    return {"gestiones": gestiones, "efectivas": efectivas, "exitosas": exitosas}
+
+def kpis_from(t: Dict[str, int]) -> Dict[str, Optional[Decimal]]:
+    return {
+        "contactabilidad": pct(t["efectivas"], t["gestiones"]),
+        "penetracion_bruta": pct(t["exitosas"], t["gestiones"]),
+        "penetracion_neta": pct(t["exitosas"], t["efectivas"]),
+    }
+
+def distribution(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cantidad por resultado (sólo resultados existentes en gestiones_resultado), de mayor a menor."""
+    acc: Dict[int, List[Any]] = {}
+    for r in rows:
+        if r["resultado"] is None:
+            continue
+        item = acc.setdefault(r["id_resultado"], [r["resultado"], 0])
+        item[1] += r["n"]
+    ordered = sorted(acc.items(), key=lambda kv: (-kv[1][1], kv[0]))
+    return [{"resultado": name, "cantidad": n} for _, (name, n) in ordered]
+
+def top_resumen(rows: Iterable[Dict[str, Any]], limit: int = 10) -> List[Dict[str, Any]]:
+    """Campaña × agente con más gestiones."""
+    acc: Dict[tuple, Dict[str, Any]] = {}
+    for r in rows:
+        if r["campaña"] is None or r["agente"] is None:
+            continue
+        key = (r["id_campaign"], r["id_broker"])
+        item = acc.setdefault(key, {"campaña": r["campaña"], "agente": r["agente"], "gestiones": 0})
+        item["gestiones"] += r["n"]
+    ordered = sorted(acc.items(), key=lambda kv: (-kv[1]["gestiones"], kv[0]))
+    return [item for _, item in ordered[:limit]]
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """kpis + distribution + top_resumen, tal como los devuelve /api/kpis (más los totales)."""
+    t = totals(rows)
+    return {
+        "totals": t,
+        "kpis": kpis_from(t),
+        "distribution": distribution(rows),
+        "top_resumen": top_resumen(rows),
+    }
+
+def rendimiento(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gestiones, efectivas, exitosas y KPIs por campaña × operador, ordenado por campaña y operador."""
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for r in rows:
+        if r["campaña"] is None or r["agente"] is None:
+            continue
+        groups.setdefault((r["id_campaign"], r["id_broker"]), []).append(r)
+
+    out = []
+    for (id_campaign, id_broker), members in groups.items():
+        t = totals(members)
+        out.append({
+            "id_campaign": id_campaign,
+            "campaña": members[0]["campaña"],
+            "id_broker": id_broker,
+            "operador": members[0]["agente"],
+            **t,
+            **kpis_from(t),
+        })
+    out.sort(key=lambda r: (fold(r["campaña"]), fold(r["operador"]), r["id_campaign"], r["id_broker"]))
+    return out
+
+# ---------------------------- lotes (/api/kpis/batch) ----------------------------
+
+GROUP_BY = {"campaign": ("id_campaign", "campaña"), "broker": ("id_broker", "agente"), "day": ("day", None)}
+
+_OUT_NAME = {"campaña": "campaña", "agente": "operador"}
+
+class RowIndex:
+    """Filas de fetch_counts indexadas por campaña y por agente, para recortar subconjuntos sin recorrer todo."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.by_campaign: Dict[int, List[Dict[str, Any]]] = {}
+        self.by_broker: Dict[int, List[Dict[str, Any]]] = {}
+        for r in rows:
+            self.by_campaign.setdefault(r["id_campaign"], []).append(r)
+            self.by_broker.setdefault(r["id_broker"], []).append(r)
+
+    def select(self, campaigns: Optional[Sequence[int]], brokers: Optional[Sequence[int]],
+               days: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """Filas de esas campañas/agentes (None = sin filtro) y, si hay columna `day`, dentro de [desde, hasta]."""
+        if campaigns is not None:
+            candidates = [r for c in set(campaigns) for r in self.by_campaign.get(c, ())]
+            broker_set = set(brokers) if brokers is not None else None
+            if broker_set is not None:
+                candidates = [r for r in candidates if r["id_broker"] in broker_set]
+        elif brokers is not None:
+            candidates = [r for b in set(brokers) for r in self.by_broker.get(b, ())]
+        else:
+            candidates = self.rows
+        if days is not None:
+            lo, hi = days
+            candidates = [r for r in candidates if (lo is None or r["day"] >= lo) and (hi is None or r["day"] <= hi)]
+        return candidates
+
+def _group_sort(dim: str, value: Any, name: Optional[str]) -> tuple:
+    if dim == "day":
+        return (value,)
+    return (name is None, fold(name or ""), value)
+
+def grouped(rows: Iterable[Dict[str, Any]], group_by: Sequence[str]) -> Dict[str, Any]:
+    """
+    Totales y KPIs por combinación de `group_by` con subtotales por cada prefijo,
+    en el orden de GROUP BY ... WITH ROLLUP: cada grupo va seguido de su subtotal.
+    El total general coincide con /api/kpis para los mismos filtros.
+    """
+    cols = [GROUP_BY[g][0] for g in group_by]
+    names: Dict[tuple, Optional[str]] = {}
+    detail: Dict[tuple, List[Dict[str, Any]]] = {}
+    for r in rows:
+        key = tuple(r[c] for c in cols)
+        detail.setdefault(key, []).append(r)
+        for g, c in zip(group_by, cols):
+            name_col = GROUP_BY[g][1]
+            if name_col:
+                names[(c, r[c])] = r[name_col]
+
+    def row(key: tuple, members: List[Dict[str, Any]], subtotal: bool) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for i, g in enumerate(group_by):
+            col, name_col = GROUP_BY[g]
+            value = key[i] if i < len(key) else None
+            out[col] = value
+            if name_col:
+                out[_OUT_NAME[name_col]] = names.get((col, value)) if value is not None else None
+        t = totals(members)
+        return {**out, "subtotal": subtotal, **t, **kpis_from(t)}
+
+    out: List[Dict[str, Any]] = []
+
+    def emit(prefix: tuple, items: List[tuple]) -> List[Dict[str, Any]]:
+        depth = len(prefix)
+        col = cols[depth]
+        children: Dict[Any, List[tuple]] = {}
+        for key, members in items:
+            children.setdefault(key[depth], []).append((key, members))
+        all_members: List[Dict[str, Any]] = []
+        for value in sorted(children, key=lambda v: _group_sort(group_by[depth], v, names.get((col, v)))):
+            group = children[value]
+            if depth + 1 == len(cols):
+                members = [m for _, ms in group for m in ms]
+                out.append(row(prefix + (value,), members, False))
+            else:
+                members = emit(prefix + (value,), group)
+                out.append(row(prefix + (value,), members, True))
+            all_members += members
+        return all_members
+
+    everything = emit((), list(detail.items()))
+    t = totals(everything)
+    return {"rows": out, "total": {**t, **kpis_from(t)}}
+
+# ---------------------------- series temporales ----------------------------
+
+GRANULARITIES = ("hour", "day", "week")
+
+_SPLIT_COLS = {"campaign": "id_campaign", "broker": "id_broker"}
+
+@lru_cache(maxsize=4096)
+def _week_of(day: str) -> str:
+    d = datetime.strptime(day, "%Y%m%d")
+    return (d - timedelta(days=d.weekday())).strftime("%Y%m%d")
+
+def bucket_of(hour_bucket: str, granularity: str) -> str:
+    """Bucket YYYYMMDDhh del rollup -> hora (YYYYMMDDhh), día (YYYYMMDD) o semana (lunes YYYYMMDD)."""
+    if granularity == "hour":
+        return hour_bucket
+    if granularity == "day":
+        return hour_bucket[:8]
+    return _week_of(hour_bucket[:8])
+
+def bucket_labels(start: str, end: str, granularity: str) -> List[str]:
+    """Todos los buckets entre start y end (YYYYMMDDhhmmss), incluidos los vacíos."""
+    lo = datetime.strptime(start[:10], "%Y%m%d%H")
+    hi = datetime.strptime(end[:10], "%Y%m%d%H")
+    if granularity == "hour":
+        step, fmt = timedelta(hours=1), "%Y%m%d%H"
+    else:
+        lo, hi = lo.replace(hour=0), hi.replace(hour=0)
+        if granularity == "week":
+            lo -= timedelta(days=lo.weekday())
+            hi -= timedelta(days=hi.weekday())
+        step, fmt = timedelta(days=7 if granularity == "week" else 1), "%Y%m%d"
+    out = []
+    while lo <= hi:
+        out.append(lo.strftime(fmt))
+        lo += step
+    return out
+
+def fetch_series_counts(
+    conn,
+    start: str,
+    end: str,
+    dim_where: Sequence[str],
+    dim_params: Sequence[Any],
+    split: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Conteos por (hora, [campaña|agente], resultado). El bucket es el prefijo
+    de 10 caracteres del `timestamp`: en el rollup es la clave y en las filas
+    crudas el rango sigue filtrando por el índice de `timestamp`.
+    """
+    by = ("bucket",) + ((_SPLIT_COLS[split],) if split else ()) + ("id_resultado",)
+    cur = conn.cursor(dictionary=True)
+    with rollup.consistent(conn) as wm:
+        src, params = rollup.source_sql(wm, start, end, "", dim_where, dim_params, by)
+        cur.execute("/* kpis.series */ " + src, params)
+        rows = cur.fetchall()
+    cur.close()
+    for r in rows:
+        r["n"] = int(r["n"])
+    return rows
+
+def series(
+    rows: Iterable[Dict[str, Any]],
+    labels: List[str],
+    granularity: str,
+    split: Optional[str] = None,
+    name: Optional[Callable[[int], Optional[str]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Arma series en formato columnar: un arreglo por métrica alineado con `labels`
+    (buckets vacíos en 0 / None). Con `split` hay una serie por campaña o agente.
+    """
+    pos = {b: i for i, b in enumerate(labels)}
+    col = _SPLIT_COLS.get(split) if split else None
+    acc: Dict[Any, Dict[str, List[int]]] = {}
+    size = len(labels)
+    for r in rows:
+        i = pos.get(bucket_of(r["bucket"], granularity))
+        if i is None:
+            continue
+        key = r[col] if col else None
+        s = acc.get(key)
+        if s is None:
+            s = acc[key] = {"gestiones": [0] * size, "efectivas": [0] * size, "exitosas": [0] * size}
+        n = r["n"]
+        s["gestiones"][i] += n
+        if r["id_resultado"] in config.RESULTADOS_EFECTIVOS:
+            s["efectivas"][i] += n
+        if r["id_resultado"] in config.RESULTADOS_EXITOSOS:
+            s["exitosas"][i] += n
+
+    if not col and not acc:
+        acc[None] = {"gestiones": [0] * size, "efectivas": [0] * size, "exitosas": [0] * size}
+
+    out = []
+    for key in sorted(acc, key=lambda k: (k is not None, k or 0)):
+        s = acc[key]
+        g, ef, ex = s["gestiones"], s["efectivas"], s["exitosas"]
+        out.append({
+            "key": key,
+            "label": name(key) if (name and key is not None) else None,
+            "gestiones": g,
+            "efectivas": ef,
+            "exitosas": ex,
+            "contactabilidad": [pct(a, b) for a, b in zip(ef, g)],
+            "penetracion_bruta": [pct(a, b) for a, b in zip(ex, g)],
+            "penetracion_neta": [pct(a, b) for a, b in zip(ex, ef)],
+        })
+    return out
@@ -0,0 +1,202 @@
+"""
+KPIs en vivo por Server-Sent Events (/api/kpis/stream).
+
+Hay un poller por combinación de filtros, compartido por todos los
+suscriptores con esos filtros. Al arrancar calcula una vez los conteos por
+resultado; después, cada LIVE_POLL_SECONDS, cuenta sólo las gestiones con
+`id` mayor a su marca de agua (rango sobre la PK) y publica el delta. Con
+200 tableros abiertos con los mismos filtros sigue habiendo una sola
+consulta incremental por tick.
+
+Eventos:
+  init   {"watermark", "counts": {id_resultado: n}, "names": {id_resultado: nombre},
+          "efectivos", "exitosos", "kpis"}
+  delta  {"watermark", "delta": {id_resultado: n}}
+
+Commits tardíos: una gestión cuyo id se asignó antes que otro pero que hace
+commit después de que el poller avanzó la marca de agua queda debajo de ella.
+Por eso cada tick recorre también las últimas LIVE_SAFETY_IDS ids y cuenta las
+que todavía no había visto (el poller recuerda las ids contadas de esa ventana).
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from . import admission, config, kpis, rollup
+from .db import connection
+
+log = logging.getLogger(__name__)
+
+class Subscriber:
+    def __init__(self):
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=config.LIVE_QUEUE_SIZE)
+        self.closed = False
+
+class Poller:
+    def __init__(self, key: tuple, start: Optional[str], end: Optional[str],
+                 dim_where: Sequence[str], dim_params: Sequence[Any], names: Dict[int, str]):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.dim_where = list(dim_where)
+        self.dim_params = list(dim_params)
+        self.names = names
+        self.subscribers: Set[Subscriber] = set()
+        self.counts: Dict[int, int] = {}
+        self.watermark = 0
+        self.seen: Set[int] = set()  # ids ya contadas en la ventana (watermark - LIVE_SAFETY_IDS, watermark]
+        self.ready = False
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    # ---------------------------- consultas (en threadpool) ----------------------------
+    # No modifican el estado del poller: run() lo actualiza todo junto en el event loop.
+
+    def _window(self, cur, low: int, top: int) -> Dict[int, int]:
+        """{id: id_resultado} de las gestiones con los filtros del poller e id en (low, top]."""
+        where, params = rollup.range_where(self.start, self.end)
+        where += self.dim_where + ["g.id > %s", "g.id <= %s"]
+        cur.execute("/* live.window */ SELECT g.id, g.id_resultado FROM gestiones g WHERE " + " AND ".join(where),
+                    params + self.dim_params + [low, top])
+        return {int(i): int(r) for i, r in cur.fetchall()}
+
+    def _initial(self) -> Tuple[int, Dict[int, int], Set[int]]:
+        with connection() as conn:
+            cur = conn.cursor()
+            with rollup.consistent(conn) as wm:
+                # MAX(id), los conteos y las ids de la ventana salen del mismo snapshot
+                cur.execute("/* live.max_id */ SELECT COALESCE(MAX(id), 0) FROM gestiones")
+                top = int(cur.fetchone()[0])
+                src, params = rollup.source_sql(wm, self.start, self.end, "", self.dim_where,
+                                                self.dim_params, ("id_resultado",))
+                cur.execute("/* live.init */ " + src, params)
+                counts = {int(r): int(n) for r, n in cur.fetchall()}
+                seen = set(self._window(cur, max(top - config.LIVE_SAFETY_IDS, 0), top))
+            cur.close()
+        return top, counts, seen
+
+    def _increment(self) -> Tuple[int, Dict[int, int], Set[int]]:
+        """(nueva marca de agua, delta por resultado, ids contadas en este tick)."""
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("/* live.max_id */ SELECT COALESCE(MAX(id), 0) FROM gestiones")
+            top = max(int(cur.fetchone()[0]), self.watermark)
+            rows = self._window(cur, max(self.watermark - config.LIVE_SAFETY_IDS, 0), top)
+            cur.close()
+        new = {i: r for i, r in rows.items() if i not in self.seen}
+        delta: Dict[int, int] = {}
+        for r in new.values():
+            delta[r] = delta.get(r, 0) + 1
+        return top, delta, set(new)
+
+    # ---------------------------- eventos ----------------------------
+
+    def init_event(self) -> Dict[str, Any]:
+        rows = [{"id_resultado": r, "n": n} for r, n in self.counts.items()]
+        return {
+            "event": "init",
+            "data": {
+                "watermark": self.watermark,
+                "counts": self.counts,
+                "names": self.names,
+                "efectivos": sorted(config.RESULTADOS_EFECTIVOS),
+                "exitosos": sorted(config.RESULTADOS_EXITOSOS),
+                "kpis": {k: (float(v) if v is not None else None)
+                         for k, v in kpis.kpis_from(kpis.totals(rows)).items()},
+            },
+        }
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        for sub in list(self.subscribers):
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # cliente demasiado lento: se lo desconecta y al reconectar recibe un init nuevo
+                sub.closed = True
+                self.subscribers.discard(sub)
+
+    async def run(self) -> None:
+        try:
+            # el conteo inicial recorre todo el rango: pasa por la admisión de consultas pesadas
+            async with admission.heavy:
+                self.watermark, self.counts, self.seen = await run_in_threadpool(self._initial)
+        except Exception as e:
+            log.exception("Falló el cálculo inicial de KPIs en vivo")
+            self.publish({"event": "error", "data": {"detail": str(e)}})
+            for sub in list(self.subscribers):
+                sub.closed = True
+            return
+        self.ready = True
+        self.publish(self.init_event())
+        while self.subscribers:
+            await asyncio.sleep(config.LIVE_POLL_SECONDS)
+            try:
+                top, delta, counted = await run_in_threadpool(self._increment)
+            except Exception:
+                log.exception("Falló el polling de KPIs en vivo")
+                continue
+            # marca de agua, conteos y ventana cambian juntos: un init_event nunca los mezcla
+            counts = dict(self.counts)
+            for r, n in delta.items():
+                counts[r] = counts.get(r, 0) + n
+            floor = top - config.LIVE_SAFETY_IDS
+            self.watermark, self.counts = top, counts
+            self.seen = {i for i in self.seen | counted if i > floor}
+            if delta:
+                self.publish({"event": "delta", "data": {"watermark": self.watermark, "delta": delta}})
+
+class Hub:
+    """Pollers activos por clave de filtros. Todo corre en el event loop, sin locks."""
+
+    def __init__(self):
+        self.pollers: Dict[tuple, Poller] = {}
+
+    def subscribe(self, key: tuple, factory) -> "tuple[Poller, Subscriber]":
+        poller = self.pollers.get(key)
+        if poller is None or poller.task is None or poller.task.done():
+            poller = self.pollers[key] = factory()
+        sub = Subscriber()
+        poller.subscribers.add(sub)
+        if poller.ready:
+            sub.queue.put_nowait(poller.init_event())
+        if poller.task is None:
+            poller.task = asyncio.get_running_loop().create_task(poller.run())
+        return poller, sub
+
+    def unsubscribe(self, poller: Poller, sub: Subscriber) -> None:
+        poller.subscribers.discard(sub)
+        if not poller.subscribers:
+            if poller.task is not None:
+                poller.task.cancel()
+            if self.pollers.get(poller.key) is poller:
+                del self.pollers[poller.key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pollers": len(self.pollers),
+            "subscribers": sum(len(p.subscribers) for p in self.pollers.values()),
+        }
+
+hub = Hub()
+
+def _sse(event: Dict[str, Any]) -> str:
+    data = json.dumps(event["data"], default=str, separators=(",", ":"))
+    return f"event: {event['event']}\ndata: {data}\n\n"
+
+async def stream(poller: Poller, sub: Subscriber):
+    """Generador SSE de un suscriptor; al cortarse la conexión se da de baja."""
+    try:
+        yield f"retry: {int(config.LIVE_POLL_SECONDS * 1000) + 1000}\n\n"
+        while not sub.closed:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=config.LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield _sse(event)
+            if event["event"] == "error":
+                break
+    finally:
+        hub.unsubscribe(poller, sub)
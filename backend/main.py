@@ -1,11 +1,32 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
+from fastapi import FastAPI, HTTPException, Query, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, List, Tuple
-from .db import get_conn
-import json
-
-app = FastAPI(title="Dashboard de Gestión con Snapshots")
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Dict, Any, Awaitable, List, Tuple, Union
+from contextlib import asynccontextmanager
+import asyncio
+from .db import get_conn, init_pool, close_pool, pool_stats, connection, connect, run_db, gather_db, PoolTimeout
+from . import admission, cache, columnar, config, dimensions, export, ingest, kpis, live, metrics, phones, rollup, snapshots
+from .text import fold
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_pool()
+    metrics.slow_log.start(connect)
+    stop_rollup = rollup.start_refresher(connection, config.ROLLUP_REFRESH_SECONDS)
+    stop_phones = phones.start_refresher(connection, config.PHONE_INDEX_REFRESH_SECONDS)
+    stop_columnar = columnar.start_refresher(connection, config.COLUMNAR_REFRESH_SECONDS)
+    stop_snapshots = snapshots.start_scheduler(connection, config.SNAPSHOTS_HOURLY_CHECK_SECONDS)
+    yield
+    for stop in (stop_rollup, stop_phones, stop_columnar, stop_snapshots):
+        if stop:
+            stop.set()
+    metrics.slow_log.stop()
+    close_pool()
+
+app = FastAPI(title="Dashboard de Gestión con Snapshots", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,14 +34,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Next-Cursor", "Link"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(PoolTimeout)
+async def _pool_timeout(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(admission.Overloaded)
+async def _overloaded(request: Request, exc: admission.Overloaded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "2"})
 
 # ---------------------------- modelos ----------------------------
 
 class SnapshotIn(BaseModel):
+    """Sólo `filters`: lo calcula el servidor. Con `kpis` + `distribution`: se guarda lo que manda el cliente."""
     filters: Dict[str, Any]
-    kpis: Dict[str, Any]
-    distribution: List[Dict[str, Any]]
+    kpis: Optional[Dict[str, Any]] = None
+    distribution: Optional[List[Dict[str, Any]]] = None
+
+_TS_FIELD = Field(None, pattern=r"^\d{14}$", description="YYYYMMDDhhmmss")
+
+class KpiFilterIn(BaseModel):
+    start: Optional[str] = _TS_FIELD
+    end: Optional[str] = _TS_FIELD
+    campaign_id: Optional[Union[int, str]] = None
+    agent_id: Optional[Union[int, str]] = None
+
+class KpiBatchIn(BaseModel):
+    """`filters`: lista de filtros como los de /api/kpis. `group_by`: campaign/broker/day sobre los filtros comunes."""
+    filters: Optional[List[KpiFilterIn]] = None
+    group_by: Optional[List[str]] = None
+    start: Optional[str] = _TS_FIELD
+    end: Optional[str] = _TS_FIELD
+    campaign_id: Optional[Union[int, str]] = None
+    agent_id: Optional[Union[int, str]] = None
+
+class ContactosBatchIn(BaseModel):
+    telefonos: List[str] = []
+    cis: List[int] = []
 
 # ---------------------------- helpers ----------------------------
 
@@ -31,79 +84,66 @@ def _require(cond: bool, msg: str):
     if not cond:
         raise HTTPException(status_code=400, detail=msg)
 
-def _build_filters(
-    cur,
-    start: Optional[str],
-    end: Optional[str],
+def _resolve_filters(
+    dims: dimensions.Dimensions,
     campaign_token: Optional[str],
     agent_token: Optional[str],
-) -> Tuple[str, str, List[Any], Dict[str, Optional[str]]]:
+) -> Tuple[Optional[List[int]], Optional[List[int]], Dict[str, Optional[str]]]:
     """
-    Construye los JOIN/WHERE/params y además resuelve labels legibles
-    para campaña y agente (para snapshots y UI).
+    IDs de campaña y de agente para los tokens (None = sin filtro) y labels
+    legibles (para snapshots y UI). Los tokens de texto se resuelven contra el
+    cache de dimensiones. Se recortan igual que en cache.filter_key (vacío = sin
+    filtro), así dos requests con la misma clave de cache resuelven lo mismo.
     """
-    joins: List[str] = []
-    where: List[str] = []
-    params: List[Any] = []
+    campaign_token, agent_token = _token(campaign_token) or None, _token(agent_token) or None
+    campaign_ids: Optional[List[int]] = None
+    broker_ids: Optional[List[int]] = None
     labels: Dict[str, Optional[str]] = {"campaign_label": None, "agent_label": None}
 
-    # Rango de fechas
-    if start and end:
-        where.append("g.`timestamp` BETWEEN %s AND %s")
-        params += [start, end]
-    elif start:
-        where.append("g.`timestamp` >= %s")
-        params += [start]
-    elif end:
-        where.append("g.`timestamp` <= %s")
-        params += [end]
-
     # Campaign: ID o nombre/código
     if campaign_token:
         if campaign_token.isdigit():
-            where.append("g.id_campaign = %s")
-            params.append(int(campaign_token))
-            cur.execute("SELECT nombre FROM campaigns WHERE id = %s", (int(campaign_token),))
-            row = cur.fetchone()
-            labels["campaign_label"] = row["nombre"] if row else f"ID {campaign_token}"
+            campaign_ids = [int(campaign_token)]
+            labels["campaign_label"] = dims.campaign_name(int(campaign_token)) or f"ID {int(campaign_token)}"
         else:
-            joins.append("JOIN campaigns c ON c.id = g.id_campaign")
-            where.append("(c.codigo = %s OR c.nombre LIKE %s)")
-            params += [campaign_token, f"%{campaign_token}%"]
-            cur.execute(
-                "SELECT GROUP_CONCAT(DISTINCT nombre ORDER BY nombre SEPARATOR ', ') AS label "
-                "FROM campaigns WHERE (codigo = %s OR nombre LIKE %s)",
-                (campaign_token, f"%{campaign_token}%"),
-            )
-            row = cur.fetchone()
-            labels["campaign_label"] = row["label"] or campaign_token
+            campaign_ids = dims.match_campaigns(campaign_token)
+            labels["campaign_label"] = dimensions.label(dims.campaign_name(i) for i in campaign_ids) or campaign_token
 
     # Agent: ID o usuario/nombre-apellido
     if agent_token:
         if agent_token.isdigit():
-            where.append("g.id_broker = %s")
-            params.append(int(agent_token))
-            cur.execute(
-                "SELECT CONCAT(nombre, ' ', apellido) AS label FROM users WHERE id = %s",
-                (int(agent_token),),
-            )
-            row = cur.fetchone()
-            labels["agent_label"] = row["label"] if row else f"ID {agent_token}"
+            broker_ids = [int(agent_token)]
+            labels["agent_label"] = dims.agent_name(int(agent_token)) or f"ID {int(agent_token)}"
         else:
-            joins.append("JOIN users u ON u.id = g.id_broker")
-            where.append("(u.usuario = %s OR CONCAT(u.nombre,' ',u.apellido) LIKE %s)")
-            params += [agent_token, f"%{agent_token}%"]
-            cur.execute(
-                "SELECT GROUP_CONCAT(DISTINCT CONCAT(nombre,' ',apellido) ORDER BY nombre,apellido SEPARATOR ', ') AS label "
-                "FROM users WHERE (usuario = %s OR CONCAT(nombre,' ',apellido) LIKE %s)",
-                (agent_token, f"%{agent_token}%"),
-            )
-            row = cur.fetchone()
-            labels["agent_label"] = row["label"] or agent_token
-
-    join_sql = (" " + " ".join(sorted(set(joins)))) if joins else ""
-    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
-    return join_sql, where_sql, params, labels
+            broker_ids = dims.match_agents(agent_token)
+            labels["agent_label"] = dimensions.label(dims.agent_name(i) for i in broker_ids) or agent_token
+
+    return campaign_ids, broker_ids, labels
+
+def _build_filters(
+    dims: dimensions.Dimensions,
+    campaign_token: Optional[str],
+    agent_token: Optional[str],
+) -> Tuple[List[str], List[Any], Dict[str, Optional[str]]]:
+    """
+    Construye los WHERE/params de campaña y agente y además resuelve labels
+    legibles para campaña y agente. Los filtros de texto se traducen a
+    `id IN (...)`, así las consultas de KPIs no necesitan JOIN con campaigns/users.
+    El rango de fechas lo aplica rollup.source_sql.
+    """
+    campaign_ids, broker_ids, labels = _resolve_filters(dims, campaign_token, agent_token)
+    where, params = kpis.ids_where(campaign_ids, broker_ids)
+    return where, params, labels
+
+def _decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        return export.decode_cursor(cursor, size)
+    except export.BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+_PAGE_LIMIT = Query(None, ge=1, le=10000, description="Filas por página (paginación keyset)")
+_PAGE_CURSOR = Query(None, description="Cursor devuelto en X-Next-Cursor")
+_FORMAT = Query("json", pattern=r"^(json|ndjson|csv)$", description="json | ndjson | csv (streaming)")
 
 # ---------------------------- endpoints ----------------------------
 
@@ -111,12 +151,49 @@ def _build_filters(
 def health():
     return {"ok": True}
 
+@app.get("/api/health/pool")
+def health_pool():
+    """Estado del pool de conexiones (en uso, ociosas, tiempos de espera) para dimensionarlo."""
+    return pool_stats()
+
+@app.get("/api/health/cache")
+def health_cache():
+    """Aciertos, fallos y desalojos del cache de /api/kpis."""
+    return cache.kpi_cache.stats()
+
+@app.get("/api/health/admission")
+def health_admission():
+    """Consultas pesadas activas / en cola, rechazos y cálculos compartidos (single-flight)."""
+    return admission.stats()
+
+@app.get("/api/health/live")
+def health_live():
+    """Pollers de KPIs en vivo activos y suscriptores conectados."""
+    return live.hub.stats()
+
+@app.get("/api/health/slow_queries")
+def health_slow_queries():
+    """Últimas consultas por encima de SLOW_QUERY_MS, con parámetros y EXPLAIN."""
+    return jsonable_encoder(metrics.slow_log.stats())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Histogramas de requests y consultas + estado del pool, cache y SSE (formato Prometheus)."""
+    text = metrics.render({
+        "db_pool": ("Estado del pool de conexiones", pool_stats()),
+        "kpi_cache": ("Contadores del cache de /api/kpis", cache.kpi_cache.stats()),
+        "live": ("Pollers y suscriptores SSE", live.hub.stats()),
+        "admission": ("Admisión de consultas pesadas y single-flight", admission.stats()),
+    })
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 def root():
     return {"message": "API OK", "docs": "/docs"}
 
 @app.get("/api/kpis")
-def get_kpis(
+async def get_kpis(
+    request: Request,
     start: Optional[str] = Query(None, description="YYYYMMDDhhmmss"),
     end: Optional[str]   = Query(None, description="YYYYMMDDhhmmss"),
     campaign_id: Optional[str] = Query(None, description="ID, código o nombre de campaña"),
@@ -125,134 +202,459 @@ def get_kpis(
     """
     KPIs + distribución. `campaign_id` y `agent_id` aceptan ID numérico o texto.
     Si es texto, se filtra por campañas (codigo/nombre) y por agentes (usuario o nombre+apellido).
+
+    La respuesta se cachea por filtros normalizados mientras no cambien los datos de
+    gestiones; ETag/Last-Modified permiten al cliente revalidar y recibir 304.
+
+    Las consultas corren en el executor de DB (el endpoint no ocupa un hilo del
+    threadpool mientras espera). Si no hay nada cacheado para estos filtros, la
+    marca de agua y los conteos se consultan en paralelo, cada uno en su conexión;
+    salvo en una revalidación (If-None-Match / If-Modified-Since): ahí primero se
+    resuelve el 304 y los conteos sólo se calculan si hace falta responder 200.
+    Requests concurrentes con los mismos filtros comparten un único cálculo, que
+    pasa por la admisión de consultas pesadas (503 si está saturada).
     """
+    summary_task = None
+    # un solo token normalizado para la clave de cache y para resolver los filtros
+    campaign_id, agent_id = _token(campaign_id) or None, _token(agent_id) or None
     try:
-        conn = get_conn()
-        cur = conn.cursor(dictionary=True)
-
-        join_sql, where_sql, params, labels = _build_filters(cur, start, end, campaign_id, agent_id)
-
-        # KPIs (sin vistas): contactabilidad, PB, PN
-        sql_kpis = f"""
-            SELECT
-              ROUND(100 * SUM(g.id_resultado IN (1,2,8,10,11,14,16)) / NULLIF(COUNT(*),0), 2) AS contactabilidad,
-              ROUND(100 * SUM(g.id_resultado = 1) / NULLIF(COUNT(*),0), 2) AS penetracion_bruta,
-              ROUND(100 * SUM(g.id_resultado = 1) /
-                    NULLIF(SUM(g.id_resultado IN (1,2,8,10,11,14,16)),0), 2) AS penetracion_neta
-            FROM gestiones g
-            {join_sql}
-            {where_sql}
-        """
-        cur.execute(sql_kpis, params)
-        kpis = cur.fetchone() or {"contactabilidad": 0, "penetracion_bruta": 0, "penetracion_neta": 0}
-
-        # Distribución por resultado
-        sql_dist = f"""
-            SELECT r.nombre AS resultado, COUNT(*) AS cantidad
-            FROM gestiones g
-            {join_sql}
-            JOIN gestiones_resultado r ON r.id = g.id_resultado
-            {where_sql}
-            GROUP BY r.id, r.nombre
-            ORDER BY cantidad DESC
-        """
-        cur.execute(sql_dist, params)
-        distribution = cur.fetchall() or []
-
-       
-        cur.execute(f"""
-            SELECT c.nombre AS campaña,
-                   CONCAT(u.nombre,' ',u.apellido) AS agente,
-                   COUNT(*) AS gestiones
-            FROM gestiones g
-            JOIN campaigns c ON c.id = g.id_campaign
-            JOIN users u     ON u.id = g.id_broker
-            {where_sql}
-            GROUP BY c.id, u.id
-            ORDER BY gestiones DESC
-            LIMIT 10
-        """, params)
-        top_resumen = cur.fetchall() or []
+        key = cache.filter_key(start, end, campaign_id, agent_id)
+        seen = cache.data_watermark.peek()
+        conditional = "if-none-match" in request.headers or "if-modified-since" in request.headers
+        if key not in cache.kpi_cache and not conditional:
+            summary_task = asyncio.ensure_future(_kpis_summary_shared(key, start, end, campaign_id, agent_id))
+        wm = await run_db(_kpis_watermark)
+        headers = {
+            "ETag": cache.etag(key, wm),
+            "Last-Modified": cache.data_watermark.last_modified(),
+            "Cache-Control": "no-cache",
+        }
+        if cache.not_modified(request.headers, headers["ETag"], headers["Last-Modified"]):
+            _discard(summary_task)
+            return Response(status_code=304, headers=headers)
+
+        if summary_task is not None:
+            summary = await summary_task
+            # los conteos corrieron en paralelo con la marca de agua: se cachean sólo
+            # si la marca de agua no cambió desde antes de lanzarlos
+            if seen == wm[:-1]:
+                cache.kpi_cache.put(key, wm, summary)
+        else:
+            summary = cache.kpi_cache.get(key, wm)
+            if summary is None:
+                summary = await _kpis_summary_shared(key, start, end, campaign_id, agent_id)
+                cache.kpi_cache.put(key, wm, summary)
+
+        body = _kpis_body(summary, start, end, campaign_id, agent_id)
+        with metrics.step("kpis.serialize"):
+            return JSONResponse(jsonable_encoder(body), headers=headers)
+    except (PoolTimeout, admission.Overloaded):
+        _discard(summary_task)
+        raise
+    except Exception as e:
+        _discard(summary_task)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _kpis_summary_shared(key: tuple, start, end, campaign_id, agent_id) -> Awaitable[Dict[str, Any]]:
+    return admission.run(("kpis",) + key, lambda: run_db(_kpis_summary, start, end, campaign_id, agent_id))
+
+def _kpis_watermark(conn) -> tuple:
+    # Los labels salen de las dimensiones: una recarga también invalida
+    return cache.data_watermark.current(conn) + (dimensions.get(conn).version,)
 
+def _kpis_summary(conn, start, end, campaign_id, agent_id) -> Dict[str, Any]:
+    with metrics.step("kpis.build_filters"):
+        dims = dimensions.get(conn)
+        campaign_ids, broker_ids, labels = _resolve_filters(dims, campaign_id, agent_id)
+
+    # Una sola pasada agrupada; KPIs, distribución y top se derivan de los conteos
+    rows = kpis.counts(conn, start, end, campaign_ids, broker_ids)
+    with metrics.step("kpis.summarize"):
+        return {**kpis.summarize(rows), "labels": labels}
+
+def _discard(task: Optional["asyncio.Future"]) -> None:
+    """
+    Abandona una consulta lanzada en paralelo cuyo resultado ya no hace falta. No
+    se cancela: puede estar compartida (single-flight) con otros requests.
+    """
+    if task is not None:
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+def _kpis_body(summary: Dict[str, Any], start, end, campaign_id, agent_id) -> Dict[str, Any]:
+    return {
+        "kpis": summary["kpis"],
+        "distribution": summary["distribution"],
+        "top_resumen": summary["top_resumen"],
+        "filters": {
+            "start": start,
+            "end": end,
+            "campaign_id": campaign_id,
+            "agent_id": agent_id,
+            "campaign_label": summary["labels"]["campaign_label"],
+            "agent_label": summary["labels"]["agent_label"],
+        },
+    }
+
+def _token(v: Union[int, str, None]) -> Optional[str]:
+    return str(v).strip() if v is not None else None
+
+def _union_ids(groups: List[Optional[List[int]]]) -> Optional[List[int]]:
+    """IDs para la consulta compartida: si algún filtro no restringe, no se restringe."""
+    if any(g is None for g in groups):
+        return None
+    return sorted({i for g in groups for i in g})
+
+def _day_aligned(start: Optional[str], end: Optional[str]) -> bool:
+    return (start is None or start.endswith("000000")) and (end is None or end.endswith("235959"))
+
+def _batch_context(conn) -> Tuple[tuple, dimensions.Dimensions]:
+    dims = dimensions.get(conn)
+    return cache.data_watermark.current(conn) + (dims.version,), dims
+
+def _batch_pass(conn, start, end, members, sets: List[KpiFilterIn], by_day: bool) -> List[Tuple[int, tuple, Dict[str, Any]]]:
+    """Una consulta agrupada para los filtros `members` y el resumen de cada uno, recortado en memoria."""
+    rows = kpis.counts(conn, start, end, _union_ids([m[2] for m in members]), _union_ids([m[3] for m in members]),
+                       ("day",) if by_day else ())
+    index = kpis.RowIndex(rows)
+    out = []
+    with metrics.step("kpis.batch_summarize"):
+        for i, key, campaign_ids, broker_ids, labels in members:
+            f = sets[i]
+            days = (f.start[:8] if f.start else None, f.end[:8] if f.end else None) if by_day else None
+            out.append((i, key, {**kpis.summarize(index.select(campaign_ids, broker_ids, days)), "labels": labels}))
+    return out
+
+async def _kpis_for_sets(sets: List[KpiFilterIn]) -> Dict[str, Any]:
+    """
+    Un resultado por filtro, igual al de /api/kpis. Los que están en el cache
+    salen de ahí; el resto se resuelve con una consulta agrupada por rango de
+    fechas distinto (en paralelo, cada una en su conexión), o una sola agrupada
+    por día si todos los rangos son de días completos. Cada subconjunto se
+    recorta en memoria y se guarda en el cache.
+    """
+    wm, dims = await run_db(_batch_context)
+    summaries: List[Optional[Dict[str, Any]]] = []
+    pending: List[Tuple[int, tuple, Optional[List[int]], Optional[List[int]], Dict[str, Optional[str]]]] = []
+    for i, f in enumerate(sets):
+        c_tok, a_tok = _token(f.campaign_id), _token(f.agent_id)
+        key = cache.filter_key(f.start, f.end, c_tok, a_tok)
+        summary = cache.kpi_cache.get(key, wm)
+        if summary is None:
+            pending.append((i, key) + _resolve_filters(dims, c_tok, a_tok))
+        summaries.append(summary)
+
+    ranges = {(sets[i].start, sets[i].end) for i, *_ in pending}
+    if len(ranges) > 1 and all(_day_aligned(s, e) for s, e in ranges):
+        starts = [s for s, _ in ranges]
+        ends = [e for _, e in ranges]
+        passes = [(None if None in starts else min(starts), None if None in ends else max(ends), pending, True)]
+    else:
+        passes = [(s, e, [p for p in pending if (sets[p[0]].start, sets[p[0]].end) == (s, e)], False)
+                  for s, e in sorted(ranges, key=lambda r: (r[0] or "", r[1] or ""))]
+
+    results = await gather_db([(_batch_pass, (start, end, members, sets, by_day))
+                               for start, end, members, by_day in passes])
+    for i, key, summary in (item for result in results for item in result):
+        cache.kpi_cache.put(key, wm, summary)
+        summaries[i] = summary
+
+    return {
+        "results": [_kpis_body(s, f.start, f.end, f.campaign_id, f.agent_id) for s, f in zip(summaries, sets)],
+        "cache_hits": len(sets) - len(pending),
+        "consultas": len(passes),
+    }
+
+def _kpis_grouped(conn, payload: KpiBatchIn) -> Dict[str, Any]:
+    dims = dimensions.get(conn)
+    c_tok, a_tok = _token(payload.campaign_id), _token(payload.agent_id)
+    campaign_ids, broker_ids, labels = _resolve_filters(dims, c_tok, a_tok)
+    extra = ("day",) if "day" in payload.group_by else ()
+    rows = kpis.counts(conn, payload.start, payload.end, campaign_ids, broker_ids, extra)
+    with metrics.step("kpis.batch_grouped"):
         return {
-            "kpis": kpis,
-            "distribution": distribution,
-            "top_resumen": top_resumen,
+            "group_by": payload.group_by,
+            **kpis.grouped(rows, payload.group_by),
+            "filters": {
+                "start": payload.start,
+                "end": payload.end,
+                "campaign_id": payload.campaign_id,
+                "agent_id": payload.agent_id,
+                **labels,
+            },
+            "consultas": 1,
+        }
+
+@app.post("/api/kpis/batch")
+async def get_kpis_batch(payload: KpiBatchIn):
+    """
+    Varios cálculos de KPIs en un request:
+      - `filters`: lista de filtros (start/end/campaign_id/agent_id como /api/kpis);
+        devuelve `results` en el mismo orden, cada uno idéntico a /api/kpis.
+      - `group_by`: subconjunto ordenado de campaign/broker/day sobre los filtros
+        comunes; devuelve `rows` con subtotales (estilo WITH ROLLUP) y `total`,
+        que coincide con /api/kpis para esos filtros.
+    Todo sale de una sola pasada agrupada sobre gestiones (vía rollup).
+    """
+    _require((payload.filters is None) != (payload.group_by is None), "Debe enviar 'filters' o 'group_by' (uno solo)")
+    if payload.filters is not None:
+        _require(0 < len(payload.filters) <= config.KPI_BATCH_MAX,
+                 f"'filters' debe tener entre 1 y {config.KPI_BATCH_MAX} elementos")
+    else:
+        _require(payload.group_by and len(set(payload.group_by)) == len(payload.group_by)
+                 and all(g in kpis.GROUP_BY for g in payload.group_by),
+                 f"'group_by' debe ser una lista sin repetidos de: {', '.join(kpis.GROUP_BY)}")
+
+    try:
+        async with admission.heavy:
+            if payload.filters is not None:
+                body = await _kpis_for_sets(payload.filters)
+            else:
+                body = await run_db(_kpis_grouped, payload)
+        return JSONResponse(jsonable_encoder(body))
+    except (PoolTimeout, admission.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+SERIES_MAX_BUCKETS = 5000
+
+def _series_rows(conn, start, end, campaign_id, agent_id, split):
+    dims = dimensions.get(conn)
+    dim_where, dim_params, filter_labels = _build_filters(dims, campaign_id, agent_id)
+    return kpis.fetch_series_counts(conn, start, end, dim_where, dim_params, split), dims, filter_labels
+
+@app.get("/api/kpis/series")
+async def get_kpis_series(
+    start: str = Query(..., pattern=r"^\d{14}$", description="YYYYMMDDhhmmss"),
+    end: str   = Query(..., pattern=r"^\d{14}$", description="YYYYMMDDhhmmss"),
+    granularity: str = Query("day", pattern=r"^(hour|day|week)$", description="hour | day | week"),
+    split: Optional[str] = Query(None, pattern=r"^(campaign|broker)$", description="Una serie por campaña o por agente"),
+    campaign_id: Optional[str] = Query(None, description="ID, código o nombre de campaña"),
+    agent_id: Optional[str] = Query(None, description="ID, usuario o nombre y apellido del agente"),
+):
+    """
+    Contactabilidad/PB/PN por hora, día o semana (semanas desde el lunes) en columnas:
+    `buckets` tiene las etiquetas y cada serie un arreglo por métrica alineado con ellas.
+    Los filtros de campaña/agente se interpretan igual que en /api/kpis. La consulta
+    es una agregación pesada: corre en el executor de DB, se comparte entre requests
+    con los mismos filtros y pasa por la admisión (503 si está saturada).
+    """
+    campaign_id, agent_id = _token(campaign_id) or None, _token(agent_id) or None
+    _require(start <= end, "'start' debe ser menor o igual a 'end'")
+    try:
+        labels = kpis.bucket_labels(start, end, granularity)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fecha inválida en 'start' o 'end'")
+    _require(len(labels) <= SERIES_MAX_BUCKETS, f"Demasiados buckets ({len(labels)}); máximo {SERIES_MAX_BUCKETS}")
+
+    try:
+        # los conteos no dependen de la granularidad: se comparten entre hour/day/week
+        key = ("series", split) + cache.filter_key(start, end, campaign_id, agent_id)
+        rows, dims, filter_labels = await admission.run(
+            key, lambda: run_db(_series_rows, start, end, campaign_id, agent_id, split))
+        name = {"campaign": dims.campaign_name, "broker": dims.agent_name}.get(split)
+        body = {
+            "granularity": granularity,
+            "buckets": labels,
+            "series": kpis.series(rows, labels, granularity, split, name),
             "filters": {
                 "start": start,
                 "end": end,
                 "campaign_id": campaign_id,
                 "agent_id": agent_id,
-                "campaign_label": labels["campaign_label"],
-                "agent_label": labels["agent_label"],
+                "split": split,
+                **filter_labels,
             },
         }
+        return JSONResponse(jsonable_encoder(body))
+    except (PoolTimeout, admission.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _live_filters(campaign_id: Optional[str], agent_id: Optional[str]):
+    with connection() as conn:
+        dims = dimensions.get(conn)
+    dim_where, dim_params, _ = _build_filters(dims, campaign_id, agent_id)
+    return dim_where, dim_params, dict(dims.resultados)
+
+@app.get("/api/kpis/stream")
+async def get_kpis_stream(
+    start: Optional[str] = Query(None, description="YYYYMMDDhhmmss"),
+    end: Optional[str]   = Query(None, description="YYYYMMDDhhmmss"),
+    campaign_id: Optional[str] = Query(None, description="ID, código o nombre de campaña"),
+    agent_id: Optional[str] = Query(None, description="ID, usuario o nombre y apellido del agente"),
+):
+    """
+    Server-Sent Events: un `init` con los conteos por resultado y luego `delta`
+    con las gestiones nuevas. Los suscriptores con los mismos filtros comparten
+    un único poller incremental.
+    """
+    key = cache.filter_key(start, end, campaign_id, agent_id)
+    poller = live.hub.pollers.get(key)
+    if poller is None:
+        dim_where, dim_params, names = await run_in_threadpool(_live_filters, campaign_id, agent_id)
+        factory = lambda: live.Poller(key, start, end, dim_where, dim_params, names)
+    else:
+        factory = lambda: live.Poller(key, start, end, poller.dim_where, poller.dim_params, poller.names)
+    poller, sub = live.hub.subscribe(key, factory)
+    return StreamingResponse(
+        live.stream(poller, sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ---------------------------- carga masiva ----------------------------
+
+@app.post("/api/gestiones/bulk")
+async def gestiones_bulk(
+    request: Request,
+    format: Optional[str] = Query(None, pattern=r"^(ndjson|csv)$", description="Por defecto, según Content-Type"),
+    dry_run: bool = Query(False, description="Sólo valida, no escribe"),
+):
+    """
+    Carga masiva de gestiones: el cuerpo es NDJSON (una gestión por línea) o CSV
+    con encabezado. Valida las claves foráneas contra el cache de dimensiones y
+    escribe en lotes (INSERT multi-fila + commit por lote). Devuelve el reporte
+    con throughput por lote y las filas rechazadas (con su número de línea).
+    Si falla la escritura de un lote responde 500 con el reporte: los lotes
+    anteriores quedan guardados.
+    """
+    size = request.headers.get("content-length")
+    _require(size is None or not size.isdigit() or int(size) <= config.INGEST_MAX_BYTES,
+             f"Cuerpo demasiado grande; máximo {config.INGEST_MAX_BYTES} bytes")
+    body = await request.body()
+    _require(len(body) <= config.INGEST_MAX_BYTES, f"Cuerpo demasiado grande; máximo {config.INGEST_MAX_BYTES} bytes")
+    _require(body.strip() != b"", "Cuerpo vacío")
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El cuerpo debe estar en UTF-8")
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+
+    try:
+        report = await run_db(ingest.load, ingest.records(ingest.split_lines(text), fmt), None, dry_run)
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(report, status_code=500 if "error" in report else 200)
+
 # ---------------------------- snapshots ----------------------------
 
+async def _cached_summary(start, end, campaign_id, agent_id) -> Dict[str, Any]:
+    """Resumen de /api/kpis para esos filtros, desde el cache si está vigente."""
+    key = cache.filter_key(start, end, campaign_id, agent_id)
+    wm = await run_db(_kpis_watermark)
+    summary = cache.kpi_cache.get(key, wm)
+    if summary is None:
+        summary = await _kpis_summary_shared(key, start, end, campaign_id, agent_id)
+        cache.kpi_cache.put(key, wm, summary)
+    return summary
+
 @app.post("/api/snapshots")
-def create_snapshot(payload: SnapshotIn):
+async def create_snapshot(payload: SnapshotIn):
     """
-    Guarda el snapshot tal cual lo envía el frontend. Como en /api/kpis
-    ya agregamos campaign_label/agent_label dentro de filters, los snapshots
-    nuevos quedarán con esa info legible.
+    Sólo con `filters` (start/end/campaign_id/agent_id, como /api/kpis) el
+    servidor calcula los KPIs y la distribución con el mismo pipeline y los
+    guarda (source='server'); los filtros repetidos se guardan una sola vez.
+    Si además vienen `kpis` y `distribution` se rechaza (400), salvo que se haya
+    activado el modo anterior con SNAPSHOTS_CLIENT_KPIS=1: ahí se guardan tal
+    cual los manda el frontend (source='client').
     """
+    if payload.kpis is not None or payload.distribution is not None:
+        _require(config.SNAPSHOTS_CLIENT_KPIS, "Los snapshots se calculan en el servidor: enviar sólo 'filters'")
+        _require(payload.kpis is not None and payload.distribution is not None,
+                 "Para guardar KPIs del cliente hay que enviar 'kpis' y 'distribution'")
+        try:
+            return {"id": await run_db(snapshots.insert_client, payload.filters, payload.kpis, payload.distribution),
+                    "source": "client"}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO dashboard_snapshots(filters_json, kpis_json, distribution_json) VALUES (%s, %s, %s)",
-            (json.dumps(payload.filters), json.dumps(payload.kpis), json.dumps(payload.distribution)),
-        )
-        snapshot_id = cur.lastrowid
-        return {"id": snapshot_id}
+        f = KpiFilterIn.model_validate(payload.filters)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=e.errors(include_url=False, include_context=False))
+    c_tok, a_tok = _token(f.campaign_id), _token(f.agent_id)
+    try:
+        summary = await _cached_summary(f.start, f.end, c_tok, a_tok)
+        item = (snapshots.normalize_filters(f.start, f.end, c_tok, a_tok), summary)
+        snapshot_id, _ = await run_db(snapshots.insert, [item], "server")
+        return {"id": snapshot_id, "source": "server"}
+    except (PoolTimeout, admission.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/snapshots/hourly")
+async def create_hourly_snapshots(hour: Optional[str] = Query(None, pattern=r"^\d{10}$", description="YYYYMMDDhh")):
+    """
+    Un snapshot por campaña para la hora indicada (por defecto, la anterior),
+    de una sola consulta agrupada e insertados en lote. Repetirlo no duplica.
+    """
+    try:
+        async with admission.heavy:
+            return await run_db(snapshots.hourly, hour or snapshots.previous_hour())
+    except (PoolTimeout, admission.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/snapshots")
-def list_snapshots():
+def list_snapshots(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500, description="Filas por página"),
+    cursor: Optional[str] = _PAGE_CURSOR,
+    source: Optional[str] = Query(None, pattern=r"^(client|server|hourly)$"),
+    conn = Depends(get_conn),
+):
+    """
+    Campos resumidos (KPIs, total de gestiones, rango y labels), del más nuevo
+    al más viejo. Paginación keyset sobre (created_at, id): el cursor de la
+    página siguiente llega en X-Next-Cursor.
+    """
+    after = _decode_cursor(cursor, 2) if cursor else None
     try:
-        conn = get_conn()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT id, created_at, filters_json, kpis_json
-            FROM dashboard_snapshots
-            ORDER BY created_at DESC
-            LIMIT 100
-        """)
-        return cur.fetchall()
+        rows = snapshots.list_page(conn, limit, after, source)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    rows, next_cursor = export.page(rows, limit, lambda r: (r["created_at"], r["id"]))
+    return JSONResponse(jsonable_encoder(rows), headers=export.page_headers(request, next_cursor))
 
 @app.get("/api/snapshots/{snapshot_id}")
-def get_snapshot(snapshot_id: int):
+def get_snapshot(snapshot_id: int, conn = Depends(get_conn)):
     try:
-        conn = get_conn()
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT id, created_at, filters_json, kpis_json, distribution_json
-            FROM dashboard_snapshots
-            WHERE id = %s
-        """, (snapshot_id,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Snapshot no encontrado")
-        return row
+        row = snapshots.get(conn, snapshot_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not row:
+        raise HTTPException(status_code=404, detail="Snapshot no encontrado")
+    return row
 
 # ---------------------------- consultas típicas ----------------------------
 
 @app.get("/api/consultas/gestiones")
 def gestiones_por_operador_fecha(
+    request: Request,
     operator_id: int = Query(..., alias="operator_id"),
     date: str = Query(..., pattern=r"^\d{8}$"),  # YYYYMMDD
-    conn = Depends(get_conn),
+    limit: Optional[int] = _PAGE_LIMIT,
+    cursor: Optional[str] = _PAGE_CURSOR,
+    format: str = _FORMAT,
 ):
+    """
+    Orden: timestamp DESC, id DESC. Cursor sobre (timestamp, id).
+    Sin Depends(get_conn): en streaming la conexión la toma el stream.
+    """
     start = f"{date}000000"; end = f"{date}235959"
-    sql = """
+    where = ["g.id_broker = %s", "g.`timestamp` BETWEEN %s AND %s"]
+    params: List[Any] = [operator_id, start, end]
+    if cursor:
+        clause, p = export.keyset_where(["g.`timestamp`", "g.id"], _decode_cursor(cursor, 2), desc=True)
+        where.append(clause); params += p
+    sql = f"""
+      /* consultas.gestiones */
       SELECT g.id, g.id_campaign, c.nombre AS campaña,
              g.id_contacto, co.nombre1, co.apellido1,
              r.nombre AS resultado, g.notas, g.`timestamp`
@@ -260,72 +662,103 @@ def gestiones_por_operador_fecha(
       JOIN campaigns c ON c.id = g.id_campaign
       JOIN contactos co ON co.id = g.id_contacto
       LEFT JOIN gestiones_resultado r ON r.id = g.id_resultado
-      WHERE g.id_broker = %s
-        AND g.`timestamp` BETWEEN %s AND %s
-      ORDER BY g.`timestamp` DESC
+      WHERE {" AND ".join(where)}
+      ORDER BY g.`timestamp` DESC, g.id DESC
+      {"LIMIT %s" if limit else ""}
     """
-    cur = _dict_cur(conn); cur.execute(sql, (operator_id, start, end))
-    return cur.fetchall()
+    if limit:
+        params.append(limit + 1)
+    if format != "json":
+        columns = ["id", "id_campaign", "campaña", "id_contacto", "nombre1", "apellido1", "resultado", "notas", "timestamp"]
+        return export.stream_query(sql, params, format, columns, f"gestiones_{operator_id}_{date}")
+
+    with connection() as conn:
+        cur = _dict_cur(conn); cur.execute(sql, tuple(params))
+        fetched = cur.fetchall()
+    rows, next_cursor = export.page(fetched, limit, lambda r: (r["timestamp"], r["id"]))
+    return JSONResponse(jsonable_encoder(rows), headers=export.page_headers(request, next_cursor))
 
 @app.get("/api/consultas/no_contesta")
 def contactos_no_contesta(
+    request: Request,
     campaign_id: int,
-    conn = Depends(get_conn),
+    limit: Optional[int] = _PAGE_LIMIT,
+    cursor: Optional[str] = _PAGE_CURSOR,
+    format: str = _FORMAT,
 ):
-    sql = """
+    """Orden: apellido1, nombre1, id. Cursor sobre (apellido1, nombre1, id). Conexión como en /gestiones."""
+    where = ["g.id_campaign = %s", "UPPER(r.nombre) = UPPER('No contesta')"]
+    params: List[Any] = [campaign_id]
+    if cursor:
+        clause, p = export.keyset_where(["co.apellido1", "co.nombre1", "co.id"], _decode_cursor(cursor, 3))
+        where.append(clause); params += p
+    sql = f"""
+      /* consultas.no_contesta */
       SELECT DISTINCT co.id, co.ci, co.nombre1, co.apellido1
       FROM gestiones g
       JOIN contactos co ON co.id = g.id_contacto
       JOIN gestiones_resultado r ON r.id = g.id_resultado
-      WHERE g.id_campaign = %s
-        AND UPPER(r.nombre) = UPPER('No contesta')
-      ORDER BY co.apellido1, co.nombre1
+      WHERE {" AND ".join(where)}
+      ORDER BY co.apellido1, co.nombre1, co.id
+      {"LIMIT %s" if limit else ""}
     """
-    cur = _dict_cur(conn); cur.execute(sql, (campaign_id,))
-    return cur.fetchall()
+    if limit:
+        params.append(limit + 1)
+    if format != "json":
+        return export.stream_query(sql, params, format, ["id", "ci", "nombre1", "apellido1"],
+                                   f"no_contesta_{campaign_id}")
+
+    with connection() as conn:
+        cur = _dict_cur(conn); cur.execute(sql, tuple(params))
+        fetched = cur.fetchall()
+    rows, next_cursor = export.page(fetched, limit, lambda r: (r["apellido1"], r["nombre1"], r["id"]))
+    return JSONResponse(jsonable_encoder(rows), headers=export.page_headers(request, next_cursor))
+
+_RENDIMIENTO_COLS = [
+    "id_campaign", "campaña", "id_broker", "operador", "gestiones", "efectivas", "exitosas",
+    "contactabilidad", "penetracion_bruta", "penetracion_neta",
+]
+
+def _rendimiento_rows(conn, start, end, campaign_ids, broker_ids) -> List[Dict[str, Any]]:
+    return kpis.rendimiento(kpis.counts(conn, start, end, campaign_ids, broker_ids))
+
+def _rendimiento_key(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (r["campaña"], r["operador"], r["id_campaign"], r["id_broker"])
 
 @app.get("/api/consultas/rendimiento")
-def rendimiento(
+async def rendimiento(
+    request: Request,
     start: Optional[str] = Query(None, pattern=r"^\d{14}$"),  # YYYYMMDDhhmmss
     end:   Optional[str] = Query(None, pattern=r"^\d{14}$"),
     campaign_id: Optional[int] = None,
     agent_id: Optional[int] = None,
-    conn = Depends(get_conn),
+    limit: Optional[int] = _PAGE_LIMIT,
+    cursor: Optional[str] = _PAGE_CURSOR,
+    format: str = _FORMAT,
 ):
-    where: List[str] = []
-    params: List[Any] = []
-    if start and end:
-        where.append("g.`timestamp` BETWEEN %s AND %s")
-        params += [start, end]
-    if campaign_id:
-        where.append("g.id_campaign = %s")
-        params.append(campaign_id)
-    if agent_id:
-        where.append("g.id_broker = %s")
-        params.append(agent_id)
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-
-    sql = f"""
-      SELECT
-        g.id_campaign,
-        c.nombre AS campaña,
-        g.id_broker,
-        CONCAT(u.nombre, ' ', u.apellido) AS operador,
-        COUNT(*) AS gestiones,
-        SUM(g.id_resultado IN (1,2,8,10,11,14,16)) AS efectivas,
-        SUM(g.id_resultado = 1) AS exitosas,
-        ROUND(100 * SUM(g.id_resultado IN (1,2,8,10,11,14,16)) / NULLIF(COUNT(*),0), 2) AS contactabilidad,
-        ROUND(100 * SUM(g.id_resultado = 1) / NULLIF(COUNT(*),0), 2) AS penetracion_bruta,
-        ROUND(100 * SUM(g.id_resultado = 1) / NULLIF(SUM(g.id_resultado IN (1,2,8,10,11,14,16)),0), 2) AS penetracion_neta
-      FROM gestiones g
-      JOIN campaigns c ON c.id = g.id_campaign
-      JOIN users u     ON u.id = g.id_broker
-      {where_sql}
-      GROUP BY g.id_campaign, c.nombre, g.id_broker, operador
-      ORDER BY campaña, operador
     """
-    cur = _dict_cur(conn); cur.execute(sql, tuple(params))
-    return cur.fetchall()
+    Orden: campaña, operador. Las filas ya vienen agregadas (campaña × operador),
+    así que el cursor (campaña, operador, id_campaign, id_broker) se aplica en memoria.
+    Requests concurrentes con los mismos filtros comparten un único cálculo (las
+    páginas se recortan después), que pasa por la admisión de consultas pesadas.
+    """
+    if not (start and end):
+        start = end = None
+
+    campaign_ids = [campaign_id] if campaign_id else None
+    broker_ids = [agent_id] if agent_id else None
+    rows = await admission.run(("rendimiento", start, end, campaign_id or None, agent_id or None),
+                               lambda: run_db(_rendimiento_rows, start, end, campaign_ids, broker_ids))
+    if cursor:
+        after = _decode_cursor(cursor, 4)
+        after_key = (fold(after[0]), fold(after[1]), after[2], after[3])
+        rows = [r for r in rows
+                if (fold(r["campaña"]), fold(r["operador"]), r["id_campaign"], r["id_broker"]) > after_key]
+    if format != "json":
+        return export.stream_rows(rows[:limit] if limit else rows, format, _RENDIMIENTO_COLS, "rendimiento")
+
+    rows, next_cursor = export.page(rows, limit, _rendimiento_key)
+    return JSONResponse(jsonable_encoder(rows), headers=export.page_headers(request, next_cursor))
 
 @app.get("/api/consultas/contactos")
 def buscar_contactos(
@@ -333,83 +766,67 @@ def buscar_contactos(
     ci: Optional[int] = None,
     conn = Depends(get_conn),
 ):
+    """El teléfono se normaliza ('+598 99 123 456' = '099123456' = 99123456) y se busca en el índice inverso."""
     _require(telefono or ci, "Debe enviar 'telefono' o 'ci'")
-    cur = _dict_cur(conn)
 
     if telefono:
-        sql = """
-          SELECT co.id, co.ci, co.nombre1, co.apellido1, t.numero AS telefono
-          FROM contactos co
-          JOIN telefonos t
-            ON t.id IN (co.id_tel_fijo1, co.id_tel_fijo2, co.id_tel_movil1, co.id_tel_movil2)
-          WHERE t.numero = %s
-        """
-        cur.execute(sql, (telefono,))
-        return cur.fetchall()
-
-    sql = "SELECT co.id, co.ci, co.nombre1, co.apellido1 FROM contactos co WHERE co.ci = %s"
-    cur.execute(sql, (ci,))
-    return cur.fetchall()
+        numero = phones.normalize(telefono)
+        if numero is None:
+            return []
+        rows = phones.lookup(conn, [numero], [])
+        return [{"id": r["id"], "ci": r["ci"], "nombre1": r["nombre1"], "apellido1": r["apellido1"],
+                 "telefono": r["clave"]} for r in rows]
+
+    rows = phones.lookup(conn, [], [ci])
+    return [{"id": r["id"], "ci": r["ci"], "nombre1": r["nombre1"], "apellido1": r["apellido1"]} for r in rows]
+
+@app.post("/api/consultas/contactos/batch")
+def buscar_contactos_batch(payload: ContactosBatchIn, conn = Depends(get_conn)):
+    """
+    Resuelve cientos de teléfonos y/o documentos en una sola consulta. Devuelve un
+    item por valor recibido, en el mismo orden, con sus contactos (lista vacía si no hay).
+    """
+    total = len(payload.telefonos) + len(payload.cis)
+    _require(total > 0, "Debe enviar 'telefonos' o 'cis'")
+    _require(total <= config.CONTACTOS_BATCH_MAX,
+             f"Demasiados valores ({total}); máximo {config.CONTACTOS_BATCH_MAX}")
+
+    numeros = [phones.normalize(t) for t in payload.telefonos]
+    try:
+        rows = phones.lookup(conn, [n for n in numeros if n is not None], payload.cis)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    found: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+    for r in rows:
+        found.setdefault((r["por"], r["clave"]), []).append(
+            {"id": r["id"], "ci": r["ci"], "nombre1": r["nombre1"], "apellido1": r["apellido1"]})
+    return {
+        "telefonos": [{"telefono": t, "normalizado": n, "contactos": found.get(("telefono", n), [])}
+                      for t, n in zip(payload.telefonos, numeros)],
+        "cis": [{"ci": c, "contactos": found.get(("ci", c), [])} for c in payload.cis],
+    }
 
 @app.get("/api/campaigns")
-def campaigns(q: Optional[str] = Query(None, description="Texto a buscar"), limit: int = 10):
+def campaigns(q: Optional[str] = Query(None, description="Texto a buscar"), limit: int = 10, conn = Depends(get_conn)):
     """
-    Devuelve campañas para autocompletar. Busca por nombre o código (LIKE).
+    Devuelve campañas para autocompletar. Busca por nombre o código (subcadena,
+    sin distinguir mayúsculas ni tildes) sobre el cache de dimensiones.
     Si no se envía q, devuelve las primeras N ordenadas por nombre.
     """
     try:
-        conn = get_conn()
-        cur = conn.cursor(dictionary=True)
-        if q:
-            cur.execute(
-                """
-                SELECT id, codigo, nombre
-                FROM campaigns
-                WHERE nombre LIKE %s OR codigo LIKE %s
-                ORDER BY nombre
-                LIMIT %s
-                """,
-                (f"%{q}%", f"%{q}%", limit),
-            )
-        else:
-            cur.execute(
-                "SELECT id, codigo, nombre FROM campaigns ORDER BY nombre LIMIT %s",
-                (limit,),
-            )
-        return cur.fetchall()
+        return dimensions.get(conn).search_campaigns(q, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/agents")
-def agents(q: Optional[str] = Query(None, description="Texto a buscar"), limit: int = 10):
+def agents(q: Optional[str] = Query(None, description="Texto a buscar"), limit: int = 10, conn = Depends(get_conn)):
     """
-    Devuelve agentes para autocompletar. Busca por usuario o por nombre y apellido (LIKE).
+    Devuelve agentes para autocompletar. Busca por usuario o por nombre y apellido
+    (subcadena, sin distinguir mayúsculas ni tildes) sobre el cache de dimensiones.
     Si no se envía q, devuelve los primeros N ordenados por nombre/apellido.
     """
     try:
-        conn = get_conn()
-        cur = conn.cursor(dictionary=True)
-        if q:
-            cur.execute(
-                """
-                SELECT id, usuario, CONCAT(nombre,' ',apellido) AS nombre_completo
-                FROM users
-                WHERE usuario LIKE %s OR CONCAT(nombre,' ',apellido) LIKE %s
-                ORDER BY nombre, apellido
-                LIMIT %s
-                """,
-                (f"%{q}%", f"%{q}%", limit),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, usuario, CONCAT(nombre,' ',apellido) AS nombre_completo
-                FROM users
-                ORDER BY nombre, apellido
-                LIMIT %s
-                """,
-                (limit,),
-            )
-        return cur.fetchall()
+        return dimensions.get(conn).search_agents(q, limit)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,356 @@
+"""
+Métricas de requests y consultas, expuestas en /metrics (formato texto de Prometheus).
+
+- Middleware ASGI: histograma de duración por endpoint (plantilla de ruta),
+  método y status, y header `Server-Timing` con el tiempo de base, de espera
+  del pool y total de cada request.
+- Cursor instrumentado (ver db.py): histograma de latencia y de filas por
+  nombre de consulta. El nombre sale de un comentario inicial en el SQL
+  (`/* kpis.counts */ SELECT ...`) o, si no hay, de verbo + primera tabla.
+- Pasos de la aplicación (`with metrics.step("build_filters"):`).
+- Consultas lentas (más de SLOW_QUERY_MS): se registran con sus parámetros y
+  un EXPLAIN automático, hecho en un hilo aparte con su propia conexión para
+  no demorar el request. Los full scans (type=ALL sobre muchas filas) se
+  informan como WARNING.
+"""
+import contextvars
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# ---------------------------- histogramas ----------------------------
+
+class Histogram:
+    """Histograma acumulativo por combinación de labels, al estilo Prometheus."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [conteo por bucket..., suma, total]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, s in sorted(series.items()):
+            base = _labels(self.labels, labels)
+            for le, n in zip(self.buckets, s):
+                out.append(f"{self.name}_bucket{{{base}le=\"{_num(le)}\"}} {n}")
+            out.append(f"{self.name}_bucket{{{base}le=\"+Inf\"}} {s[-1]}")
+            out.append(f"{self.name}_sum{_braces(base)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_braces(base)} {s[-1]}")
+        return out
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = dict(self._series)
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, v in sorted(series.items()):
+            out.append(f"{self.name}{_braces(_labels(self.labels, labels))} {_num(v)}")
+        return out
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return "".join(f'{n}="{_escape(v)}",' for n, v in zip(names, values))
+
+def _braces(labels: str) -> str:
+    return "{" + labels.rstrip(",") + "}" if labels else ""
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Duración de requests HTTP",
+                            ("endpoint", "method", "status"), LATENCY_BUCKETS)
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "Duración de consultas (execute + fetch)",
+                          ("query",), LATENCY_BUCKETS)
+QUERY_ROWS = Histogram("db_query_rows", "Filas leídas por consulta", ("query",), ROW_BUCKETS)
+POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Espera por una conexión del pool", (), LATENCY_BUCKETS)
+STEP_SECONDS = Histogram("app_step_duration_seconds", "Duración de pasos de la aplicación", ("step",),
+                         LATENCY_BUCKETS)
+SLOW_QUERIES = Counter("db_slow_queries_total", "Consultas por encima de SLOW_QUERY_MS", ("query",))
+FULL_SCANS = Counter("db_full_scans_total", "Consultas lentas con full scan según EXPLAIN", ("query", "table"))
+
+_ALL = (REQUEST_SECONDS, QUERY_SECONDS, QUERY_ROWS, POOL_WAIT_SECONDS, STEP_SECONDS, SLOW_QUERIES, FULL_SCANS)
+
+# ---------------------------- contexto del request ----------------------------
+
+class RequestTimings:
+    """`db` suma el tiempo de todas las consultas, aunque corran en paralelo en varias conexiones."""
+    __slots__ = ("db", "queries", "pool_wait", "lock")
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.pool_wait = 0.0
+        self.lock = threading.Lock()
+
+    def server_timing(self, total: float) -> str:
+        return (f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+                f"pool;dur={self.pool_wait * 1000:.1f}, total;dur={total * 1000:.1f}")
+
+# Objeto mutable: los hilos del threadpool heredan la referencia y suman sobre el mismo
+_timings: "contextvars.ContextVar[Optional[RequestTimings]]" = contextvars.ContextVar("timings", default=None)
+
+@contextmanager
+def step(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STEP_SECONDS.observe(time.perf_counter() - t0, name)
+
+def observe_pool_wait(seconds: float) -> None:
+    POOL_WAIT_SECONDS.observe(seconds)
+    t = _timings.get()
+    if t is not None:
+        with t.lock:
+            t.pool_wait += seconds
+
+def add_db_time(seconds: float, queries: int = 0) -> None:
+    t = _timings.get()
+    if t is not None:
+        with t.lock:
+            t.db += seconds
+            t.queries += queries
+
+# ---------------------------- nombres de consultas ----------------------------
+
+_NAMED = re.compile(r"^\s*/\*\s*([\w.:-]+)\s*\*/")
+_VERB_TABLE = re.compile(
+    r"^\s*(?:/\*.*?\*/\s*)?(SELECT|INSERT|UPDATE|DELETE|REPLACE|EXPLAIN|SHOW|SET|START|COMMIT|ROLLBACK)\b"
+    r"(?:.*?\b(?:FROM|INTO|UPDATE)\s+`?(\w+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+@lru_cache(maxsize=2048)
+def query_name(sql: str) -> str:
+    m = _NAMED.match(sql)
+    if m:
+        return m.group(1)
+    m = _VERB_TABLE.match(sql)
+    if not m:
+        return "other"
+    verb, table = m.group(1).lower(), m.group(2)
+    return f"{verb}:{table}" if table else verb
+
+def observe_query(sql: str, seconds: float, rows: int, params: Any) -> None:
+    name = query_name(sql)
+    QUERY_SECONDS.observe(seconds, name)
+    QUERY_ROWS.observe(rows, name)
+    if config.SLOW_QUERY_MS > 0 and seconds * 1000 >= config.SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(name)
+        slow_log.submit(name, sql, params, seconds * 1000, rows)
+
+# ---------------------------- consultas lentas ----------------------------
+
+def _short(v: Any, limit: int) -> str:
+    s = v if isinstance(v, str) else repr(v)
+    return s if len(s) <= limit else s[:limit] + f"... ({len(s)} chars)"
+
+class SlowQueryLog:
+    """
+    Cola acotada de consultas lentas procesada por un hilo propio: log con
+    parámetros + EXPLAIN. Si la cola se llena se descartan (se cuentan igual
+    en db_slow_queries_total).
+    """
+
+    def __init__(self, keep: int, maxsize: int = 100):
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.dropped = 0
+        # (entrada, SQL original): el EXPLAIN usa el SQL tal cual, el log la versión compacta
+        self._queue: "queue.Queue[Optional[Tuple[Dict[str, Any], str]]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._connect: Optional[Callable[[], Any]] = None
+        self._conn = None
+
+    def start(self, connect: Callable[[], Any]) -> None:
+        """`connect` abre una conexión fuera del pool (no instrumentada) para los EXPLAIN."""
+        if self._thread is not None:
+            return
+        self._connect = connect
+        self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def submit(self, name: str, sql: str, params: Any, ms: float, rows: int) -> None:
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "query": name,
+            "ms": round(ms, 1),
+            "rows": rows,
+            "sql": " ".join(sql.split()),
+            "params": params,
+        }
+        if self._thread is None:
+            self._record(entry)
+            return
+        try:
+            self._queue.put_nowait((entry, sql))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            entry, sql = item
+            try:
+                if config.SLOW_QUERY_EXPLAIN:
+                    entry["explain"] = self._explain(sql, entry["params"])
+            except Exception as e:
+                entry["explain_error"] = str(e)
+                self._drop_conn()
+            self._record(entry)
+
+    def _explain(self, sql: str, params: Any) -> Optional[List[Dict[str, Any]]]:
+        head = _NAMED.sub("", sql).lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        if head not in ("SELECT", "WITH"):
+            return None
+        if self._conn is None:
+            self._conn = self._connect()
+        cur = self._conn.cursor(dictionary=True)
+        try:
+            cur.execute("EXPLAIN " + sql, params or ())
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def _drop_conn(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        scans = [r.get("table") for r in entry.get("explain") or ()
+                 if r.get("type") == "ALL" and (r.get("rows") or 0) >= config.SLOW_QUERY_FULL_SCAN_ROWS]
+        entry["full_scan"] = scans
+        for table in scans:
+            FULL_SCANS.inc(entry["query"], str(table))
+        self.recent.append(entry)
+        msg = "Consulta lenta %s: %.1f ms, %d filas | %s | params=%s"
+        args = (entry["query"], entry["ms"], entry["rows"], _short(entry["sql"], 2000), _short(entry["params"], 500))
+        if scans:
+            log.warning(msg + " | FULL SCAN de %s | explain=%s", *args, ", ".join(map(str, scans)), entry.get("explain"))
+        else:
+            log.info(msg + " | explain=%s", *args, entry.get("explain", entry.get("explain_error")))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": config.SLOW_QUERY_MS,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "recent": list(self.recent),
+        }
+
+slow_log = SlowQueryLog(config.SLOW_QUERY_KEEP)
+
+# ---------------------------- middleware y exposición ----------------------------
+
+class MetricsMiddleware:
+    """Mide cada request HTTP y agrega `Server-Timing` (db, pool, total) a la respuesta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing",
+                                                     timings.server_timing(time.perf_counter() - t0))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _timings.reset(token)
+            # el router deja la ruta resuelta en el scope: se usa la plantilla, no la URL
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint, scope["method"], str(status))
+
+def _gauges(name: str, help: str, values: Dict[str, Any], kind: str = "gauge") -> List[str]:
+    out = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for key, v in values.items():
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            out.append(f'{name}{{key="{_escape(key)}"}} {_num(v)}')
+    return out
+
+def render(extra: Dict[str, Tuple[str, Dict[str, Any]]]) -> str:
+    """Texto de Prometheus; `extra` agrega gauges {nombre: (ayuda, {clave: valor})}."""
+    lines: List[str] = []
+    for metric in _ALL:
+        lines += metric.render()
+    for name, (help, values) in extra.items():
+        lines += _gauges(name, help, values)
+    return "\n".join(lines) + "\n"
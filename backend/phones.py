@@ -0,0 +1,274 @@
+"""
+Índice inverso de teléfonos (tabla contacto_telefono, ver sql/07_contacto_telefono.sql).
+
+Buscar un contacto por teléfono con `t.id IN (co.id_tel_fijo1, ...)` recorre
+contactos entero, porque sólo id_tel_fijo1 tiene índice. contacto_telefono
+guarda (numero_normalizado, id_contacto, slot) con el número como prefijo de
+la PK, así una búsqueda es un rango sobre el índice.
+
+El refresco es incremental por `contactos.lastupdate`: se rehacen las filas de
+los contactos modificados desde la marca de agua. Las búsquedas combinan el
+índice (contactos anteriores a la marca de agua) con la consulta cruda para
+los modificados después, así el resultado no depende de cuándo corrió el
+último refresco. Un cambio de `telefonos.numero` no toca lastupdate: en ese
+caso hay que correr `rebuild`.
+
+Uso:
+    python -m backend.phones refresh   # rehace los contactos modificados
+    python -m backend.phones rebuild   # reconstruye todo desde cero
+    python -m backend.phones check     # compara el índice contra los contactos
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+STATE_KEY = "contactos"
+
+# se reprocesa este margen hacia atrás por si una transacción larga hizo commit tarde
+_MARGIN_SECONDS = 60
+
+_SLOTS = {1: "id_tel_fijo1", 2: "id_tel_fijo2", 3: "id_tel_movil1", 4: "id_tel_movil2"}
+
+# ---------------------------- normalización ----------------------------
+
+def normalize(raw: Any) -> Optional[int]:
+    """
+    Número como lo guarda telefonos.numero: sólo dígitos, sin ceros a la
+    izquierda (prefijo internacional 00 o de larga distancia 0) y sin el código
+    de país si viene adelante. '+598 99 123 456', '099123456' -> 99123456.
+    """
+    digits = re.sub(r"\D", "", str(raw)).lstrip("0")
+    cc = config.PHONE_COUNTRY_CODE
+    if cc and digits.startswith(cc) and len(digits) - len(cc) >= config.PHONE_NATIONAL_DIGITS:
+        digits = digits[len(cc):].lstrip("0")
+    if not digits or len(digits) > 15:
+        return None
+    return int(digits)
+
+def _numero_sql(col: str) -> str:
+    """La misma normalización en SQL, para números ya guardados (sin ceros a la izquierda)."""
+    cc = config.PHONE_COUNTRY_CODE
+    if not cc:
+        return col
+    if not cc.isdigit():
+        raise ValueError(f"PHONE_COUNTRY_CODE inválido: {cc!r}")
+    return (f"IF(LEFT({col}, {len(cc)}) = '{cc}' AND CHAR_LENGTH({col}) - {len(cc)} >= {config.PHONE_NATIONAL_DIGITS}, "
+            f"CAST(SUBSTRING({col}, {len(cc) + 1}) AS UNSIGNED), {col})")
+
+def _raw_candidates(numeros: Sequence[int]) -> List[int]:
+    """
+    Valores de telefonos.numero que _numero_sql lleva a esos números: el número
+    tal cual y, si le corresponde, con el código de país (y un 0) adelante.
+    """
+    cc = config.PHONE_COUNTRY_CODE
+    out = set(numeros)
+    if cc:
+        for n in numeros:
+            if len(str(n)) >= config.PHONE_NATIONAL_DIGITS:
+                out.update((int(f"{cc}{n}"), int(f"{cc}0{n}")))
+    return sorted(out)
+
+def _slot_sql() -> str:
+    return " ".join(f"WHEN {n} THEN co.{col}" for n, col in _SLOTS.items())
+
+def _select_sql(where: str) -> str:
+    """(numero_normalizado, id_contacto, slot) para los contactos que cumplen `where`."""
+    slots = " UNION ALL ".join(f"SELECT {n} AS slot" for n in _SLOTS)
+    return f"""
+      SELECT {_numero_sql("t.numero")} AS numero_normalizado, co.id AS id_contacto, s.slot
+      FROM contactos co
+      JOIN ({slots}) s
+      JOIN telefonos t ON t.id = CASE s.slot {_slot_sql()} END
+      WHERE {where}
+    """
+
+_WM_SQL = ("COALESCE((SELECT last_update FROM contacto_telefono_state WHERE nombre = %s), "
+           "'1970-01-01 00:00:00')")
+
+# ---------------------------- búsqueda ----------------------------
+
+def _in(col: str, values: Sequence[Any]) -> str:
+    return f"{col} IN ({', '.join(['%s'] * len(values))})"
+
+def lookup(conn, numeros: Sequence[int], cis: Sequence[int]) -> List[Dict[str, Any]]:
+    """
+    Contactos para una lista de números normalizados y/o de documentos, en una
+    sola consulta. Cada fila trae `por` ('telefono' | 'ci') y `clave` (el
+    número normalizado o el documento buscado).
+    """
+    numeros = sorted(set(numeros))
+    cis = sorted(set(cis))
+    parts: List[str] = []
+    params: List[Any] = []
+    cols = "co.id, co.ci, co.nombre1, co.apellido1"
+    if numeros and config.PHONE_INDEX_ENABLED:
+        parts.append(f"""
+          SELECT 'telefono' AS por, ct.numero_normalizado AS clave, {cols}
+          FROM contacto_telefono ct
+          JOIN contactos co ON co.id = ct.id_contacto
+          WHERE {_in("ct.numero_normalizado", numeros)} AND co.lastupdate < {_WM_SQL}
+          UNION
+          SELECT 'telefono', {_numero_sql("t.numero")}, {cols}
+          FROM contactos co
+          JOIN telefonos t ON t.id IN ({", ".join(f"co.{c}" for c in _SLOTS.values())})
+          WHERE co.lastupdate >= {_WM_SQL} AND {_in(_numero_sql("t.numero"), numeros)}
+        """)
+        params += numeros + [STATE_KEY, STATE_KEY] + numeros
+    elif numeros:
+        # sin índice: t.numero IN (candidatos crudos) usa UNIQUE(numero); la expresión
+        # normalizada sólo se evalúa sobre esas filas y descarta los que no son del número buscado
+        raw = _raw_candidates(numeros)
+        parts.append(f"""
+          SELECT DISTINCT 'telefono' AS por, {_numero_sql("t.numero")} AS clave, {cols}
+          FROM contactos co
+          JOIN telefonos t ON t.id IN ({", ".join(f"co.{c}" for c in _SLOTS.values())})
+          WHERE {_in("t.numero", raw)} AND {_in(_numero_sql("t.numero"), numeros)}
+        """)
+        params += raw + numeros
+    if cis:
+        parts.append(f"SELECT 'ci' AS por, co.ci AS clave, {cols} FROM contactos co WHERE {_in('co.ci', cis)}")
+        params += cis
+    if not parts:
+        return []
+    # `por` distingue las partes, así que UNION sólo quita duplicados dentro de cada una
+    sql = "/* contactos.lookup */ " + " UNION ".join(parts) + " ORDER BY por, clave, id"
+    cur = conn.cursor(dictionary=True)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    for r in rows:
+        r["clave"] = int(r["clave"])
+    return rows
+
+# ---------------------------- mantenimiento ----------------------------
+
+def _watermark(cur, lock: bool = False) -> str:
+    cur.execute("SELECT last_update FROM contacto_telefono_state WHERE nombre = %s"
+                + (" FOR UPDATE" if lock else ""), (STATE_KEY,))
+    row = cur.fetchone()
+    if row is None:
+        if lock:
+            cur.execute("INSERT INTO contacto_telefono_state (nombre) VALUES (%s)", (STATE_KEY,))
+        return "1970-01-01 00:00:00"
+    return str(row[0])
+
+def refresh(conn) -> Dict[str, Any]:
+    """
+    Rehace las filas de los contactos con lastupdate >= marca de agua, en una
+    transacción. El FOR UPDATE sobre el estado serializa refrescos concurrentes.
+    """
+    cur = conn.cursor()
+    conn.start_transaction()
+    try:
+        since = _watermark(cur, lock=True)
+        cur.execute("SELECT NOW() - INTERVAL %s SECOND", (_MARGIN_SECONDS,))
+        upto = cur.fetchone()[0]
+        cur.execute("DELETE ct FROM contacto_telefono ct JOIN contactos co ON co.id = ct.id_contacto "
+                    "WHERE co.lastupdate >= %s", (since,))
+        deleted = cur.rowcount
+        cur.execute("INSERT IGNORE INTO contacto_telefono (numero_normalizado, id_contacto, slot) "
+                    + _select_sql("co.lastupdate >= %s"), (since,))
+        inserted = cur.rowcount
+        cur.execute("UPDATE contacto_telefono_state SET last_update = %s WHERE nombre = %s", (upto, STATE_KEY))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {"since": since, "watermark": str(upto), "deleted": deleted, "inserted": inserted}
+
+def rebuild(conn) -> Dict[str, Any]:
+    """Reconstruye el índice completo en una sola transacción."""
+    cur = conn.cursor()
+    conn.start_transaction()
+    try:
+        _watermark(cur, lock=True)
+        cur.execute("SELECT NOW() - INTERVAL %s SECOND", (_MARGIN_SECONDS,))
+        upto = cur.fetchone()[0]
+        cur.execute("DELETE FROM contacto_telefono")
+        cur.execute("INSERT IGNORE INTO contacto_telefono (numero_normalizado, id_contacto, slot) "
+                    + _select_sql("1 = 1"))
+        inserted = cur.rowcount
+        cur.execute("UPDATE contacto_telefono_state SET last_update = %s WHERE nombre = %s", (upto, STATE_KEY))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {"watermark": str(upto), "rows": inserted}
+
+def check(conn) -> Dict[str, Any]:
+    """Diferencias entre el índice y los contactos anteriores a la marca de agua (faltantes y sobrantes)."""
+    cur = conn.cursor()
+    conn.start_transaction(consistent_snapshot=True, readonly=True)
+    try:
+        since = _watermark(cur)
+        expected = _select_sql("co.lastupdate < %s")
+        cur.execute(f"""
+          SELECT COUNT(*) FROM ({expected}) e
+          LEFT JOIN contacto_telefono ct
+            ON ct.numero_normalizado = e.numero_normalizado AND ct.id_contacto = e.id_contacto AND ct.slot = e.slot
+          WHERE ct.id_contacto IS NULL
+        """, (since,))
+        missing = cur.fetchone()[0]
+        cur.execute(f"""
+          SELECT COUNT(*) FROM contacto_telefono ct
+          JOIN contactos co ON co.id = ct.id_contacto AND co.lastupdate < %s
+          LEFT JOIN ({expected}) e
+            ON e.numero_normalizado = ct.numero_normalizado AND e.id_contacto = ct.id_contacto AND e.slot = ct.slot
+          WHERE e.id_contacto IS NULL
+        """, (since, since))
+        extra = cur.fetchone()[0]
+    finally:
+        conn.rollback()
+        cur.close()
+    return {"watermark": since, "missing": missing, "extra": extra, "ok": not missing and not extra}
+
+# ---------------------------- refresco en segundo plano ----------------------------
+
+def start_refresher(connection, interval: float) -> Optional[threading.Event]:
+    """Como rollup.start_refresher: refresh() cada `interval` segundos en un hilo daemon."""
+    if interval <= 0 or not config.PHONE_INDEX_ENABLED:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with connection() as conn:
+                    refresh(conn)
+            except Exception:
+                log.exception("Falló el refresco del índice de teléfonos")
+
+    threading.Thread(target=loop, name="phones-refresher", daemon=True).start()
+    return stop
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import connect
+
+    ap = argparse.ArgumentParser(prog="python -m backend.phones", description=__doc__.split("\n\n")[0])
+    ap.add_argument("command", choices=["refresh", "rebuild", "check"])
+    args = ap.parse_args(argv)
+
+    conn = connect()
+    try:
+        out = {"refresh": refresh, "rebuild": rebuild, "check": check}[args.command](conn)
+    finally:
+        conn.close()
+    print(json.dumps(out, indent=2, default=str))
+    return 0 if out.get("ok", True) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""
+Rollup horario de `gestiones` (tabla gestiones_rollup, ver sql/05_rollup.sql).
+
+Cada fila cuenta las gestiones de un bucket YYYYMMDDhh (prefijo del CHAR(14)
+`timestamp`) por campaña, agente y resultado. El refresco es incremental:
+sólo se vuelcan las filas con `id` mayor a la marca de agua de rollup_state.
+
+Las consultas combinan el rollup (buckets completos dentro del rango, filas
+hasta la marca de agua) con filas crudas de gestiones (buckets parciales de
+los extremos y filas nuevas aún no volcadas), así el resultado es idéntico
+al de consultar sólo gestiones.
+
+Uso:
+    python -m backend.rollup refresh   # vuelca las filas nuevas
+    python -m backend.rollup rebuild   # reconstruye todo desde cero
+    python -m backend.rollup check     # compara rollup vs consultas crudas
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+STATE_KEY = "gestiones"
+
+_TS = re.compile(r"^\d{14}$")
+
+# columna lógica -> (expresión en gestiones, expresión en gestiones_rollup)
+_COLS = {
+    "bucket": ("LEFT(g.`timestamp`, 10)", "g.bucket"),
+    "day": ("LEFT(g.`timestamp`, 8)", "LEFT(g.bucket, 8)"),
+    "id_campaign": ("g.id_campaign", "g.id_campaign"),
+    "id_broker": ("g.id_broker", "g.id_broker"),
+    "id_resultado": ("g.id_resultado", "g.id_resultado"),
+}
+
+# ---------------------------- lectura ----------------------------
+
+def watermark(cur) -> int:
+    cur.execute("SELECT last_id FROM rollup_state WHERE nombre = %s", (STATE_KEY,))
+    row = cur.fetchone()
+    if not row:
+        return 0
+    return int(row["last_id"] if isinstance(row, dict) else row[0])
+
+@contextmanager
+def consistent(conn):
+    """
+    Abre una transacción de sólo lectura con snapshot consistente y entrega la
+    marca de agua: el rollup y la marca de agua se leen en el mismo instante,
+    aunque un refresco haga commit en el medio. Entrega None si el rollup
+    está deshabilitado (ROLLUP_ENABLED=0); el snapshot se abre igual, para que
+    el llamador pueda hacer varias lecturas coherentes entre sí.
+    """
+    conn.start_transaction(consistent_snapshot=True, isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        wm = None
+        if config.ROLLUP_ENABLED:
+            cur = conn.cursor()
+            wm = watermark(cur)
+            cur.close()
+        yield wm
+    finally:
+        conn.rollback()
+
+def range_where(start: Optional[str], end: Optional[str]) -> Tuple[List[str], List[Any]]:
+    where: List[str] = []
+    params: List[Any] = []
+    if start and end:
+        where.append("g.`timestamp` BETWEEN %s AND %s")
+        params += [start, end]
+    elif start:
+        where.append("g.`timestamp` >= %s")
+        params += [start]
+    elif end:
+        where.append("g.`timestamp` <= %s")
+        params += [end]
+    return where, params
+
+def source_sql(
+    wm: Optional[int],
+    start: Optional[str],
+    end: Optional[str],
+    join_sql: str,
+    dim_where: Sequence[str],
+    dim_params: Sequence[Any],
+    by: Sequence[str],
+) -> Tuple[str, List[Any]]:
+    """
+    SQL de una tabla derivada con las columnas `by` + `n` (cantidad de
+    gestiones) para el rango [start, end] y los filtros de dimensión dados.
+    Los filtros usan el alias `g` y sólo pueden referirse a id_campaign,
+    id_broker e id_resultado (o a tablas unidas por `join_sql`).
+
+    Con `wm` None (rollup deshabilitado) o con límites que no son
+    YYYYMMDDhhmmss se consulta sólo gestiones.
+    """
+    raw_cols = ", ".join(f"{_COLS[c][0]} AS {c}" for c in by)
+    roll_cols = ", ".join(f"{_COLS[c][1]} AS {c}" for c in by)
+    group = ", ".join(by)
+
+    raw_where, raw_params = range_where(start, end)
+    raw_where += list(dim_where)
+    raw_params += list(dim_params)
+
+    usable = wm is not None and all(ts is None or _TS.match(ts) for ts in (start, end))
+    if not usable:
+        sql = f"""
+            SELECT {raw_cols}, COUNT(*) AS n
+            FROM gestiones g{join_sql}
+            {"WHERE " + " AND ".join(raw_where) if raw_where else ""}
+            GROUP BY {group}
+        """
+        return sql, raw_params
+
+    # Buckets completamente cubiertos por el rango -> rollup.
+    # El resto (extremos parciales y filas posteriores a la marca de agua) -> crudo.
+    roll_where = list(dim_where)
+    roll_params: List[Any] = list(dim_params)
+    outside = ["g.id > %s"]
+    outside_params: List[Any] = [wm]
+    if start:
+        if start[10:] == "0000":
+            roll_where.append("g.bucket >= %s")
+        else:
+            roll_where.append("g.bucket > %s")
+            outside.append("g.`timestamp` <= %s")
+            outside_params.append(start[:10] + "9999")
+        roll_params.append(start[:10])
+    if end:
+        if end[10:] >= "5959":
+            roll_where.append("g.bucket <= %s")
+        else:
+            roll_where.append("g.bucket < %s")
+            outside.append("g.`timestamp` >= %s")
+            outside_params.append(end[:10] + "0000")
+        roll_params.append(end[:10])
+    raw_where.append("(" + " OR ".join(outside) + ")")
+    raw_params += outside_params
+
+    sql = f"""
+        SELECT {group}, SUM(n) AS n FROM (
+            SELECT {roll_cols}, SUM(g.cantidad) AS n
+            FROM gestiones_rollup g{join_sql}
+            {"WHERE " + " AND ".join(roll_where) if roll_where else ""}
+            GROUP BY {group}
+            UNION ALL
+            SELECT {raw_cols}, COUNT(*) AS n
+            FROM gestiones g{join_sql}
+            WHERE {" AND ".join(raw_where)}
+            GROUP BY {group}
+        ) x
+        GROUP BY {group}
+    """
+    return sql, roll_params + raw_params
+
+# ---------------------------- mantenimiento ----------------------------
+
+_UPSERT = """
+    INSERT INTO gestiones_rollup (bucket, id_campaign, id_broker, id_resultado, cantidad)
+    SELECT LEFT(g.`timestamp`, 10), g.id_campaign, g.id_broker, g.id_resultado, COUNT(*)
+    FROM gestiones g
+    WHERE g.id > %s AND g.id <= %s
+    GROUP BY 1, 2, 3, 4
+    ON DUPLICATE KEY UPDATE cantidad = cantidad + VALUES(cantidad)
+"""
+
+def _safe_top(cur) -> int:
+    """
+    Hasta dónde se puede volcar: MAX(id) menos ROLLUP_SAFETY_IDS. Un id asignado
+    antes pero confirmado después de leer MAX(id) quedaría debajo de la marca
+    de agua sin volcar (y fuera también de la parte cruda); con el margen, las
+    filas más nuevas se siguen leyendo de gestiones hasta el próximo refresco.
+    """
+    cur.execute("SELECT MAX(id) FROM gestiones")
+    top = cur.fetchone()[0] or 0
+    return max(top - config.ROLLUP_SAFETY_IDS, 0)
+
+def refresh(conn, batch: Optional[int] = None) -> Dict[str, int]:
+    """
+    Vuelca al rollup las gestiones con id mayor a la marca de agua, en lotes
+    de `batch` ids, cada uno en su propia transacción. El SELECT ... FOR UPDATE
+    sobre rollup_state serializa refrescos concurrentes. Las últimas
+    ROLLUP_SAFETY_IDS gestiones quedan sin volcar (ver _safe_top).
+
+    Sólo contempla inserciones: si se modifican o borran gestiones ya
+    volcadas hay que correr `rebuild`.
+    """
+    batch = batch or config.ROLLUP_BATCH
+    cur = conn.cursor()
+    top = _safe_top(cur)
+    applied = 0
+    while True:
+        conn.start_transaction()
+        try:
+            cur.execute("SELECT last_id FROM rollup_state WHERE nombre = %s FOR UPDATE", (STATE_KEY,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("INSERT INTO rollup_state (nombre, last_id) VALUES (%s, 0)", (STATE_KEY,))
+                last = 0
+            else:
+                last = row[0]
+            if last >= top:
+                conn.commit()
+                break
+            upto = min(top, last + batch)
+            cur.execute(_UPSERT, (last, upto))
+            cur.execute("UPDATE rollup_state SET last_id = %s WHERE nombre = %s", (upto, STATE_KEY))
+            conn.commit()
+            applied += upto - last
+        except Exception:
+            conn.rollback()
+            raise
+    cur.close()
+    return {"watermark": max(top, 0), "ids_applied": applied}
+
+def rebuild(conn) -> Dict[str, int]:
+    """
+    Reconstruye el rollup completo en una sola transacción: los lectores
+    siguen viendo la versión anterior hasta el commit.
+    """
+    cur = conn.cursor()
+    conn.start_transaction()
+    try:
+        top = _safe_top(cur)
+        cur.execute("DELETE FROM gestiones_rollup")
+        cur.execute(_UPSERT, (0, top))
+        cur.execute(
+            "INSERT INTO rollup_state (nombre, last_id) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)",
+            (STATE_KEY, top),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {"watermark": top}
+
+def check(conn, samples: int = 20) -> Dict[str, Any]:
+    """
+    Verifica el rollup contra gestiones:
+      - diferencias fila a fila hasta la marca de agua;
+      - respuestas de source_sql con y sin rollup para rangos de muestra
+        (día completo, horas parciales, por campaña y por agente).
+    """
+    cur = conn.cursor()
+    conn.start_transaction(consistent_snapshot=True, isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        wm = watermark(cur)
+        cur.execute("""
+            SELECT bucket, id_campaign, id_broker, id_resultado, SUM(n) AS diff FROM (
+                SELECT bucket, id_campaign, id_broker, id_resultado, cantidad AS n
+                FROM gestiones_rollup
+                UNION ALL
+                SELECT LEFT(`timestamp`, 10), id_campaign, id_broker, id_resultado, -COUNT(*)
+                FROM gestiones WHERE id <= %s
+                GROUP BY 1, 2, 3, 4
+            ) d
+            GROUP BY bucket, id_campaign, id_broker, id_resultado
+            HAVING diff <> 0
+            LIMIT 50
+        """, (wm,))
+        mismatched = [list(r) for r in cur.fetchall()]
+
+        cur.execute("SELECT MIN(`timestamp`), MAX(`timestamp`) FROM gestiones")
+        lo, hi = cur.fetchone()
+        cur.execute("SELECT DISTINCT id_campaign FROM gestiones_rollup LIMIT 5")
+        camps = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT DISTINCT id_broker FROM gestiones_rollup LIMIT 5")
+        brokers = [r[0] for r in cur.fetchall()]
+
+        cases: List[Tuple[Optional[str], Optional[str], List[str], List[Any]]] = [(None, None, [], [])]
+        if lo and hi:
+            cases += [
+                (lo, hi, [], []),
+                (lo[:8] + "000000", lo[:8] + "235959", [], []),
+                (lo[:10] + "1530", hi[:10] + "4512", [], []),
+                (lo[:10] + "0000", lo[:10] + "5959", [], []),
+            ]
+            cases += [(lo, hi, ["g.id_campaign = %s"], [c]) for c in camps]
+            cases += [(lo[:10] + "3000", None, ["g.id_broker = %s"], [b]) for b in brokers]
+        cases = cases[:samples]
+
+        by = ("id_campaign", "id_broker", "id_resultado")
+        failures = []
+        for start, end, where, params in cases:
+            answers = []
+            for mark in (wm, None):
+                sql, p = source_sql(mark, start, end, "", where, params, by)
+                cur.execute(sql, p)
+                answers.append(sorted((int(a), int(b), int(c), int(n)) for a, b, c, n in cur.fetchall()))
+            if answers[0] != answers[1]:
+                failures.append({"start": start, "end": end, "where": where, "params": params})
+    finally:
+        conn.rollback()
+        cur.close()
+    return {
+        "watermark": wm,
+        "mismatched_groups": mismatched,
+        "cases": len(cases),
+        "failed_cases": failures,
+        "ok": not mismatched and not failures,
+    }
+
+# ---------------------------- refresco en segundo plano ----------------------------
+
+def start_refresher(connection, interval: float) -> Optional[threading.Event]:
+    """
+    Hilo daemon que llama a refresh() cada `interval` segundos usando
+    `connection()` (context manager del pool). Devuelve el Event para detenerlo.
+    """
+    if interval <= 0 or not config.ROLLUP_ENABLED:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with connection() as conn:
+                    refresh(conn)
+            except Exception:
+                log.exception("Falló el refresco del rollup")
+
+    threading.Thread(target=loop, name="rollup-refresher", daemon=True).start()
+    return stop
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import connect
+
+    ap = argparse.ArgumentParser(prog="python -m backend.rollup", description=__doc__.split("\n\n")[0])
+    ap.add_argument("command", choices=["refresh", "rebuild", "check"])
+    ap.add_argument("--samples", type=int, default=20, help="casos de muestra para `check`")
+    args = ap.parse_args(argv)
+
+    conn = connect()
+    try:
+        if args.command == "refresh":
+            out = refresh(conn)
+        elif args.command == "rebuild":
+            out = rebuild(conn)
+        else:
+            out = check(conn, args.samples)
+    finally:
+        conn.close()
+    print(json.dumps(out, indent=2, default=str))
+    return 0 if out.get("ok", True) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
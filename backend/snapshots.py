@@ -0,0 +1,258 @@
+"""
+Snapshots de KPIs calculados en el servidor (ver sql/08_snapshots_compact.sql).
+
+- Los KPIs salen del mismo pipeline que /api/kpis: el cliente sólo manda los
+  filtros, así un snapshot no se puede falsificar.
+- Los filtros se normalizan (como las claves del cache de /api/kpis) y cada
+  combinación se guarda una vez en snapshot_filters.
+- Contactabilidad, PB, PN y total de gestiones van en columnas: el listado no
+  lee JSON. La distribución se guarda como JSON o, si supera
+  SNAPSHOT_COMPRESS_BYTES, comprimida con zlib.
+- Los snapshots programados (uno por campaña para una hora) salen de una sola
+  consulta agrupada y se insertan en lote; `period` + UNIQUE los hace idempotentes.
+
+Uso:
+    python -m backend.snapshots hourly                 # hora completa anterior
+    python -m backend.snapshots hourly --hour 2025063014
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import threading
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import cache, config, dimensions, export, kpis
+
+log = logging.getLogger(__name__)
+
+SOURCES = ("client", "server", "hourly")
+
+# filas por INSERT multi-fila
+_CHUNK = 500
+
+# ---------------------------- filtros ----------------------------
+
+def normalize_filters(start: Optional[str], end: Optional[str], campaign: Optional[str],
+                      agent: Optional[str]) -> Dict[str, Optional[str]]:
+    start, end, campaign, agent = cache.filter_key(start, end, campaign, agent)
+    return {"start": start, "end": end, "campaign_id": campaign, "agent_id": agent}
+
+def filter_hash(filters: Dict[str, Optional[str]]) -> bytes:
+    return hashlib.sha1(json.dumps(filters, sort_keys=True, separators=(",", ":")).encode()).digest()
+
+def _filter_ids(cur, items: Sequence[Tuple[Dict[str, Optional[str]], Dict[str, Optional[str]]]]) -> List[int]:
+    """IDs de snapshot_filters para cada (filtros, labels), insertando los que faltan en un solo INSERT."""
+    hashes = [filter_hash(f) for f, _ in items]
+    unique = {h: {**f, **labels} for h, (f, labels) in zip(hashes, items)}
+    values = ", ".join(["(%s, %s)"] * len(unique))
+    params: List[Any] = []
+    for h, doc in unique.items():
+        params += [h, json.dumps(doc)]
+    cur.execute("INSERT INTO snapshot_filters (filter_hash, filters_json) VALUES " + values
+                + " ON DUPLICATE KEY UPDATE filter_hash = filter_hash", params)
+    cur.execute("SELECT filter_hash, id FROM snapshot_filters WHERE filter_hash IN ("
+                + ", ".join(["%s"] * len(unique)) + ")", list(unique))
+    ids = {bytes(h): i for h, i in cur.fetchall()}
+    return [ids[h] for h in hashes]
+
+# ---------------------------- distribución ----------------------------
+
+def encode_distribution(distribution: List[Dict[str, Any]]) -> Tuple[Optional[str], Optional[bytes]]:
+    """(JSON, None) si es chica; (None, zlib) si supera SNAPSHOT_COMPRESS_BYTES."""
+    text = json.dumps(distribution, default=str, separators=(",", ":"))
+    if len(text) <= config.SNAPSHOT_COMPRESS_BYTES:
+        return text, None
+    return None, zlib.compress(text.encode(), 6)
+
+def decode_distribution(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if row.get("distribution_gz") is not None:
+        return json.loads(zlib.decompress(row["distribution_gz"]))
+    raw = row.get("distribution_json")
+    return json.loads(raw) if raw else []
+
+# ---------------------------- escritura ----------------------------
+
+Item = Tuple[Dict[str, Optional[str]], Dict[str, Any]]  # (filtros normalizados, resumen de kpis.summarize + labels)
+
+def insert(conn, items: Sequence[Item], source: str, period: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Inserta los snapshots en una transacción: un INSERT de filtros y los
+    snapshots en INSERTs multi-fila de a _CHUNK. Con `period` se ignoran los
+    ya guardados para esa hora y filtros. Devuelve (primer id, filas insertadas).
+    """
+    if not items:
+        return 0, 0
+    cur = conn.cursor()
+    conn.start_transaction()
+    try:
+        filter_ids = _filter_ids(cur, [(f, s["labels"]) for f, s in items])
+        rows = []
+        for id_filters, (_, summary) in zip(filter_ids, items):
+            k = summary["kpis"]
+            dist_json, dist_gz = encode_distribution(summary["distribution"])
+            rows.append((source, period, id_filters, summary["totals"]["gestiones"], k["contactabilidad"],
+                         k["penetracion_bruta"], k["penetracion_neta"], dist_json, dist_gz))
+        first_id, inserted = 0, 0
+        for i in range(0, len(rows), _CHUNK):
+            chunk = rows[i:i + _CHUNK]
+            cur.execute(
+                f"INSERT {'IGNORE ' if period else ''}INTO dashboard_snapshots (source, period, id_filters, gestiones, "
+                "contactabilidad, penetracion_bruta, penetracion_neta, distribution_json, distribution_gz) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk)),
+                [v for row in chunk for v in row],
+            )
+            first_id = first_id or cur.lastrowid
+            inserted += cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return first_id, inserted
+
+def insert_client(conn, filters: Dict[str, Any], kpis_in: Dict[str, Any], distribution: List[Dict[str, Any]]) -> int:
+    """
+    Snapshot enviado por el frontend (modo anterior, sólo con SNAPSHOTS_CLIENT_KPIS=1):
+    se guarda tal cual, marcado como 'client' para distinguirlo de los calculados.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO dashboard_snapshots (filters_json, kpis_json, distribution_json, source, contactabilidad, "
+        "penetracion_bruta, penetracion_neta) VALUES (%s, %s, %s, 'client', %s, %s, %s)",
+        (json.dumps(filters), json.dumps(kpis_in), json.dumps(distribution), kpis_in.get("contactabilidad"),
+         kpis_in.get("penetracion_bruta"), kpis_in.get("penetracion_neta")),
+    )
+    snapshot_id = cur.lastrowid
+    cur.close()
+    return snapshot_id
+
+# ---------------------------- lectura ----------------------------
+
+_SUMMARY_COLS = """
+    s.id, s.created_at, s.source, s.period, s.gestiones,
+    s.contactabilidad, s.penetracion_bruta, s.penetracion_neta,
+    COALESCE(f.filters_json, s.filters_json) AS filters_json
+"""
+
+def list_page(conn, limit: int, after: Optional[Sequence[Any]], source: Optional[str]) -> List[Dict[str, Any]]:
+    """Campos resumidos, orden (created_at, id) DESC, keyset sobre el índice created_id. Pide limit + 1."""
+    where: List[str] = []
+    params: List[Any] = []
+    if source:
+        where.append("s.source = %s")
+        params.append(source)
+    if after:
+        clause, p = export.keyset_where(["s.created_at", "s.id"], after, desc=True)
+        where.append(clause)
+        params += p
+    cur = conn.cursor(dictionary=True)
+    cur.execute(f"""
+        /* snapshots.list */
+        SELECT {_SUMMARY_COLS}
+        FROM dashboard_snapshots s
+        LEFT JOIN snapshot_filters f ON f.id = s.id_filters
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    cur.close()
+    for r in rows:
+        f = json.loads(r.pop("filters_json") or "{}")
+        r.update({k: f.get(k) for k in ("start", "end", "campaign_label", "agent_label")})
+    return rows
+
+def get(conn, snapshot_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Un snapshot completo. Devuelve filters_json / kpis_json / distribution_json
+    como texto JSON (como antes), armados desde las columnas si hace falta.
+    """
+    cur = conn.cursor(dictionary=True)
+    cur.execute(f"""
+        /* snapshots.get */
+        SELECT {_SUMMARY_COLS}, s.kpis_json, s.distribution_json, s.distribution_gz
+        FROM dashboard_snapshots s
+        LEFT JOIN snapshot_filters f ON f.id = s.id_filters
+        WHERE s.id = %s
+    """, (snapshot_id,))
+    row = cur.fetchone()
+    cur.close()
+    if row is None:
+        return None
+    if row["kpis_json"] is None:
+        row["kpis_json"] = json.dumps({k: row[k] for k in ("contactabilidad", "penetracion_bruta", "penetracion_neta")},
+                                      default=str)
+    row["distribution_json"] = json.dumps(decode_distribution(row), default=str)
+    del row["distribution_gz"]
+    return row
+
+# ---------------------------- programados ----------------------------
+
+def previous_hour(now: Optional[datetime] = None) -> str:
+    return ((now or datetime.now()) - timedelta(hours=1)).strftime("%Y%m%d%H")
+
+def hourly(conn, hour: str) -> Dict[str, Any]:
+    """Un snapshot por campaña con gestiones en `hour` (YYYYMMDDhh), de una sola pasada agrupada."""
+    start, end = hour + "0000", hour + "5959"
+    dims = dimensions.get(conn)
+    rows = kpis.counts(conn, start, end, None, None)
+    index = kpis.RowIndex(rows)
+    items: List[Item] = []
+    for cid in sorted(index.by_campaign):
+        labels = {"campaign_label": dims.campaign_name(cid) or f"ID {cid}", "agent_label": None}
+        summary = {**kpis.summarize(index.select([cid], None)), "labels": labels}
+        items.append((normalize_filters(start, end, str(cid), None), summary))
+    _, inserted = insert(conn, items, "hourly", hour)
+    return {"hour": hour, "campaigns": len(items), "inserted": inserted}
+
+def _done(conn, hour: str) -> bool:
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM dashboard_snapshots WHERE source = 'hourly' AND period = %s LIMIT 1", (hour,))
+    found = cur.fetchone() is not None
+    cur.close()
+    return found
+
+def start_scheduler(connection, interval: float) -> Optional[threading.Event]:
+    """Cada `interval` segundos, si la hora anterior no tiene snapshots programados, los escribe."""
+    if interval <= 0 or not config.SNAPSHOTS_HOURLY:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            hour = previous_hour()
+            try:
+                with connection() as conn:
+                    if not _done(conn, hour):
+                        log.info("Snapshots programados: %s", hourly(conn, hour))
+            except Exception:
+                log.exception("Fallaron los snapshots programados de %s", hour)
+
+    threading.Thread(target=loop, name="snapshots-hourly", daemon=True).start()
+    return stop
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .db import connect
+
+    ap = argparse.ArgumentParser(prog="python -m backend.snapshots", description=__doc__.split("\n\n")[0])
+    ap.add_argument("command", choices=["hourly"])
+    ap.add_argument("--hour", help="YYYYMMDDhh (por defecto, la hora completa anterior)")
+    args = ap.parse_args(argv)
+
+    conn = connect()
+    try:
+        out = hourly(conn, args.hour or previous_hour())
+    finally:
+        conn.close()
+    print(json.dumps(out, indent=2, default=str))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
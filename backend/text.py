@@ -0,0 +1,15 @@
+import unicodedata
+
+def fold(s: str) -> str:
+    """
+    Normaliza texto para comparar como la collation utf8_spanish_ci:
+    sin mayúsculas ni tildes, pero manteniendo la ñ como letra propia.
+    """
+    out = []
+    for ch in unicodedata.normalize("NFD", s.casefold()):
+        if unicodedata.combining(ch):
+            if ch == "̃" and out and out[-1] == "n":
+                out[-1] = "ñ"
+            continue
+        out.append(ch)
+    return "".join(out)
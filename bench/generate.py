@@ -0,0 +1,247 @@
+"""
+Generador de datos sintéticos reproducible para pruebas de volumen.
+
+Agrega users, campaigns, telefonos, contactos y gestiones a continuación de
+los ids existentes, con sesgo realista:
+  - campañas "calientes" (Zipf): unas pocas concentran la mayoría de gestiones;
+  - agentes con mucha más actividad que otros (Zipf por campaña);
+  - mezcla de resultados típica de un call center (mayoría "No contesta");
+  - horario laboral, lunes a sábado, con picos a media mañana y media tarde.
+
+Con la misma semilla y los mismos parámetros genera exactamente los mismos datos.
+Sólo corre contra una base local (DB_HOST 127.0.0.1 / localhost / ::1).
+Al terminar reconstruye el rollup y el índice de teléfonos (si están
+habilitados), así un benchmark nunca lee datos derivados de otra generación.
+
+Uso:
+    python -m bench.generate --gestiones 5000000 --seed 42
+    python -m bench.generate --truncate --gestiones 2000000   # vacía las tablas antes
+"""
+import argparse
+import bisect
+import itertools
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Sequence
+
+import mysql.connector
+
+from backend import config, phones, rollup
+from backend.config import env
+from backend.db import connect
+
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+NOMBRES = ["Juan", "María", "Carlos", "Ana", "Pedro", "Lucía", "Jorge", "Sofía", "Martín", "Valentina",
+           "Diego", "Camila", "Andrés", "Florencia", "Nicolás", "Agustina", "Pablo", "Micaela", "Gonzalo", "Rocío"]
+APELLIDOS = ["Pérez", "González", "Rodríguez", "Fernández", "López", "Martínez", "García", "Sosa", "Silva",
+             "Núñez", "Méndez", "Castro", "Olivera", "Suárez", "Ramírez", "Díaz", "Acosta", "Benítez", "Peña", "Ibáñez"]
+RUBROS = ["Ventas", "Retención", "Cross Selling", "Cobranzas", "Encuestas", "Upgrade", "Fidelización", "Reactivación"]
+
+# id_resultado -> peso (ver gestiones_resultado en sql/01_base.sql)
+RESULTADOS = {3: 38, 4: 9, 2: 12, 10: 8, 5: 5, 6: 3, 7: 4, 9: 6, 1: 5, 8: 3, 11: 2, 12: 1, 13: 0.3, 14: 2, 15: 1, 16: 1.7}
+
+# peso por hora del día (8 a 21 hs)
+HORAS = {8: 3, 9: 7, 10: 10, 11: 10, 12: 6, 13: 4, 14: 6, 15: 9, 16: 10, 17: 8, 18: 6, 19: 4, 20: 2, 21: 1}
+
+def _require_local() -> None:
+    host = env("DB_HOST")
+    if host not in LOCAL_HOSTS:
+        sys.exit(f"Se rechaza DB_HOST={host}: el generador sólo corre contra una base local ({', '.join(sorted(LOCAL_HOSTS))})")
+
+def _sampler(rng: random.Random, items: Sequence, weights: Sequence[float]) -> Callable[[], object]:
+    cum = list(itertools.accumulate(weights))
+    total = cum[-1]
+    return lambda: items[bisect.bisect(cum, rng.random() * total)]
+
+def _zipf(n: int, s: float) -> List[float]:
+    return [1 / (k ** s) for k in range(1, n + 1)]
+
+def _next_id(cur, table: str) -> int:
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return int(cur.fetchone()[0])
+
+def _insert(conn, sql: str, rows: List[tuple]) -> None:
+    cur = conn.cursor()
+    cur.executemany(sql, rows)  # mysql-connector lo envía como un INSERT multi-fila
+    cur.close()
+
+def _batched(conn, sql: str, rows, batch: int) -> int:
+    buf: List[tuple] = []
+    n = 0
+    conn.start_transaction()
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= batch:
+            _insert(conn, sql, buf)
+            n += len(buf)
+            buf = []
+            if n % (batch * 20) == 0:
+                conn.commit()
+                conn.start_transaction()
+    if buf:
+        _insert(conn, sql, buf)
+        n += len(buf)
+    conn.commit()
+    return n
+
+# derivadas de las tablas generadas; --truncate también las vacía
+DERIVED = ("gestiones_rollup", "contacto_telefono", "dashboard_snapshots", "snapshot_filters")
+
+def _execute_if_table(cur, sql: str) -> None:
+    try:
+        cur.execute(sql)
+    except mysql.connector.errors.ProgrammingError as e:
+        if e.errno != 1146:  # tabla inexistente: la migración que la crea no se aplicó
+            raise
+
+def _truncate(cur) -> None:
+    for table in ("gestiones", "contactos", "telefonos", "campaigns", "users"):
+        cur.execute(f"DELETE FROM {table}")
+    for table in DERIVED:
+        _execute_if_table(cur, f"DELETE FROM {table}")
+    _execute_if_table(cur, "UPDATE rollup_state SET last_id = 0")
+    _execute_if_table(cur, "UPDATE contacto_telefono_state SET last_update = '1970-01-01 00:00:00'")
+
+def _rebuild_derived(conn) -> dict:
+    out = {}
+    if config.ROLLUP_ENABLED:
+        out["rollup"] = rollup.rebuild(conn)
+    if config.PHONE_INDEX_ENABLED:
+        out["phones"] = phones.rebuild(conn)
+    return out
+
+def generate(args) -> dict:
+    rng = random.Random(args.seed)
+    conn = connect()
+    cur = conn.cursor()
+    t0 = time.perf_counter()
+
+    if args.truncate:
+        _truncate(cur)
+
+    # ---------------------------- users ----------------------------
+    first_user = _next_id(cur, "users")
+    users = []
+    for i in range(args.users):
+        uid = first_user + i
+        nombre, apellido = rng.choice(NOMBRES), rng.choice(APELLIDOS)
+        users.append((uid, 1, 1, rng.randint(1, 3), rng.randint(1, 3), 10_000_000 + uid,
+                      nombre, apellido, f"{nombre[0].lower()}{apellido.lower()}{uid}", "x", 1))
+    _batched(conn, "INSERT INTO users (id, id_tipo, id_estado, id_grupo, id_categoria, ci, nombre, apellido, "
+                   "usuario, password, id_tipo_escala) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", users, args.batch)
+    user_ids = [u[0] for u in users]
+
+    # ---------------------------- campaigns ----------------------------
+    first_campaign = _next_id(cur, "campaigns")
+    campaigns = []
+    for i in range(args.campaigns):
+        cid = first_campaign + i
+        rubro = rng.choice(RUBROS)
+        campaigns.append((cid, rng.choice([1, 1, 1, 2, 3]), f"SYN{cid:06d}", f"{rubro} {cid}",
+                          f"Campaña sintética de {rubro.lower()}", "", 20240101, 20261231))
+    _batched(conn, "INSERT INTO campaigns (id, id_estado, codigo, nombre, descripcion, brokers, fc_inicio, fc_final) "
+                   "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)", campaigns, args.batch)
+    campaign_ids = [c[0] for c in campaigns]
+
+    # ---------------------------- telefonos + contactos ----------------------------
+    first_tel = _next_id(cur, "telefonos")
+    cur.execute("SELECT COALESCE(MAX(numero), 0) FROM telefonos")
+    base_numero = max(int(cur.fetchone()[0]) + 1, 20_000_000)
+    n_tel = args.contactos * 2
+    _batched(conn, "INSERT INTO telefonos (id, tipo, numero) VALUES (%s,%s,%s)",
+             ((first_tel + i, 1 if i % 2 == 0 else 2, base_numero + i) for i in range(n_tel)), args.batch)
+
+    first_contacto = _next_id(cur, "contactos")
+
+    def contactos():
+        for i in range(args.contactos):
+            cid = first_contacto + i
+            fijo, movil = first_tel + 2 * i, first_tel + 2 * i + 1
+            yield (cid, rng.randint(1, 5), cid, 1, 1, 30_000_000 + cid,
+                   rng.choice(NOMBRES), "", rng.choice(APELLIDOS), rng.choice(APELLIDOS),
+                   rng.randint(19500101, 20051231), rng.choice("MF"), "N",
+                   fijo, 0, movil, 0, "", rng.choice(user_ids), 1, 0, 20240101000000, 0)
+
+    _batched(conn, "INSERT INTO contactos (id, id_estado, id_domicilio, id_ocupacion, id_estado_civil, ci, nombre1, "
+                   "nombre2, apellido1, apellido2, fc_nacimiento, sexo, zurdo, id_tel_fijo1, id_tel_fijo2, "
+                   "id_tel_movil1, id_tel_movil2, email, id_userinsert, id_fuente_dato, se_queda, `timestamp`, mascota) "
+                   "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+             contactos(), args.batch)
+
+    # ---------------------------- gestiones ----------------------------
+    pick_campaign = _sampler(rng, campaign_ids, _zipf(len(campaign_ids), 1.1))
+    # cada campaña tiene su plantel de agentes, con algunos mucho más activos
+    staff = {}
+    for cid in campaign_ids:
+        team = rng.sample(user_ids, min(len(user_ids), rng.randint(5, 25)))
+        staff[cid] = _sampler(rng, team, _zipf(len(team), 0.8))
+    pick_resultado = _sampler(rng, list(RESULTADOS), list(RESULTADOS.values()))
+    pick_hora = _sampler(rng, list(HORAS), list(HORAS.values()))
+
+    end = datetime.strptime(args.end_date, "%Y%m%d")
+    days = [end - timedelta(days=d) for d in range(args.days - 1, -1, -1)]
+    days = [d for d in days if d.weekday() < 6]
+    # más actividad en los últimos 30 días; reparto entero que suma exactamente args.gestiones
+    weights = [1.5 if i >= len(days) - 30 else 1.0 for i in range(len(days))]
+    total_w = sum(weights)
+    per_day = [int(args.gestiones * w / total_w) for w in weights]
+    per_day[-1] += args.gestiones - sum(per_day)
+
+    first_gestion = _next_id(cur, "gestiones")
+
+    def gestiones():
+        # ids crecientes en orden cronológico, como en producción
+        gid = first_gestion
+        for day, count in zip(days, per_day):
+            stamps = sorted(
+                day.replace(hour=pick_hora(), minute=rng.randint(0, 59), second=rng.randint(0, 59))
+                for _ in range(count)
+            )
+            for ts in stamps:
+                cid = pick_campaign()
+                idx = rng.randrange(args.contactos)
+                yield (gid, 1, cid, staff[cid](), first_contacto + idx, pick_resultado(), "",
+                       ts.strftime("%Y%m%d%H%M%S"), first_tel + 2 * idx)
+                gid += 1
+
+    n = _batched(conn, "INSERT INTO gestiones (id, id_tipo, id_campaign, id_broker, id_contacto, id_resultado, "
+                       "notas, `timestamp`, id_tel_fijo1) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+                 gestiones(), args.batch)
+    cur.close()
+    derived = _rebuild_derived(conn)
+    conn.close()
+    return {
+        "seed": args.seed,
+        "users": args.users,
+        "campaigns": args.campaigns,
+        "telefonos": n_tel,
+        "contactos": args.contactos,
+        "gestiones": n,
+        **derived,
+        "seconds": round(time.perf_counter() - t0, 1),
+    }
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.generate", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--gestiones", type=int, default=2_000_000)
+    ap.add_argument("--contactos", type=int, default=200_000)
+    ap.add_argument("--users", type=int, default=300)
+    ap.add_argument("--campaigns", type=int, default=60)
+    ap.add_argument("--days", type=int, default=365, help="días hacia atrás desde --end-date")
+    ap.add_argument("--end-date", default="20251231", help="YYYYMMDD")
+    ap.add_argument("--batch", type=int, default=5000, help="filas por INSERT")
+    ap.add_argument("--truncate", action="store_true",
+                    help="vacía users/campaigns/telefonos/contactos/gestiones (y rollup, índice de teléfonos y snapshots) antes")
+    args = ap.parse_args(argv)
+
+    _require_local()
+    out = generate(args)
+    print(out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
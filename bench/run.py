@@ -0,0 +1,358 @@
+"""
+Benchmark de la API contra una base local generada con bench.generate.
+
+Arma una mezcla reproducible de requests (semilla fija) sobre todos los
+endpoints de lectura, con filtros muestreados de la propia base, y la
+dispara con N clientes concurrentes. El resultado es un JSON con, por
+endpoint: requests, errores, p50/p95/p99 y máximo en ms, throughput y tiempo
+de base de datos (header `Server-Timing: db;dur=...` si la API lo envía).
+Dos JSON de commits distintos se comparan con --compare.
+
+Uso:
+    uvicorn backend.main:app --port 8000 &
+    python -m bench.run --concurrency 16 --requests 5000 --out bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.run --endpoints kpis,series --duration 60
+    python -m bench.run --compare bench/results/antes.json bench/results/despues.json
+"""
+import argparse
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from backend.db import connect
+
+from .generate import LOCAL_HOSTS, _require_local
+
+# endpoint -> peso en la mezcla por defecto
+MIX = {
+    "kpis": 30,
+    "series": 10,
+    "rendimiento": 15,
+    "gestiones": 15,
+    "no_contesta": 5,
+    "contactos": 10,
+    "contactos_batch": 2,
+    "campaigns": 8,
+    "agents": 7,
+}
+
+_DB_TIMING = re.compile(r"(?:^|,)\s*db;(?:[^,]*;)?\s*dur=([\d.]+)")
+
+# ---------------------------- muestras de la base ----------------------------
+
+def sample_db(rng: random.Random, size: int = 500) -> Dict[str, Any]:
+    """Ids, textos y rango de fechas reales para armar filtros que devuelvan datos."""
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SELECT id, codigo, nombre FROM campaigns")
+    campaigns = cur.fetchall()
+    cur.execute("SELECT id, usuario, nombre, apellido FROM users")
+    users = cur.fetchall()
+    cur.execute("SELECT MIN(`timestamp`), MAX(`timestamp`), MIN(id), MAX(id) FROM gestiones")
+    ts_min, ts_max, id_min, id_max = cur.fetchone()
+    if not campaigns or not users or ts_min is None:
+        sys.exit("La base está vacía: generá datos con python -m bench.generate")
+
+    # filas al azar por rango de PK (sin ORDER BY RAND() sobre millones de filas)
+    def pick(sql: str, lo: int, hi: int) -> List[tuple]:
+        rows = []
+        for _ in range(size):
+            cur.execute(sql, (rng.randint(lo, hi),))
+            row = cur.fetchone()
+            if row:
+                rows.append(row)
+        return rows
+
+    cur.execute("SELECT MIN(id), MAX(id) FROM contactos")
+    c_min, c_max = cur.fetchone()
+    contactos = pick("SELECT co.ci, t.numero FROM contactos co JOIN telefonos t ON t.id = co.id_tel_fijo1 "
+                     "WHERE co.id >= %s ORDER BY co.id LIMIT 1", c_min, c_max) if c_min else []
+    brokers = pick("SELECT id_broker, LEFT(`timestamp`, 8) FROM gestiones WHERE id >= %s ORDER BY id LIMIT 1",
+                   id_min, id_max)
+    cur.close()
+    conn.close()
+    return {
+        "campaigns": campaigns,
+        "users": users,
+        "ts_min": str(ts_min)[:8],
+        "ts_max": str(ts_max)[:8],
+        "contactos": contactos,
+        "brokers": brokers,
+    }
+
+# ---------------------------- mezcla de requests ----------------------------
+
+def _date_range(rng: random.Random, s: Dict[str, Any]) -> Tuple[str, str]:
+    lo = datetime.strptime(s["ts_min"], "%Y%m%d")
+    hi = datetime.strptime(s["ts_max"], "%Y%m%d")
+    span = max((hi - lo).days, 0)
+    days = rng.choice([1, 1, 7, 7, 30, 30, 90, 365])
+    start = hi - timedelta(days=rng.randint(0, span)) if rng.random() < 0.3 else hi - timedelta(days=days - 1)
+    start = max(lo, start)
+    end = min(hi, start + timedelta(days=days - 1))
+    return start.strftime("%Y%m%d") + "000000", end.strftime("%Y%m%d") + "235959"
+
+def _campaign_token(rng: random.Random, s: Dict[str, Any]) -> str:
+    cid, codigo, nombre = rng.choice(s["campaigns"])
+    return rng.choice([str(cid), str(cid), codigo, nombre.split()[0]])
+
+def _agent_token(rng: random.Random, s: Dict[str, Any]) -> str:
+    uid, usuario, nombre, apellido = rng.choice(s["users"])
+    return rng.choice([str(uid), str(uid), usuario, f"{nombre} {apellido}"])
+
+def build_request(endpoint: str, rng: random.Random, s: Dict[str, Any]) -> Tuple[str, Optional[bytes]]:
+    """(path, cuerpo JSON) del request; cuerpo None = GET."""
+    q: Dict[str, Any] = {}
+    if endpoint == "kpis":
+        if rng.random() < 0.9:
+            q["start"], q["end"] = _date_range(rng, s)
+        if rng.random() < 0.5:
+            q["campaign_id"] = _campaign_token(rng, s)
+        if rng.random() < 0.2:
+            q["agent_id"] = _agent_token(rng, s)
+        return "/api/kpis?" + urlencode(q), None
+    if endpoint == "series":
+        q["start"], q["end"] = _date_range(rng, s)
+        q["granularity"] = rng.choice(["hour", "day", "day", "week"])
+        if rng.random() < 0.3:
+            q["split"] = rng.choice(["campaign", "broker"])
+        if rng.random() < 0.4:
+            q["campaign_id"] = _campaign_token(rng, s)
+        return "/api/kpis/series?" + urlencode(q), None
+    if endpoint == "rendimiento":
+        if rng.random() < 0.8:
+            q["start"], q["end"] = _date_range(rng, s)
+        if rng.random() < 0.3:
+            q["campaign_id"] = rng.choice(s["campaigns"])[0]
+        q["limit"] = rng.choice([50, 100, 500])
+        return "/api/consultas/rendimiento?" + urlencode(q), None
+    if endpoint == "gestiones":
+        broker, day = rng.choice(s["brokers"])
+        q = {"operator_id": broker, "date": day, "limit": rng.choice([50, 100, 1000])}
+        return "/api/consultas/gestiones?" + urlencode(q), None
+    if endpoint == "no_contesta":
+        q = {"campaign_id": rng.choice(s["campaigns"])[0], "limit": rng.choice([100, 1000])}
+        return "/api/consultas/no_contesta?" + urlencode(q), None
+    if endpoint == "contactos":
+        ci, numero = rng.choice(s["contactos"])
+        q = {"telefono": numero} if rng.random() < 0.6 else {"ci": ci}
+        return "/api/consultas/contactos?" + urlencode(q), None
+    if endpoint == "contactos_batch":
+        picks = rng.sample(s["contactos"], min(len(s["contactos"]), rng.choice([50, 200, 500])))
+        # formatos variados para ejercitar la normalización
+        telefonos = [rng.choice(["{}", "0{}", "+598 {}", "00598{}"]).format(n) for _, n in picks[::2]]
+        body = {"telefonos": telefonos, "cis": [ci for ci, _ in picks[1::2]]}
+        return "/api/consultas/contactos/batch", json.dumps(body).encode()
+    if endpoint == "campaigns":
+        _, _, nombre = rng.choice(s["campaigns"])
+        return "/api/campaigns?" + urlencode({"q": nombre[:rng.randint(1, 5)], "limit": 10}), None
+    if endpoint == "agents":
+        _, _, nombre, apellido = rng.choice(s["users"])
+        return "/api/agents?" + urlencode({"q": rng.choice([nombre, apellido])[:rng.randint(1, 5)], "limit": 10}), None
+    raise ValueError(f"endpoint desconocido: {endpoint}")
+
+def request_stream(seed: int, endpoints: List[str], s: Dict[str, Any]) -> Iterator[Tuple[str, str, Optional[bytes]]]:
+    """Secuencia infinita y determinística de (endpoint, path, cuerpo)."""
+    rng = random.Random(seed)
+    weights = [MIX[e] for e in endpoints]
+    while True:
+        endpoint = rng.choices(endpoints, weights)[0]
+        yield (endpoint,) + build_request(endpoint, rng, s)
+
+# ---------------------------- ejecución ----------------------------
+
+def _call(url: str, body: Optional[bytes], timeout: float) -> Tuple[int, int, Optional[float]]:
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"} if body else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            status, timing = resp.status, resp.headers.get("Server-Timing")
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status, timing = e.code, e.headers.get("Server-Timing")
+    m = _DB_TIMING.search(timing or "")
+    return status, len(body), float(m.group(1)) if m else None
+
+def _percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[k], 2)
+
+def run(base_url: str, requests: Iterator[Tuple[str, str, Optional[bytes]]], concurrency: int,
+        total: Optional[int], duration: Optional[float], timeout: float) -> Dict[str, Any]:
+    lock = threading.Lock()
+    samples: Dict[str, List[Tuple[float, int, int, Optional[float]]]] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_request() -> Optional[Tuple[str, str, Optional[bytes]]]:
+        nonlocal issued
+        with lock:
+            if total is not None and issued >= total:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            issued += 1
+            return next(requests)
+
+    def worker() -> None:
+        while True:
+            item = next_request()
+            if item is None:
+                return
+            endpoint, path, body = item
+            t0 = time.perf_counter()
+            try:
+                status, size, db_ms = _call(base_url + path, body, timeout)
+            except Exception as e:
+                with lock:
+                    errors[endpoint][type(e).__name__] += 1
+                continue
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                if status >= 400:
+                    errors[endpoint][str(status)] += 1
+                else:
+                    samples[endpoint].append((ms, status, size, db_ms))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        for _ in range(concurrency):
+            ex.submit(worker)
+    elapsed = time.perf_counter() - t0
+
+    report: Dict[str, Any] = {}
+    for endpoint in sorted(set(samples) | set(errors)):
+        rows = samples.get(endpoint, [])
+        lat = sorted(r[0] for r in rows)
+        db = sorted(r[3] for r in rows if r[3] is not None)
+        report[endpoint] = {
+            "requests": len(rows) + sum(errors[endpoint].values()),
+            "errors": dict(errors[endpoint]),
+            "rps": round(len(rows) / elapsed, 2) if elapsed else None,
+            "p50_ms": _percentile(lat, 50),
+            "p95_ms": _percentile(lat, 95),
+            "p99_ms": _percentile(lat, 99),
+            "max_ms": round(lat[-1], 2) if lat else None,
+            "db_p50_ms": _percentile(db, 50),
+            "db_p95_ms": _percentile(db, 95),
+            "db_total_ms": round(sum(db), 1) if db else None,
+            "bytes_avg": int(sum(r[2] for r in rows) / len(rows)) if rows else None,
+        }
+    ok = sum(len(v) for v in samples.values())
+    return {"elapsed_s": round(elapsed, 2), "requests_ok": ok,
+            "throughput_rps": round(ok / elapsed, 2) if elapsed else None, "endpoints": report}
+
+def _json(url: str) -> Optional[Any]:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as resp:
+            return json.loads(resp.read())
+    except Exception:
+        return None
+
+def _git_head() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+# ---------------------------- comparación ----------------------------
+
+_COMPARE = ("rps", "p50_ms", "p95_ms", "p99_ms", "db_p95_ms")
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'endpoint':<16}" + "".join(f"{m:>26}" for m in _COMPARE))
+    for endpoint in sorted(set(old["results"]["endpoints"]) | set(new["results"]["endpoints"])):
+        a = old["results"]["endpoints"].get(endpoint, {})
+        b = new["results"]["endpoints"].get(endpoint, {})
+        cells = []
+        for m in _COMPARE:
+            x, y = a.get(m), b.get(m)
+            if x is None or y is None:
+                cells.append(f"{'-':>26}")
+                continue
+            delta = f"{(y - x) / x * 100:+.1f}%" if x else "n/a"
+            cells.append(f"{f'{x} -> {y} ({delta})':>26}")
+        print(f"{endpoint:<16}" + "".join(cells))
+
+# ---------------------------- CLI ----------------------------
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=2000, help="total de requests (se ignora con --duration)")
+    ap.add_argument("--duration", type=float, help="segundos de carga en vez de un total fijo")
+    ap.add_argument("--endpoints", default=",".join(MIX), help="subconjunto separado por comas")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--warmup", type=int, default=0, help="requests previos que no se miden")
+    ap.add_argument("--out", help="archivo JSON de salida (por defecto stdout)")
+    ap.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"))
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    host = urlsplit(args.url).hostname
+    if host not in LOCAL_HOSTS:
+        sys.exit(f"Se rechaza {args.url}: el benchmark sólo corre contra una API local")
+    _require_local()
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in MIX]
+    if unknown:
+        sys.exit(f"Endpoints desconocidos: {', '.join(unknown)} (válidos: {', '.join(MIX)})")
+
+    s = sample_db(random.Random(args.seed))
+    base = args.url.rstrip("/")
+    if args.warmup:
+        run(base, request_stream(args.seed + 1, endpoints, s), args.concurrency, args.warmup, None, args.timeout)
+
+    before = _json(base + "/api/health/cache")
+    results = run(base, request_stream(args.seed, endpoints, s), args.concurrency,
+                  None if args.duration else args.requests, args.duration, args.timeout)
+    out = {
+        "meta": {
+            "git": _git_head(),
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": None if args.duration else args.requests,
+            "duration": args.duration,
+            "endpoints": endpoints,
+            "seed": args.seed,
+            "warmup": args.warmup,
+        },
+        "results": results,
+        "cache": {"before": before, "after": _json(base + "/api/health/cache")},
+        "pool": _json(base + "/api/health/pool"),
+    }
+    text = json.dumps(out, indent=2, ensure_ascii=False, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -140,6 +140,46 @@ function render(data){
   });
 }
 
+// ======================== EN VIVO (SSE) ==========================
+let liveSource = null;
+
+function pct2(a, b){ return b ? Math.round(10000 * a / b) / 100 : 0; }
+
+function renderLive(state){
+  const ef = new Set(state.efectivos), ex = new Set(state.exitosos);
+  let total = 0, efectivas = 0, exitosas = 0;
+  const distribution = [];
+  for(const [r, n] of Object.entries(state.counts)){
+    const id = Number(r);
+    total += n;
+    if(ef.has(id)) efectivas += n;
+    if(ex.has(id)) exitosas += n;
+    if(state.names[r]) distribution.push({ resultado: state.names[r], cantidad: n });
+  }
+  distribution.sort((a, b) => b.cantidad - a.cantidad);
+  const kpis = {
+    contactabilidad: pct2(efectivas, total),
+    penetracion_bruta: pct2(exitosas, total),
+    penetracion_neta: pct2(exitosas, efectivas)
+  };
+  if(window.__lastKPIs){ window.__lastKPIs.kpis = kpis; window.__lastKPIs.distribution = distribution; }
+  render({ kpis, distribution });
+}
+
+function startLive(qs){
+  if(liveSource) liveSource.close();
+  if(typeof EventSource === 'undefined') return;
+  let state = null;
+  liveSource = new EventSource(`${API}/api/kpis/stream${qs ? `?${qs}` : ''}`);
+  liveSource.addEventListener('init', e => { state = JSON.parse(e.data); });
+  liveSource.addEventListener('delta', e => {
+    if(!state) return;
+    const d = JSON.parse(e.data);
+    for(const [r, n] of Object.entries(d.delta)) state.counts[r] = (state.counts[r] || 0) + n;
+    renderLive(state);
+  });
+}
+
 // ======================== API CALLS ==============================
 async function fetchKPIs(){
   console.log('[DBG] click Aplicar');
@@ -166,6 +206,7 @@ async function fetchKPIs(){
     const data = JSON.parse(txt);
     window.__lastKPIs = data;
     render(data);
+    startLive(qs.toString());
   }catch(e){
     alert('Error al obtener KPIs:\n' + (e?.message || e));
   }finally{
@@ -178,11 +219,8 @@ async function saveSnapshot(){
   const btn = $('#btnSave'); const backup = btn.textContent;
   btn.textContent='Guardando…'; btn.disabled=true;
   try{
-    const payload = {
-      filters: window.__lastKPIs.filters,
-      kpis: window.__lastKPIs.kpis,
-      distribution: window.__lastKPIs.distribution
-    };
+    // Sólo los filtros: el servidor recalcula KPIs y distribución
+    const payload = { filters: window.__lastKPIs.filters };
     const res = await fetch(`${API}/api/snapshots`,{
       method:'POST',
       headers:{'Content-Type':'application/json'},
@@ -205,13 +243,14 @@ async function listSnapshots(){
     const rows = await res.json();
     const wrap = $('#snapshots'); wrap.innerHTML = '';
     (rows||[]).forEach(r=>{
-      let k={}; try{ k = JSON.parse(r.kpis_json||'{}'); }catch{}
+      const k = r;  // el listado trae los KPIs en columnas
       const when = r.created_at ? new Date(r.created_at).toLocaleString() : '';
+      const label = [r.campaign_label, r.agent_label].filter(Boolean).join(' · ');
       const card = document.createElement('div'); card.className = 'item';
       card.innerHTML = `
         <div>
           <div style="font-weight:700">Snapshot #${r.id}</div>
-          <div class="meta">${when}</div>
+          <div class="meta">${when}${label ? ' — ' + label : ''}</div>
         </div>
         <div style="display:flex;gap:8px;flex-wrap:wrap;align-items:center">
           <span class="pill">Ctc <strong>${k.contactabilidad ?? '-' }%</strong></span>
@@ -0,0 +1,23 @@
+-- Rollup horario de gestiones para KPIs (ver backend/rollup.py)
+-- bucket = LEFT(gestiones.timestamp, 10) -> YYYYMMDDhh
+-- ROLLUP_ENABLED está activo por defecto: la API necesita estas tablas
+-- (o ROLLUP_ENABLED=0 en .env para consultar sólo gestiones).
+CREATE TABLE IF NOT EXISTS gestiones_rollup (
+  bucket CHAR(10) NOT NULL,
+  id_campaign INT NOT NULL,
+  id_broker INT NOT NULL,
+  id_resultado INT NOT NULL,
+  cantidad INT UNSIGNED NOT NULL,
+  PRIMARY KEY (bucket, id_campaign, id_broker, id_resultado),
+  KEY id_campaign (id_campaign, bucket),
+  KEY id_broker (id_broker, bucket)
+);
+
+-- Marca de agua: último gestiones.id ya volcado al rollup
+CREATE TABLE IF NOT EXISTS rollup_state (
+  nombre VARCHAR(32) NOT NULL PRIMARY KEY,
+  last_id INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO rollup_state (nombre, last_id) VALUES ('gestiones', 0);
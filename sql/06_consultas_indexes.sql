@@ -0,0 +1,9 @@
+-- Índices para la paginación keyset de /api/consultas/*
+-- gestiones de un operador en un día, ordenadas por (timestamp, id)
+ALTER TABLE gestiones ADD KEY broker_timestamp (id_broker, `timestamp`, id);
+
+-- contactos "No contesta" de una campaña
+ALTER TABLE gestiones ADD KEY campaign_resultado (id_campaign, id_resultado, id_contacto);
+
+-- orden por apellido1, nombre1, id
+ALTER TABLE contactos ADD KEY apellido_nombre (apellido1, nombre1, id);
@@ -0,0 +1,23 @@
+-- Índice inverso teléfono -> contacto (ver backend/phones.py)
+-- Una fila por cada id_tel_* de contactos que apunte a un teléfono existente.
+-- slot: 1 = id_tel_fijo1, 2 = id_tel_fijo2, 3 = id_tel_movil1, 4 = id_tel_movil2
+CREATE TABLE IF NOT EXISTS contacto_telefono (
+  numero_normalizado BIGINT UNSIGNED NOT NULL,
+  id_contacto INT UNSIGNED NOT NULL,
+  slot TINYINT NOT NULL,
+  PRIMARY KEY (numero_normalizado, id_contacto, slot),
+  KEY id_contacto (id_contacto)
+);
+
+-- Marca de agua: contactos con lastupdate anterior a esto ya están en el índice
+CREATE TABLE IF NOT EXISTS contacto_telefono_state (
+  nombre VARCHAR(32) NOT NULL PRIMARY KEY,
+  last_update DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00',
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO contacto_telefono_state (nombre) VALUES ('contactos');
+
+-- Refresco incremental por lastupdate y búsqueda por documento
+ALTER TABLE contactos ADD KEY lastupdate (lastupdate);
+ALTER TABLE contactos ADD KEY ci (ci);
@@ -0,0 +1,32 @@
+-- Snapshots calculados en el servidor (ver backend/snapshots.py)
+
+-- Cada combinación de filtros normalizada se guarda una sola vez
+CREATE TABLE IF NOT EXISTS snapshot_filters (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  filter_hash BINARY(20) NOT NULL,            -- SHA-1 de los filtros normalizados
+  filters_json JSON NOT NULL,                 -- filtros + labels legibles
+  UNIQUE KEY filter_hash (filter_hash)
+);
+
+-- KPIs en columnas (el listado no lee JSON) y distribución comprimida si es grande.
+-- Las filas viejas (source = 'client') conservan sus JSON.
+ALTER TABLE dashboard_snapshots
+  MODIFY filters_json JSON NULL,
+  MODIFY kpis_json JSON NULL,
+  MODIFY distribution_json JSON NULL,
+  ADD COLUMN source VARCHAR(16) NOT NULL DEFAULT 'client',  -- client | server | hourly
+  ADD COLUMN period CHAR(10) NULL,                          -- YYYYMMDDhh de los snapshots programados
+  ADD COLUMN id_filters INT NULL,                           -- FK hacia snapshot_filters.id
+  ADD COLUMN gestiones INT UNSIGNED NULL,
+  ADD COLUMN contactabilidad DECIMAL(6,2) NULL,
+  ADD COLUMN penetracion_bruta DECIMAL(6,2) NULL,
+  ADD COLUMN penetracion_neta DECIMAL(6,2) NULL,
+  ADD COLUMN distribution_gz MEDIUMBLOB NULL,               -- zlib del JSON de distribución
+  ADD KEY created_id (created_at, id),                      -- listado keyset (created_at, id) DESC
+  ADD UNIQUE KEY scheduled (source, period, id_filters);    -- un programado por hora y filtros
+
+UPDATE dashboard_snapshots
+SET contactabilidad = NULLIF(JSON_UNQUOTE(JSON_EXTRACT(kpis_json, '$.contactabilidad')), 'null'),
+    penetracion_bruta = NULLIF(JSON_UNQUOTE(JSON_EXTRACT(kpis_json, '$.penetracion_bruta')), 'null'),
+    penetracion_neta = NULLIF(JSON_UNQUOTE(JSON_EXTRACT(kpis_json, '$.penetracion_neta')), 'null')
+WHERE kpis_json IS NOT NULL;
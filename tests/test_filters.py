@@ -0,0 +1,35 @@
+"""Los tokens de campaña/agente con la misma clave de cache tienen que resolver los mismos filtros."""
+import pytest
+
+from backend import cache, dimensions
+from backend.main import _resolve_filters
+
+DIMS = dimensions.Dimensions(
+    campaigns=[{"id": 5, "codigo": "VTA", "nombre": "Ventas"}, {"id": 15, "codigo": "RET", "nombre": "Retención 5"}],
+    users=[{"id": 7, "usuario": "jperez", "nombre": "Juan", "apellido": "Pérez", "nombre_completo": "Juan Pérez"}],
+    resultados=[],
+    version=1,
+)
+
+@pytest.mark.parametrize("a, b", [
+    (" 5", "5"),
+    ("5 ", "05"),
+    ("  ", None),
+    ("", None),
+    (" ventas ", "ventas"),
+])
+def test_same_key_same_filters(a, b):
+    assert cache.filter_key(None, None, a, a) == cache.filter_key(None, None, b, b)
+    assert _resolve_filters(DIMS, a, a) == _resolve_filters(DIMS, b, b)
+
+def test_text_case_gets_its_own_key():
+    # sin coincidencias el label es el texto recibido: no pueden compartir entrada de cache
+    assert cache.filter_key(None, None, "Nada", None) != cache.filter_key(None, None, "nada", None)
+
+def test_padded_id_is_not_a_text_search():
+    campaign_ids, broker_ids, labels = _resolve_filters(DIMS, " 5", " 7")
+    assert campaign_ids == [5] and broker_ids == [7]
+    assert labels == {"campaign_label": "Ventas", "agent_label": "Juan Pérez"}
+
+def test_blank_token_is_no_filter():
+    assert _resolve_filters(DIMS, "   ", "\t") == (None, None, {"campaign_label": None, "agent_label": None})
@@ -0,0 +1,20 @@
+"""El cuerpo de la carga masiva se parte sólo en "\n": otros separadores dentro de notas no cortan el registro."""
+import json
+
+import pytest
+
+from backend import ingest
+
+@pytest.mark.parametrize("sep", ["\r", " ", "\u0085", "\x1c", "\x0b", "\x0c"])
+def test_ndjson_notas_with_separator(sep):
+    raw = '{"id_campaign": 1, "notas": "antes%sdespués"}' % sep
+    text = raw + "\n" + json.dumps({"id_campaign": 2}) + "\r\n"
+    recs = list(ingest.records(ingest.split_lines(text), "ndjson"))
+    assert [n for n, _ in recs] == [1, 2]
+    assert recs[0][1] == {"id_campaign": 1, "notas": f"antes{sep}después"}
+    assert recs[1][1] == {"id_campaign": 2}
+
+def test_csv_quoted_newline_and_cr():
+    text = 'id_campaign,notas\r\n1,"uno\r\ndos\rtres"\r\n2,x\r\n'
+    recs = [rec for _, rec in ingest.records(ingest.split_lines(text), "csv")]
+    assert recs == [{"id_campaign": "1", "notas": "uno\r\ndos\rtres"}, {"id_campaign": "2", "notas": "x"}]